@@ -10,6 +10,8 @@ import io
 import os
 import ssl
 
+from platform_annotation import load_probe_annotation
+
 print("=" * 60)
 print("Annotating DE Probes via BioMart")
 print("=" * 60 + "\n")
@@ -34,8 +36,6 @@ print(f"Significant probes (FDR < 0.1): {len(sig_probes)}")
 # 2. Query BioMart for Illumina probe annotation
 # =============================================================================
 
-print("\nQuerying Ensembl BioMart for probe annotations...")
-
 # BioMart XML query for Illumina HumanHT-12 v4 probes
 # Note: DASL probes may map to HT-12 v4 probe IDs
 base_url = "http://www.ensembl.org/biomart/martservice"
@@ -51,37 +51,46 @@ xml_query = '''<?xml version="1.0" encoding="UTF-8"?>
     </Dataset>
 </Query>'''
 
-try:
-    data = urllib.parse.urlencode({'query': xml_query}).encode('utf-8')
-    req = urllib.request.Request(base_url, data=data)
-
-    print("Fetching from Ensembl BioMart...")
-    with urllib.request.urlopen(req, timeout=120, context=ssl_context) as response:
-        result = response.read().decode('utf-8')
-
-        if result and len(result) > 100:
-            # Parse result
-            df = pd.read_csv(io.StringIO(result), sep='\t')
-            print(f"Retrieved {len(df)} probe-gene mappings")
-            print(f"Columns: {list(df.columns)}")
-
-            # Rename columns
-            if len(df.columns) >= 2:
-                df.columns = ['Probe', 'Gene_Symbol', 'Ensembl_ID'][:len(df.columns)]
-                df = df.dropna(subset=['Probe', 'Gene_Symbol'])
-                df = df[df['Gene_Symbol'] != '']
-
-                # Save annotation
-                annot_file = os.path.join(lacy_dir, "GPL14951_biomart_annotation.csv")
-                df.to_csv(annot_file, index=False)
-                print(f"Saved: {annot_file}")
-        else:
-            print("No results from BioMart query")
-            df = None
-
-except Exception as e:
-    print(f"BioMart query failed: {e}")
-    df = None
+# The local GPL14951 platform table (platform_annotation.py) covers symbols and
+# Entrez IDs; BioMart is only needed when it carries no Ensembl IDs
+annot_df = load_probe_annotation(lacy_dir)
+df = None
+if annot_df is not None and 'Ensembl_ID' in annot_df.columns and annot_df['Ensembl_ID'].notna().any():
+    print("Local GPL14951 annotation has Ensembl IDs - skipping BioMart query")
+    df = annot_df
+else:
+    print("\nQuerying Ensembl BioMart for probe annotations...")
+    try:
+        data = urllib.parse.urlencode({'query': xml_query}).encode('utf-8')
+        req = urllib.request.Request(base_url, data=data)
+
+        print("Fetching from Ensembl BioMart...")
+        with urllib.request.urlopen(req, timeout=120, context=ssl_context) as response:
+            result = response.read().decode('utf-8')
+
+            if result and len(result) > 100:
+                # Parse result
+                df = pd.read_csv(io.StringIO(result), sep='\t')
+                print(f"Retrieved {len(df)} probe-gene mappings")
+                print(f"Columns: {list(df.columns)}")
+
+                # Rename columns
+                if len(df.columns) >= 2:
+                    df.columns = ['Probe', 'Gene_Symbol', 'Ensembl_ID'][:len(df.columns)]
+                    df = df.dropna(subset=['Probe', 'Gene_Symbol'])
+                    df = df[df['Gene_Symbol'] != '']
+
+                    # Save annotation
+                    annot_file = os.path.join(lacy_dir, "GPL14951_biomart_annotation.csv")
+                    df.to_csv(annot_file, index=False)
+                    print(f"Saved: {annot_file}")
+            else:
+                print("No results from BioMart query")
+                df = None
+
+    except Exception as e:
+        print(f"BioMart query failed: {e}")
+        df = None
 
 # =============================================================================
 # 3. Alternative: Parse from supplementary data if available
@@ -109,10 +118,8 @@ print("\n" + "=" * 60)
 print("ANALYSIS WITH AVAILABLE ANNOTATION")
 print("=" * 60 + "\n")
 
-# Load the partial annotation we created earlier
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
+# Local GPL14951 annotation (SOFT platform table, or the older CSV)
+if annot_df is not None:
 
     # Merge with DE results
     de_annotated = de_results.merge(annot_df, on='Probe', how='left')
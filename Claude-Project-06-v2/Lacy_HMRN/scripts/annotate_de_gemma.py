@@ -10,6 +10,8 @@ import os
 import time
 import ssl
 
+from platform_annotation import load_probe_annotation
+
 # Disable SSL verification (for Gemma API)
 ssl_context = ssl.create_default_context()
 ssl_context.check_hostname = False
@@ -39,69 +41,75 @@ top_probes = de_results[de_results['P_value'] < 0.05]['Probe'].tolist()
 print(f"Probes with p < 0.05: {len(top_probes)}\n")
 
 # =============================================================================
-# 2. Fetch Annotations from Gemma API
+# 2. Load Annotations (local GPL14951 SOFT file, Gemma API fallback)
 # =============================================================================
 
-print("Fetching annotations from Gemma API...")
-print("(This may take a minute - fetching in batches)\n")
-
-base_url = "https://gemma.msl.ubc.ca/rest/v2/platforms/GPL14951/elements"
+# Local GPL14951 SOFT annotation first; Gemma is only queried without it
+annot_df = load_probe_annotation(lacy_dir)
 all_annotations = []
 
-# Fetch in batches (Gemma API supports pagination)
-offset = 0
-limit = 5000  # Max per request
-total_fetched = 0
+if annot_df is None:
+    print("Fetching annotations from Gemma API...")
+    print("(This may take a minute - fetching in batches)\n")
+
+    base_url = "https://gemma.msl.ubc.ca/rest/v2/platforms/GPL14951/elements"
 
-while True:
-    url = f"{base_url}?offset={offset}&limit={limit}"
+    # Fetch in batches (Gemma API supports pagination)
+    offset = 0
+    limit = 5000  # Max per request
+    total_fetched = 0
 
-    try:
-        req = urllib.request.Request(url)
-        req.add_header('Accept', 'application/json')
+    while True:
+        url = f"{base_url}?offset={offset}&limit={limit}"
 
-        with urllib.request.urlopen(req, timeout=60, context=ssl_context) as response:
-            data = json.loads(response.read().decode('utf-8'))
+        try:
+            req = urllib.request.Request(url)
+            req.add_header('Accept', 'application/json')
 
-            if 'data' in data:
-                elements = data['data']
-            else:
-                elements = data
+            with urllib.request.urlopen(req, timeout=60, context=ssl_context) as response:
+                data = json.loads(response.read().decode('utf-8'))
 
-            if not elements or len(elements) == 0:
-                break
+                if 'data' in data:
+                    elements = data['data']
+                else:
+                    elements = data
 
-            for elem in elements:
-                probe_id = elem.get('name', '')
-                gene_symbol = elem.get('description', '').strip()
+                if not elements or len(elements) == 0:
+                    break
 
-                if probe_id and gene_symbol:
-                    all_annotations.append({
-                        'Probe': probe_id,
-                        'Gene_Symbol': gene_symbol
-                    })
+                for elem in elements:
+                    probe_id = elem.get('name', '')
+                    gene_symbol = elem.get('description', '').strip()
 
-            total_fetched += len(elements)
-            print(f"  Fetched {total_fetched} probes...", end='\r')
+                    if probe_id and gene_symbol:
+                        all_annotations.append({
+                            'Probe': probe_id,
+                            'Gene_Symbol': gene_symbol
+                        })
 
-            # Check if we got fewer than limit (end of data)
-            if len(elements) < limit:
-                break
+                total_fetched += len(elements)
+                print(f"  Fetched {total_fetched} probes...", end='\r')
 
-            offset += limit
-            time.sleep(0.5)  # Be nice to the API
+                # Check if we got fewer than limit (end of data)
+                if len(elements) < limit:
+                    break
 
-    except Exception as e:
-        print(f"\nError fetching offset {offset}: {e}")
-        break
+                offset += limit
+                time.sleep(0.5)  # Be nice to the API
 
-print(f"\nTotal annotations fetched: {len(all_annotations)}")
+        except Exception as e:
+            print(f"\nError fetching offset {offset}: {e}")
+            break
+
+    print(f"\nTotal annotations fetched: {len(all_annotations)}")
+else:
+    print(f"Loaded local GPL14951 annotation: {len(annot_df)} probes")
 
 # =============================================================================
 # 3. Create Annotation DataFrame
 # =============================================================================
 
-if len(all_annotations) > 0:
+if annot_df is None and len(all_annotations) > 0:
     annot_df = pd.DataFrame(all_annotations)
     annot_df = annot_df.drop_duplicates(subset=['Probe'])
 
@@ -112,6 +120,8 @@ if len(all_annotations) > 0:
     annot_df.to_csv(annot_file, index=False)
     print(f"Saved annotation: {annot_file}\n")
 
+if annot_df is not None:
+
     # =============================================================================
     # 4. Merge Annotation with DE Results
     # =============================================================================
@@ -262,7 +272,7 @@ if len(all_annotations) > 0:
     print(f"  - Advanced-high: {len(advanced_high)}")
 
 else:
-    print("Failed to fetch annotations - showing probe IDs only")
+    print("No annotation available - showing probe IDs only")
     print("\nTop 30 DE Probes:")
     for idx, row in de_results.head(30).iterrows():
         direction = "^" if row['Direction'] == "Advanced-high" else "v"
@@ -4,11 +4,10 @@ Uses GPL14951 (Illumina DASL) platform annotation
 """
 
 import pandas as pd
-import urllib.request
-import gzip
-import io
 import os
 
+from platform_annotation import load_probe_annotation
+
 print("=" * 60)
 print("Annotating DE Probes with Gene Symbols")
 print("=" * 60 + "\n")
@@ -27,69 +26,18 @@ print(f"FDR < 0.1: {(de_results['FDR'] < 0.1).sum()}")
 print(f"P < 0.01: {(de_results['P_value'] < 0.01).sum()}\n")
 
 # =============================================================================
-# 2. Download GPL14951 Annotation
-# =============================================================================
-
-print("Downloading GPL14951 annotation...")
-
-# Use the SOFT format which is more parseable
-gpl_url = "https://ftp.ncbi.nlm.nih.gov/geo/platforms/GPL14nnn/GPL14951/soft/GPL14951_family.soft.gz"
-
-try:
-    with urllib.request.urlopen(gpl_url, timeout=120) as response:
-        print("Downloaded GPL annotation file")
-
-        # Decompress and parse
-        content = gzip.decompress(response.read()).decode('utf-8', errors='ignore')
-        lines = content.split('\n')
-
-        # Find the table section
-        table_start = None
-        table_end = None
-        for i, line in enumerate(lines):
-            if line.startswith("!platform_table_begin"):
-                table_start = i + 1
-            elif line.startswith("!platform_table_end"):
-                table_end = i
-                break
-
-        if table_start and table_end:
-            print(f"Found annotation table: lines {table_start} to {table_end}")
-
-            # Parse table
-            table_content = '\n'.join(lines[table_start:table_end])
-            annot_df = pd.read_csv(io.StringIO(table_content), sep='\t',
-                                   low_memory=False, on_bad_lines='skip')
-
-            print(f"Annotation columns: {list(annot_df.columns)}")
-            print(f"Annotation entries: {len(annot_df)}")
-
-            # Find ID and Symbol columns
-            id_cols = [c for c in annot_df.columns if c.upper() in ['ID', 'PROBE_ID', 'ID_REF']]
-            symbol_cols = [c for c in annot_df.columns if 'SYMBOL' in c.upper() or 'GENE' in c.upper()]
-
-            print(f"\nID columns found: {id_cols}")
-            print(f"Symbol columns found: {symbol_cols}")
-
-except Exception as e:
-    print(f"Download failed: {e}")
-    annot_df = None
-
-# =============================================================================
-# 3. Alternative: Check if annotation already exists locally
+# 2. Load GPL14951 Annotation (local SOFT file, cached probe index)
 # =============================================================================
 
-if annot_df is None or len(annot_df) == 0:
-    print("\nChecking for local annotation...")
+print("Loading GPL14951 annotation from local SOFT file...")
 
-    # Try to see if there's already an annotation file
-    local_annot = os.path.join(lacy_dir, "GPL14951_annotation.csv")
-    if os.path.exists(local_annot):
-        annot_df = pd.read_csv(local_annot)
-        print(f"Loaded local annotation: {len(annot_df)} entries")
+annot_df = load_probe_annotation(lacy_dir)
+if annot_df is not None:
+    print(f"Annotation columns: {list(annot_df.columns)}")
+    print(f"Annotation entries: {len(annot_df)}")
 
 # =============================================================================
-# 4. Merge Annotation with DE Results
+# 3. Merge Annotation with DE Results
 # =============================================================================
 
 print("\n" + "=" * 60)
@@ -102,7 +50,7 @@ if annot_df is not None and len(annot_df) > 0:
     symbol_col = None
 
     for col in annot_df.columns:
-        if col.upper() == 'ID':
+        if col.upper() in ('ID', 'PROBE'):
             id_col = col
         if 'SYMBOL' in col.upper():
             symbol_col = col
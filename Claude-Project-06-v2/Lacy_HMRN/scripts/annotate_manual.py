@@ -1,14 +1,12 @@
 """
 Annotate Differentially Expressed Probes
-Using direct GEO download with proper handling
+Using the local GPL14951 platform annotation
 """
 
 import pandas as pd
-import urllib.request
-import gzip
-import io
 import os
-import ssl
+
+from platform_annotation import load_probe_annotation
 
 print("=" * 60)
 print("Annotating DE Probes with Gene Symbols")
@@ -17,11 +15,6 @@ print("=" * 60 + "\n")
 lacy_dir = "C:/Users/ericp/OneDrive/Desktop/Claude-Projects/Claude-Project-06/Lacy_HMRN"
 results_dir = os.path.join(lacy_dir, "results")
 
-# Disable SSL verification
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
-
 # =============================================================================
 # 1. Load DE Results
 # =============================================================================
@@ -32,45 +25,15 @@ print(f"Total probes: {len(de_results)}")
 print(f"FDR < 0.1: {(de_results['FDR'] < 0.1).sum()}")
 
 # =============================================================================
-# 2. Try to download annotation
+# 2. Load annotation from the local GPL14951 SOFT file
 # =============================================================================
 
-print("\nDownloading GPL14951 annotation (SOFT format)...")
-
-# Try the simple SOFT format from GEO FTP
-annot_url = "https://ftp.ncbi.nlm.nih.gov/geo/platforms/GPL14nnn/GPL14951/annot/GPL14951.annot.gz"
-
-annot_df = None
-
-try:
-    print(f"Trying: {annot_url}")
-    req = urllib.request.Request(annot_url)
-    req.add_header('User-Agent', 'Mozilla/5.0')
-
-    with urllib.request.urlopen(req, timeout=120, context=ssl_context) as response:
-        data = gzip.decompress(response.read()).decode('utf-8', errors='ignore')
-
-        # Find table start
-        lines = data.split('\n')
-        table_start = None
-        for i, line in enumerate(lines):
-            if line.startswith('#ID'):
-                table_start = i
-                break
-            if line.startswith('ID\t'):
-                table_start = i
-                break
-
-        if table_start:
-            # Read from table start
-            table_lines = '\n'.join(lines[table_start:])
-            annot_df = pd.read_csv(io.StringIO(table_lines), sep='\t',
-                                  low_memory=False, on_bad_lines='skip')
-            print(f"Loaded annotation: {len(annot_df)} entries")
-            print(f"Columns: {list(annot_df.columns)[:10]}")
-
-except Exception as e:
-    print(f"Download failed: {e}")
+print("\nLoading GPL14951 annotation (local SOFT file)...")
+
+annot_df = load_probe_annotation(lacy_dir)
+if annot_df is not None:
+    print(f"Loaded annotation: {len(annot_df)} entries")
+    print(f"Columns: {list(annot_df.columns)[:10]}")
 
 # =============================================================================
 # 3. Alternative: Use probe ID pattern matching for known genes
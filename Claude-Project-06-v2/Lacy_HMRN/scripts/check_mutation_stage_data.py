@@ -5,6 +5,8 @@ Check for better stage data overlap with mutation data
 import pandas as pd
 import os
 
+from clinical_metadata import load_clinical
+
 lacy_dir = "C:/Users/ericp/OneDrive/Desktop/Claude-Projects/Claude-Project-06/Lacy_HMRN"
 
 print("=" * 60)
@@ -56,6 +58,20 @@ print("Looking for stage in raw data files...")
 # Check if there's stage in genomic_data.csv header
 print(f"\ngenomic_data.csv columns: {list(mutations.columns)[:20]}")
 
+# Stage in GEO expression metadata (header-only read, no expression block)
+print("\n" + "=" * 60)
+print("Checking GEO series matrix characteristics...")
+clinical = load_clinical(os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz"),
+                         dtypes={'pid_pmid_32187361': str})
+print(f"GEO samples: {len(clinical)}")
+if 'Stage' in clinical.columns and 'pid_pmid_32187361' in clinical.columns:
+    print(f"Stage: {clinical['Stage'].value_counts(dropna=False).to_dict()}")
+    geo_staged = clinical[clinical['Stage'].notna() & clinical['pid_pmid_32187361'].notna()]
+    geo_pids = set(geo_staged['pid_pmid_32187361'])
+    mut_pids = set(mutations['PID'].astype(str))
+    print(f"GEO samples with stage + PID: {len(geo_staged)}")
+    print(f"  Overlap with mutation data: {len(geo_pids & mut_pids)}")
+
 # The issue is the stage data is only in GEO expression metadata
 # Not in the Blood supplement clinical data
 # This is a data structure limitation
@@ -0,0 +1,156 @@
+"""
+Clinical Metadata Fast Path for Series Matrices
+Typed sample characteristics without touching the expression block
+
+Reads only the metadata section of a GEO series matrix (everything before
+`!series_matrix_table_begin` plus the table's column header), so the gzip is
+decompressed for a few hundred KB instead of the whole file. Every
+`key: value` characteristic row becomes one column of a typed DataFrame:
+
+  integers             -> Int64 (nullable)
+  other numbers        -> float64 (zero-padded integers such as IDs "007"
+                          are text, so they keep their padding)
+  low-cardinality text -> category
+  other text           -> object (str)
+
+Missing values are always NA (pd.isna() is True). Columns given a dtype
+override are cast from their original strings, never from the inferred
+type. The typed table is cached in the same cache entry as the expression
+matrix but in its own files, so clinical-only scripts never build or wait
+on the expression cache.
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from expression_cache import (atomic_write_json, cache_entry_dir, is_fresh, read_json_meta,
+                              source_fingerprint)
+from series_matrix import (TABLE_BEGIN, align_characteristics, characteristics_frame,
+                           open_text, read_header, read_table_header)
+
+CLINICAL_VERSION = 2
+
+# Text columns with at most this fraction of distinct values become categories
+CATEGORY_MAX_UNIQUE = 0.5
+
+# Integers without leading zeros, so casting back to str is exact (IDs stay intact)
+_INT_RE = re.compile(r'^[-+]?(0|[1-9][0-9]*)$')
+# Zero-padded integers ("007"): identifiers, kept as text
+_PADDED_RE = re.compile(r'^[-+]?0[0-9]+$')
+
+
+def _clinical_paths(entry):
+    return (os.path.join(entry, "clinical.pkl"), os.path.join(entry, "clinical.json"),
+            os.path.join(entry, "characteristics.pkl"))
+
+
+def infer_column(values):
+    """Convert one column of strings/None to the narrowest fitting dtype"""
+    present = values.dropna()
+    if len(present) == 0:
+        return values.astype(object)
+    text = present.astype(str)
+    if text.str.match(_PADDED_RE).any():
+        return _text_column(values, text)
+    if text.str.match(_INT_RE).all():
+        return pd.to_numeric(values, errors='coerce').astype('Int64')
+    numeric = pd.to_numeric(text, errors='coerce')
+    if numeric.notna().all():
+        return pd.to_numeric(values, errors='coerce').astype(np.float64)
+    return _text_column(values, text)
+
+
+def _text_column(values, text):
+    if text.nunique() <= max(1, CATEGORY_MAX_UNIQUE * len(text)):
+        return values.astype('category')
+    return values.astype(object)
+
+
+def infer_types(frame, dtypes=None):
+    """
+    Typed copy of a string characteristics frame.
+
+    `dtypes` overrides inference per column, e.g. {'pid_pmid_32187361': str}.
+    """
+    dtypes = dtypes or {}
+    typed = {}
+    for col in frame.columns:
+        if col in dtypes:
+            typed[col] = _cast(frame[col], dtypes[col])
+        else:
+            typed[col] = infer_column(frame[col])
+    return pd.DataFrame(typed, index=frame.index)
+
+
+def _cast(values, dtype):
+    """Cast keeping missing values as NA (str columns stay object, not 'nan')"""
+    if dtype is str:
+        return values.astype(object).map(lambda v: v if pd.isna(v) else str(v))
+    return values.astype(dtype)
+
+
+def read_characteristics(path):
+    """
+    Parse only the metadata section of a series matrix.
+
+    Returns the characteristics as a string DataFrame indexed by sample_id
+    (None when missing), in the same column order as the expression table.
+    """
+    with open_text(path) as f:
+        geo_ids, characteristics, found = read_header(f)
+        if not found:
+            raise ValueError(f"No {TABLE_BEGIN} block in {path}")
+        sample_ids = read_table_header(f)
+    characteristics = align_characteristics(characteristics, geo_ids, sample_ids)
+    return characteristics_frame(sample_ids, characteristics)
+
+
+def load_clinical(path, dtypes=None, cache_dir=None, use_cache=True, verbose=True):
+    """
+    Typed clinical DataFrame (samples x characteristics) for a series matrix.
+
+    Served from `clinical.pkl` in the cache entry when it matches the source;
+    otherwise the header is parsed and the cache rewritten. Columns in
+    `dtypes` are cast from the cached original strings (characteristics.pkl)
+    instead of being inferred, so overrides never invalidate the cache.
+    """
+    if not use_cache:
+        return infer_types(read_characteristics(path), dtypes)
+
+    entry = cache_entry_dir(path, cache_dir)
+    table_path, meta_path, raw_path = _clinical_paths(entry)
+    meta = read_json_meta(meta_path, CLINICAL_VERSION)
+
+    if is_fresh(meta, path, meta_path) and os.path.exists(table_path) and os.path.exists(raw_path):
+        clinical = pd.read_pickle(table_path)
+        return _apply_overrides(clinical, pd.read_pickle(raw_path) if dtypes else None, dtypes)
+
+    if verbose:
+        print(f"  Parsing metadata of {os.path.basename(path)} (building clinical cache)...")
+    raw = read_characteristics(path)
+    clinical = infer_types(raw)
+    os.makedirs(entry, exist_ok=True)
+    for frame, target in ((raw, raw_path), (clinical, table_path)):
+        tmp = target + ".tmp"
+        frame.to_pickle(tmp)
+        os.replace(tmp, target)
+    atomic_write_json(meta_path, {
+        'version': CLINICAL_VERSION,
+        'source': source_fingerprint(path),
+        'source_name': os.path.basename(path),
+        'columns': {c: str(clinical[c].dtype) for c in clinical.columns},
+    })
+    return _apply_overrides(clinical, raw, dtypes)
+
+
+def _apply_overrides(clinical, raw, dtypes):
+    """Overridden columns cast from the original strings `raw`, in place of the inferred ones"""
+    if not dtypes:
+        return clinical
+    clinical = clinical.copy()
+    for col, dtype in dtypes.items():
+        if col in clinical.columns:
+            clinical[col] = _cast(raw[col], dtype)
+    return clinical
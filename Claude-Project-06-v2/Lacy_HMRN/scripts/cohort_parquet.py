@@ -0,0 +1,370 @@
+"""
+Columnar Parquet Export of the Lacy Cohort
+Typed tables with column projection and predicate pushdown
+
+Writes the harmonized cohort to Lacy_HMRN/parquet/:
+
+  expression.parquet  - probes x samples (Probe, Gene_Symbol, one column per
+                        GSM), row groups ordered by gene symbol
+  clinical.parquet    - typed sample characteristics (sample_id + columns)
+  results/<name>.parquet - every DE/survival CSV in results/, joined once
+                        with the GPL14951 annotation (Gene_Symbol, Entrez_ID)
+
+Readers call read_table(data_dir, name, columns=..., filters=...): only the
+requested columns are decoded and row groups whose min/max statistics cannot
+match the filters are skipped. Tables not yet exported are read from the
+CSV with the same projection/filter semantics, so scripts work either way.
+Each file carries the fingerprint of its source and is only rewritten when
+the source changes; readers check it too, re-exporting a stale table before
+reading it.
+
+Run as a script to (re)export everything.
+"""
+
+import json
+import operator
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from clinical_metadata import CATEGORY_MAX_UNIQUE, load_clinical
+from expression_cache import is_fresh, source_fingerprint
+from expression_store import open_store
+from platform_annotation import LEGACY_CSV, SOFT_FILE, load_probe_annotation
+
+EXPORT_VERSION = 1
+PARQUET_DIRNAME = "parquet"
+SERIES_MATRIX = "GSE181063_series_matrix.txt.gz"
+
+# Rows per row group: small enough that symbol/P-value statistics prune well
+ROW_GROUP_SIZE = 4096
+COMPRESSION = 'zstd'
+
+# Schema metadata key holding the export fingerprint
+META_KEY = b'lacy_export'
+
+# Annotation columns joined onto result tables that have a Probe column
+ANNOTATION_COLUMNS = ['Gene_Symbol', 'Entrez_ID']
+
+CLINICAL_DTYPES = {'pid_pmid_32187361': str}
+
+_OPS = {
+    '=': operator.eq, '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def parquet_dir(data_dir):
+    return os.path.join(data_dir, PARQUET_DIRNAME)
+
+
+def table_path(data_dir, name):
+    """Parquet path of a table: 'expression', 'clinical' or a results CSV stem"""
+    if name in ('expression', 'clinical'):
+        return os.path.join(parquet_dir(data_dir), f"{name}.parquet")
+    return os.path.join(parquet_dir(data_dir), "results", f"{name}.parquet")
+
+
+# =============================================================================
+# Writing
+# =============================================================================
+
+def _export_meta(sources):
+    return {'version': EXPORT_VERSION,
+            'sources': {os.path.basename(p): source_fingerprint(p) for p in sources}}
+
+
+def read_export_meta(path):
+    """Export fingerprint stored in a Parquet file's schema metadata (None if absent)"""
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if META_KEY not in metadata:
+        return None
+    meta = json.loads(metadata[META_KEY])
+    return meta if meta.get('version') == EXPORT_VERSION else None
+
+
+def is_current(path, sources):
+    """True if the Parquet file was exported from the current version of every source"""
+    meta = read_export_meta(path)
+    if meta is None or set(meta['sources']) != {os.path.basename(p) for p in sources}:
+        return False
+    return all(is_fresh({'source': meta['sources'][os.path.basename(p)]}, p) for p in sources)
+
+
+def _with_meta(schema, sources):
+    metadata = dict(schema.metadata or {})
+    metadata[META_KEY] = json.dumps(_export_meta(sources)).encode()
+    return schema.with_metadata(metadata)
+
+
+def write_frame(frame, path, sources):
+    """Write a DataFrame as Parquet (atomically), tagged with its source fingerprints"""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata(_with_meta(table.schema, sources).metadata)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION)
+    os.replace(tmp, path)
+    return path
+
+
+def _compact_strings(frame):
+    """Low-cardinality text columns (Direction, COO, ...) as categories (dictionary-encoded)"""
+    frame = frame.copy()
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            present = frame[col].dropna()
+            if len(present) and present.map(type).eq(str).all() and \
+                    present.nunique() <= max(1, CATEGORY_MAX_UNIQUE * len(present)):
+                frame[col] = frame[col].astype('category')
+    return frame
+
+
+def _annotation_sources(data_dir):
+    for name in (SOFT_FILE, LEGACY_CSV):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            return [path]
+    return []
+
+
+def _symbol_order(probe_ids, annot):
+    """Probe positions sorted by gene symbol (unannotated probes last), and the symbols"""
+    symbols = pd.Series(probe_ids).map(annot) if annot is not None else \
+        pd.Series([None] * len(probe_ids))
+    order = np.lexsort((np.arange(len(probe_ids)), symbols.fillna('').to_numpy(str),
+                        symbols.isna().to_numpy()))
+    return order, symbols.to_numpy(object)
+
+
+def export_expression(data_dir, series_file=SERIES_MATRIX, annot=None, verbose=True):
+    """
+    Write parquet/expression.parquet from the memory-mapped expression store.
+
+    Streams one row group at a time, so the matrix is never copied whole.
+    Rows are ordered by Gene_Symbol so symbol filters touch few row groups.
+    """
+    series_path = os.path.join(data_dir, series_file)
+    path = table_path(data_dir, 'expression')
+    sources = [series_path] + _annotation_sources(data_dir)
+    if is_current(path, sources):
+        return path
+
+    if verbose:
+        print(f"  Exporting expression matrix to {os.path.relpath(path, data_dir)}...")
+    store = open_store(series_path, verbose=verbose)
+    symbol_map = None if annot is None else \
+        annot.drop_duplicates('Probe').set_index('Probe')['Gene_Symbol']
+    order, symbols = _symbol_order(store.probe_ids, symbol_map)
+    probe_ids = np.asarray(store.probe_ids, dtype=object)
+
+    fields = [pa.field('Probe', pa.string()), pa.field('Gene_Symbol', pa.string())]
+    fields += [pa.field(s, pa.from_numpy_dtype(store.dtype)) for s in store.sample_ids]
+    schema = _with_meta(pa.schema(fields), sources)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with pq.ParquetWriter(tmp, schema, compression=COMPRESSION) as writer:
+        for start in range(0, len(order), ROW_GROUP_SIZE):
+            rows = order[start:start + ROW_GROUP_SIZE]
+            block = store.probe_major[rows]
+            columns = [pa.array(probe_ids[rows].tolist(), pa.string()),
+                       pa.array(symbols[rows], pa.string(), from_pandas=True)]
+            columns += [pa.array(block[:, j]) for j in range(block.shape[1])]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    os.replace(tmp, path)
+    return path
+
+
+def export_clinical(data_dir, series_file=SERIES_MATRIX, verbose=True):
+    """Write parquet/clinical.parquet (typed characteristics, one row per sample)"""
+    series_path = os.path.join(data_dir, series_file)
+    path = table_path(data_dir, 'clinical')
+    if is_current(path, [series_path]):
+        return path
+    if verbose:
+        print(f"  Exporting clinical table to {os.path.relpath(path, data_dir)}...")
+    clinical = load_clinical(series_path, dtypes=CLINICAL_DTYPES, verbose=verbose)
+    return write_frame(clinical.rename_axis('sample_id').reset_index(), path, [series_path])
+
+
+def export_result(data_dir, csv_path, annot=None, verbose=True):
+    """
+    Write one results CSV as parquet/results/<stem>.parquet.
+
+    Tables keyed by Probe get Gene_Symbol/Entrez_ID from the annotation when
+    they do not already carry them.
+    """
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    path = table_path(data_dir, name)
+    sources = [csv_path] + _annotation_sources(data_dir)
+    if is_current(path, sources):
+        return path
+    if verbose:
+        print(f"  Exporting {os.path.basename(csv_path)}...")
+    frame = _join_annotation(pd.read_csv(csv_path), annot)
+    return write_frame(_compact_strings(frame), path, sources)
+
+
+def _join_annotation(frame, annot, columns=None):
+    """Add missing annotation columns (all of ANNOTATION_COLUMNS, or `columns`) by Probe"""
+    wanted = [c for c in (columns or ANNOTATION_COLUMNS) if c not in frame.columns]
+    if annot is None or 'Probe' not in frame.columns or not wanted:
+        return frame
+    wanted = [c for c in wanted if c in annot.columns]
+    lookup = annot.drop_duplicates('Probe').set_index('Probe')[wanted]
+    return frame.join(lookup, on='Probe')
+
+
+def export_cohort(data_dir, series_file=SERIES_MATRIX, verbose=True):
+    """Export expression, clinical and every results/*.csv; returns the written paths"""
+    annot = load_probe_annotation(data_dir, verbose=verbose)
+    paths = []
+    if os.path.exists(os.path.join(data_dir, series_file)):
+        paths.append(export_clinical(data_dir, series_file, verbose))
+        paths.append(export_expression(data_dir, series_file, annot, verbose))
+    results_dir = os.path.join(data_dir, "results")
+    if os.path.isdir(results_dir):
+        for name in sorted(os.listdir(results_dir)):
+            if name.endswith('.csv'):
+                paths.append(export_result(data_dir, os.path.join(results_dir, name), annot, verbose))
+    return paths
+
+
+# =============================================================================
+# Reading
+# =============================================================================
+
+def _normalize_filters(filters):
+    """Filters as a list of conjunctions (pyarrow DNF form)"""
+    if not filters:
+        return None
+    if isinstance(filters[0], tuple):
+        return [list(filters)]
+    return [list(conj) for conj in filters]
+
+
+def _filter_mask(frame, filters):
+    mask = np.zeros(len(frame), dtype=bool)
+    for conj in filters:
+        keep = np.ones(len(frame), dtype=bool)
+        for col, op, value in conj:
+            values = frame[col]
+            if op == 'in':
+                keep &= values.isin(value).to_numpy()
+            elif op == 'not in':
+                keep &= ~values.isin(value).to_numpy()
+            else:
+                keep &= _OPS[op](values, value).fillna(False).to_numpy(bool)
+        mask |= keep
+    return mask
+
+
+def _read_csv_fallback(data_dir, name, columns, filters):
+    """Same projection/filter semantics on results/<name>.csv"""
+    csv_path = os.path.join(data_dir, "results", f"{name}.csv")
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Neither {table_path(data_dir, name)} nor {csv_path} exists")
+    header = pd.read_csv(csv_path, nrows=0).columns
+    needed = None
+    if columns is not None:
+        needed = list(columns)
+        for conj in filters or []:
+            needed += [col for col, _, _ in conj if col not in needed]
+    missing = [c for c in (needed or ANNOTATION_COLUMNS) if c not in header]
+    usecols = None if needed is None else [c for c in needed if c in header]
+    if missing and 'Probe' in header and usecols is not None and 'Probe' not in usecols:
+        usecols.append('Probe')
+    frame = pd.read_csv(csv_path, usecols=usecols)
+    if missing:
+        annot = load_probe_annotation(data_dir, verbose=False)
+        frame = _join_annotation(frame, annot, missing if needed is not None else None)
+    if filters:
+        frame = frame[_filter_mask(frame, filters)].reset_index(drop=True)
+    return frame if columns is None else frame[list(columns)]
+
+
+def _current_table(data_dir, name, series_file=SERIES_MATRIX):
+    """
+    Path of an exported table, re-exported first if its source changed since
+    the export. Raises FileNotFoundError when the source is gone.
+    """
+    path = table_path(data_dir, name)
+    if name in ('expression', 'clinical'):
+        source = os.path.join(data_dir, series_file)
+    else:
+        source = os.path.join(data_dir, "results", f"{name}.csv")
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"{path} cannot be checked: its source {source} no longer exists")
+    sources = [source] + (_annotation_sources(data_dir) if name != 'clinical' else [])
+    if is_current(path, sources):
+        return path
+    if name == 'clinical':
+        return export_clinical(data_dir, series_file)
+    annot = load_probe_annotation(data_dir, verbose=False)
+    if name == 'expression':
+        return export_expression(data_dir, series_file, annot)
+    return export_result(data_dir, source, annot)
+
+
+def read_table(data_dir, name, columns=None, filters=None):
+    """
+    Load a cohort table as a DataFrame, reading only what is asked for.
+
+    `name` is 'expression', 'clinical' or a results CSV stem (e.g.
+    'mortality_signature_gcb'). `columns` projects; `filters` are pyarrow
+    predicates, e.g. [('Gene_Symbol', 'in', genes), ('FDR', '<', 0.1)]
+    (a list of tuples is AND, a list of lists is OR of ANDs). Falls back to
+    the results CSV when the table has not been exported; an export older
+    than its source is rewritten first.
+    """
+    filters = _normalize_filters(filters)
+    path = table_path(data_dir, name)
+    if not os.path.exists(path):
+        return _read_csv_fallback(data_dir, name, columns, filters)
+    path = _current_table(data_dir, name)
+    table = pq.read_table(path, columns=list(columns) if columns is not None else None,
+                          filters=filters)
+    return table.to_pandas()
+
+
+def read_expression(data_dir, genes=None, probes=None, samples=None):
+    """
+    Expression rows for selected genes/probes as a DataFrame indexed by Probe.
+
+    Only the requested sample columns are decoded; gene/probe filters are
+    pushed down to the row groups. An export older than the series matrix
+    is rewritten first.
+    """
+    filters = []
+    if genes is not None:
+        filters.append(('Gene_Symbol', 'in', list(genes)))
+    if probes is not None:
+        filters.append(('Probe', 'in', list(probes)))
+    columns = None if samples is None else ['Probe', 'Gene_Symbol'] + list(samples)
+    path = table_path(data_dir, 'expression')
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not exported; run cohort_parquet.py")
+    path = _current_table(data_dir, 'expression')
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    return table.to_pandas().set_index('Probe')
+
+
+# =============================================================================
+# Entry point
+# =============================================================================
+
+if __name__ == '__main__':
+    lacy_dir = "C:/Users/ericp/OneDrive/Desktop/Claude-Projects/Claude-Project-06/Lacy_HMRN"
+
+    print("=" * 60)
+    print("Exporting Lacy cohort to Parquet")
+    print("=" * 60)
+    written = export_cohort(lacy_dir)
+    for p in written:
+        print(f"  {os.path.relpath(p, lacy_dir)}: {os.path.getsize(p) / 1e6:.1f} MB")
+    print(f"\nWrote {len(written)} tables to {parquet_dir(lacy_dir)}")
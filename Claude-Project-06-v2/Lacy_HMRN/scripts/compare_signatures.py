@@ -6,15 +6,18 @@ Dark Zone vs Light Zone transcriptional programs
 import pandas as pd
 import numpy as np
 from scipy import stats
-from lifelines import KaplanMeierFitter, CoxPHFitter
-from lifelines.statistics import logrank_test
+from lifelines import CoxPHFitter
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import gzip
 import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from probe_index import open_probe_index
+from platform_annotation import load_probe_annotation
+from survival_design import SurvivalDesign
+from survival_stats import kaplan_meier, logrank_matrix
+
 print("=" * 70)
 print("SIGNATURE COMPARISON: tEgress vs DZ/LZ Signatures")
 print("=" * 70 + "\n")
@@ -76,69 +79,28 @@ print("\nLoading data...")
 
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 
-with gzip.open(series_file, 'rt') as f:
-    lines = f.readlines()
+# Probe index: only the signature genes' rows are read, not the whole matrix
+index = open_probe_index(series_file)
+sample_ids = index.sample_ids
 
 # Parse metadata
-sample_ids = None
-coo = None
-os_status = None
-os_followup = None
-
-for line in lines:
-    if line.startswith("!Sample_geo_accession"):
-        parts = line.strip().split('\t')[1:]
-        sample_ids = [p.strip('"') for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "pred_combine:" in line:
-        parts = line.strip().split('\t')[1:]
-        coo = [p.strip('"').split(":")[-1].strip() if "pred_combine:" in p else None for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "os_status:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_status = []
-        for p in parts:
-            try:
-                os_status.append(int(p.strip('"').split(":")[-1].strip()))
-            except:
-                os_status.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "os_followup_y:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_followup = []
-        for p in parts:
-            try:
-                os_followup.append(float(p.strip('"').split(":")[-1].strip()))
-            except:
-                os_followup.append(None)
-
-# Parse expression
-expr_start = None
-expr_end = None
-for i, line in enumerate(lines):
-    if line.startswith("!series_matrix_table_begin"):
-        expr_start = i + 1
-    elif line.startswith("!series_matrix_table_end"):
-        expr_end = i
-        break
-
-expr_data = {}
-if expr_start and expr_end:
-    expr_lines = lines[expr_start:expr_end]
-    for line in expr_lines[1:]:
-        parts = line.strip().split('\t')
-        probe_id = parts[0].strip('"')
-        values = [float(v) if v != 'null' and v != '' else np.nan for v in parts[1:]]
-        expr_data[probe_id] = values
+coo = index.characteristic('pred_combine')
+os_status = index.characteristic('os_status', int)
+os_followup = index.characteristic('os_followup_y', float)
 
 # Load annotation
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
+annot_df = load_probe_annotation(lacy_dir)
 gene_to_probe = {}
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
-    for _, row in annot_df.iterrows():
-        if row['Gene_Symbol'] not in gene_to_probe:
-            gene_to_probe[row['Gene_Symbol']] = row['Probe']
+if annot_df is not None:
+    for probe, gene in zip(annot_df['Probe'], annot_df['Gene_Symbol']):
+        if gene not in gene_to_probe:
+            gene_to_probe[gene] = probe
 
 print(f"Available annotated genes: {list(gene_to_probe.keys())}")
 
+signature_genes = DZ_GENES + LZ_GENES + RETENTION_GENES + EGRESS_GENES + MYC_TARGETS + BCL2_SIG
+expr_data = index.read_dict([gene_to_probe[g] for g in signature_genes if g in gene_to_probe])
+
 # =============================================================================
 # 3. Calculate Signature Scores
 # =============================================================================
@@ -210,7 +172,8 @@ surv = clinical[clinical['OS_status'].notna() & clinical['OS_time'].notna()].cop
 print(f"\nSamples with survival: {len(surv)}")
 
 # Create quartiles for each signature (only if variance exists)
-for sig in ['DZ_LZ_ratio', 'tEgress', 'MYC_score', 'BCL2_score', 'DZ_score']:
+QUARTILE_SIGS = ['DZ_LZ_ratio', 'tEgress', 'MYC_score', 'BCL2_score', 'DZ_score']
+for sig in QUARTILE_SIGS:
     if surv[sig].std() > 0.01:  # Only if there's meaningful variance
         try:
             surv[f'{sig}_Q'] = pd.qcut(surv[sig], q=4, labels=['Q1', 'Q2', 'Q3', 'Q4'], duplicates='drop')
@@ -249,7 +212,36 @@ print("\n" + "=" * 70)
 print("SURVIVAL ANALYSIS: SIGNATURE COMPARISON")
 print("=" * 70)
 
-def analyze_signature_survival(data, sig_name, quartile_col):
+SURVIVAL_SIGS = ['DZ_score', 'tEgress', 'MYC_score']
+
+# Subtype cohorts, quartiles recalculated within subtype
+subtype_cohorts = {}
+for subtype in ['GCB', 'ABC', 'MHG', 'UNC']:
+    subset = surv[surv['COO'] == subtype].copy()
+    if len(subset) >= 40:
+        for sig in SURVIVAL_SIGS:
+            if subset[sig].std() > 0.01:
+                try:
+                    subset[f'{sig}_Q'] = pd.qcut(subset[sig], q=4, labels=['Q1', 'Q2', 'Q3', 'Q4'], duplicates='drop')
+                except:
+                    subset[f'{sig}_Q'] = None
+            else:
+                subset[f'{sig}_Q'] = None
+        subtype_cohorts[subtype] = subset
+
+# Q1 vs Q4 log-rank and Kaplan-Meier curves of every signature in every cohort, batched:
+# one label column per cohort/signature (NaN outside the cohort)
+cohort_sigs = {'Overall': (surv, QUARTILE_SIGS),
+               **{subtype: (subset, SURVIVAL_SIGS) for subtype, subset in subtype_cohorts.items()}}
+quartile_labels = pd.DataFrame({f'{cohort}/{sig}': data[f'{sig}_Q']
+                                for cohort, (data, sigs) in cohort_sigs.items() for sig in sigs},
+                               index=surv.index)
+survival_design = SurvivalDesign.from_frame(surv, time_col='OS_time', id_col='sample_id')
+logrank_q1_vs_q4 = logrank_matrix(survival_design, quartile_labels, groups=['Q1', 'Q4'])
+km_quartiles = kaplan_meier(survival_design, quartile_labels, groups=['Q1', 'Q2', 'Q3', 'Q4'])
+median_quartiles = km_quartiles.table()['median']
+
+def analyze_signature_survival(data, sig_name, quartile_col, cohort='Overall'):
     """Analyze survival by signature quartiles"""
 
     q1 = data[data[quartile_col] == 'Q1']
@@ -259,17 +251,13 @@ def analyze_signature_survival(data, sig_name, quartile_col):
         return None, None, None
 
     # Log-rank Q1 vs Q4
-    lr = logrank_test(q1['OS_time'], q4['OS_time'], q1['OS_status'], q4['OS_status'])
+    p_value = logrank_q1_vs_q4.loc[f'{cohort}/{sig_name}', 'p_value']
 
     # Median OS
-    kmf = KaplanMeierFitter()
-    kmf.fit(q1['OS_time'], q1['OS_status'])
-    med_q1 = kmf.median_survival_time_
+    med_q1 = median_quartiles[(f'{cohort}/{sig_name}', 'Q1')]
+    med_q4 = median_quartiles[(f'{cohort}/{sig_name}', 'Q4')]
 
-    kmf.fit(q4['OS_time'], q4['OS_status'])
-    med_q4 = kmf.median_survival_time_
-
-    return lr.p_value, med_q1, med_q4
+    return p_value, med_q1, med_q4
 
 # Overall comparison
 print("\n--- OVERALL COHORT ---")
@@ -277,7 +265,7 @@ print(f"{'Signature':<20} {'Q1vsQ4 p':>12} {'Median Q1':>12} {'Median Q4':>12} {
 print("-" * 70)
 
 sig_results = {}
-for sig in ['DZ_score', 'tEgress', 'MYC_score']:
+for sig in SURVIVAL_SIGS:
     if surv[f'{sig}_Q'] is None or surv[f'{sig}_Q'].isna().all():
         continue
     p, m1, m4 = analyze_signature_survival(surv, sig, f'{sig}_Q')
@@ -291,32 +279,20 @@ for sig in ['DZ_score', 'tEgress', 'MYC_score']:
         sig_results[sig] = {'p': p, 'med_q1': m1, 'med_q4': m4}
 
 # By subtype
-for subtype in ['GCB', 'ABC', 'MHG', 'UNC']:
-    subset = surv[surv['COO'] == subtype].copy()
-    if len(subset) >= 40:
-        # Recalculate quartiles within subtype
-        for sig in ['DZ_score', 'tEgress', 'MYC_score']:
-            if subset[sig].std() > 0.01:
-                try:
-                    subset[f'{sig}_Q'] = pd.qcut(subset[sig], q=4, labels=['Q1', 'Q2', 'Q3', 'Q4'], duplicates='drop')
-                except:
-                    subset[f'{sig}_Q'] = None
-            else:
-                subset[f'{sig}_Q'] = None
-
-        print(f"\n--- {subtype} (n={len(subset)}) ---")
-        print(f"{'Signature':<20} {'Q1vsQ4 p':>12} {'Median Q1':>12} {'Median Q4':>12}")
-        print("-" * 60)
-
-        for sig in ['DZ_score', 'tEgress', 'MYC_score']:
-            if subset[f'{sig}_Q'] is None or subset[f'{sig}_Q'].isna().all():
-                continue
-            p, m1, m4 = analyze_signature_survival(subset, sig, f'{sig}_Q')
-            if p is not None:
-                m1_str = f"{m1:.1f}" if not np.isinf(m1) else "NR"
-                m4_str = f"{m4:.1f}" if not np.isinf(m4) else "NR"
-                sig_star = "***" if p < 0.001 else ("**" if p < 0.01 else ("*" if p < 0.05 else ""))
-                print(f"{sig:<20} {p:>12.4f} {m1_str:>12} {m4_str:>12} {sig_star}")
+for subtype, subset in subtype_cohorts.items():
+    print(f"\n--- {subtype} (n={len(subset)}) ---")
+    print(f"{'Signature':<20} {'Q1vsQ4 p':>12} {'Median Q1':>12} {'Median Q4':>12}")
+    print("-" * 60)
+
+    for sig in SURVIVAL_SIGS:
+        if subset[f'{sig}_Q'] is None or subset[f'{sig}_Q'].isna().all():
+            continue
+        p, m1, m4 = analyze_signature_survival(subset, sig, f'{sig}_Q', cohort=subtype)
+        if p is not None:
+            m1_str = f"{m1:.1f}" if not np.isinf(m1) else "NR"
+            m4_str = f"{m4:.1f}" if not np.isinf(m4) else "NR"
+            sig_star = "***" if p < 0.001 else ("**" if p < 0.01 else ("*" if p < 0.05 else ""))
+            print(f"{sig:<20} {p:>12.4f} {m1_str:>12} {m4_str:>12} {sig_star}")
 
 # =============================================================================
 # 7. Multivariate Analysis
@@ -397,7 +373,6 @@ signatures_to_plot = [
 ]
 
 colors = {'Q1': '#2ECC71', 'Q2': '#3498DB', 'Q3': '#F39C12', 'Q4': '#E74C3C'}
-kmf = KaplanMeierFitter()
 
 for idx, (sig, title) in enumerate(signatures_to_plot):
     ax = axes.flatten()[idx]
@@ -405,8 +380,7 @@ for idx, (sig, title) in enumerate(signatures_to_plot):
     for q in ['Q1', 'Q2', 'Q3', 'Q4']:
         subset = surv[surv[f'{sig}_Q'] == q]
         if len(subset) >= 5:
-            kmf.fit(subset['OS_time'], subset['OS_status'], label=q)
-            kmf.plot_survival_function(ax=ax, color=colors[q], linewidth=2)
+            km_quartiles.plot(ax, f'Overall/{sig}', q, color=colors[q], linewidth=2)
 
     p = sig_results.get(sig, {}).get('p', np.nan)
     p_str = f"p={p:.4f}" if not np.isnan(p) else ""
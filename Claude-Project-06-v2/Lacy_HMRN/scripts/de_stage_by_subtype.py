@@ -9,9 +9,14 @@ import numpy as np
 from scipy import stats
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import gzip
 import os
 
+from expression_store import open_store
+from expression_cache import default_cache_dir
+from differential_expression import cached_group_stats, de_table
+from rank_tests import RankMatrix
+from platform_annotation import load_probe_annotation
+
 print("=" * 70)
 print("DE ANALYSIS: Stage I vs Stage III/IV by Molecular Subtype")
 print("GCB and MHG - Lacy/HMRN Dataset")
@@ -21,6 +26,12 @@ lacy_dir = "C:/Users/ericp/OneDrive/Desktop/Claude-Projects/Claude-Project-06/La
 results_dir = os.path.join(lacy_dir, "results")
 figures_dir = os.path.join(results_dir, "figures")
 
+# Optional empirical-Bayes moderated t (probe variances shrunk towards a common
+# prior) instead of Student's t; set True to rank small subgroups, which also
+# lowers MIN_GROUP_N to 3 (default: Student's t, groups of at least 5)
+MODERATED_T = False
+MIN_GROUP_N = 3 if MODERATED_T else 5
+
 # =============================================================================
 # 1. Load Data
 # =============================================================================
@@ -29,62 +40,12 @@ print("Loading data from series matrix...")
 
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 
-sample_ids = None
-stages = None
-coo = None
-
-with gzip.open(series_file, 'rt') as f:
-    lines = f.readlines()
-
-# Parse metadata
-for line in lines:
-    if line.startswith("!Sample_geo_accession"):
-        parts = line.strip().split('\t')[1:]
-        sample_ids = [p.strip('"') for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "Stage:" in line:
-        parts = line.strip().split('\t')[1:]
-        stages = []
-        for p in parts:
-            p = p.strip('"')
-            if "Stage:" in p:
-                stage = p.split(":")[-1].strip()
-                stages.append(stage)
-            else:
-                stages.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "pred_combine:" in line:
-        parts = line.strip().split('\t')[1:]
-        coo = []
-        for p in parts:
-            p = p.strip('"')
-            if "pred_combine:" in p:
-                c = p.split(":")[-1].strip()
-                coo.append(c)
-            else:
-                coo.append(None)
-
-# Parse expression matrix
-expr_start = None
-expr_end = None
-for i, line in enumerate(lines):
-    if line.startswith("!series_matrix_table_begin"):
-        expr_start = i + 1
-    elif line.startswith("!series_matrix_table_end"):
-        expr_end = i
-        break
-
-expr_data = {}
-probe_ids = []
-if expr_start and expr_end:
-    expr_lines = lines[expr_start:expr_end]
-    header = expr_lines[0].strip().split('\t')
-    header = [h.strip('"') for h in header]
-
-    for line in expr_lines[1:]:
-        parts = line.strip().split('\t')
-        probe_id = parts[0].strip('"')
-        probe_ids.append(probe_id)
-        values = [float(v) if v != 'null' and v != '' else np.nan for v in parts[1:]]
-        expr_data[probe_id] = values
+# Memory-mapped store: group submatrices are read on demand, not copied up front
+store = open_store(series_file)
+sample_ids = store.sample_ids
+probe_ids = store.probe_ids
+stages = store.characteristic('Stage')
+coo = store.characteristic('pred_combine')
 
 print(f"Samples: {len(sample_ids)}")
 print(f"Probes: {len(probe_ids)}")
@@ -100,10 +61,7 @@ print(f"\nCOO distribution:")
 print(clinical['COO'].value_counts(dropna=False))
 
 # Load annotation
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
-annot_df = None
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
+annot_df = load_probe_annotation(lacy_dir)
 
 # =============================================================================
 # 2. Define Stage Classification
@@ -128,6 +86,15 @@ clinical['stage_extreme'] = clinical['Stage'].apply(classify_stage_extreme)
 
 sample_to_idx = {s: i for i, s in enumerate(sample_ids)}
 
+# Count/sum/sum-of-squares per probe for every COO x stage cell, kept in the cache and updated
+# with only the samples added or restaged since the last run;
+# each subtype contrast is derived from these
+cell_stats = cached_group_stats(os.path.join(default_cache_dir(series_file), "group_stats_coo_stage.npz"),
+                                store.probe_major, clinical[['COO', 'stage_extreme']], sample_ids, probe_ids)
+
+# Per-probe sort order shared by the Mann-Whitney test of every subtype
+ranks = RankMatrix(store.probe_major, probe_ids)
+
 def run_de_analysis(subtype_name, subtype_df):
     """Run differential expression analysis for a subtype"""
 
@@ -145,45 +112,28 @@ def run_de_analysis(subtype_name, subtype_df):
     print(f"Stage I: n={len(stage1_idx)}")
     print(f"Stage III/IV: n={len(stage34_idx)}")
 
-    if len(stage1_idx) < 5 or len(stage34_idx) < 5:
+    if len(stage1_idx) < MIN_GROUP_N or len(stage34_idx) < MIN_GROUP_N:
         print(f"WARNING: Insufficient samples for analysis")
         return None
 
-    # Run t-tests
-    results = []
-
-    for probe_id in probe_ids:
-        values = expr_data[probe_id]
-
-        stage1_vals = [values[i] for i in stage1_idx if not np.isnan(values[i])]
-        stage34_vals = [values[i] for i in stage34_idx if not np.isnan(values[i])]
-
-        if len(stage1_vals) >= 5 and len(stage34_vals) >= 5:
-            if np.std(stage1_vals) > 0 and np.std(stage34_vals) > 0:
-                t_stat, p_value = stats.ttest_ind(stage1_vals, stage34_vals)
-
-                mean_s1 = np.mean(stage1_vals)
-                mean_s34 = np.mean(stage34_vals)
-                log2fc = np.log2((mean_s34 + 0.01) / (mean_s1 + 0.01))
-
-                direction = 'Stage_III_IV_high' if log2fc > 0 else 'Stage_I_high'
+    # t-tests for all probes at once from the cell statistics (NaNs masked per probe)
+    de = cell_stats.ttest({'COO': subtype_name, 'stage_extreme': 'Stage_I'},
+                          {'COO': subtype_name, 'stage_extreme': 'Stage_III_IV'},
+                          min_n=MIN_GROUP_N, moderated=MODERATED_T)
+    if MODERATED_T:
+        print(f"Moderated t: prior df={de.attrs['df_prior']:.2f}, prior variance={de.attrs['s2_prior']:.4f}")
 
-                results.append({
-                    'Probe': probe_id,
-                    'Mean_StageI': mean_s1,
-                    'Mean_StageIII_IV': mean_s34,
-                    'Log2FC': log2fc,
-                    'T_stat': t_stat,
-                    'P_value': p_value,
-                    'Direction': direction
-                })
+    # Non-parametric check from the shared ranks
+    de = de.join(ranks.mann_whitney(stage1_idx, stage34_idx)[['U_stat', 'AUC', 'P_MWU']])
 
     # Convert to DataFrame
-    results_df = pd.DataFrame(results)
+    results_df = de_table(de, ('StageI', 'StageIII_IV'), ('Stage_I_high', 'Stage_III_IV_high'),
+                          extra=('U_stat', 'AUC', 'P_MWU'))
     results_df = results_df.sort_values('P_value')
 
     # FDR correction
     results_df['FDR'] = stats.false_discovery_control(results_df['P_value'])
+    results_df['FDR_MWU'] = stats.false_discovery_control(results_df['P_MWU'])
 
     # Add gene annotation
     if annot_df is not None:
@@ -198,6 +148,7 @@ def run_de_analysis(subtype_name, subtype_df):
     print(f"\nProbes tested: {len(results_df)}")
     print(f"Significant (FDR < 0.05): {len(sig_fdr05)}")
     print(f"Significant (FDR < 0.1): {len(sig_fdr01)}")
+    print(f"Significant (Mann-Whitney FDR < 0.1): {(results_df['FDR_MWU'] < 0.1).sum()}")
     print(f"Nominal (p < 0.01): {len(nom_sig_01)}")
     print(f"Nominal (p < 0.05): {len(nom_sig)}")
     print(f"Max |Log2FC|: {results_df['Log2FC'].abs().max():.4f}")
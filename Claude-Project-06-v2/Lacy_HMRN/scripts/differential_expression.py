@@ -0,0 +1,846 @@
+"""
+Vectorized Differential Expression
+Two-group t-tests for every probe at once
+
+Replaces the per-probe `stats.ttest_ind` loops of the Lacy DE scripts. Given
+the (probes x samples) expression matrix and two sample masks, group means,
+variances, Student's t (pooled variance, as ttest_ind's default), two-sided
+p-values, log2 fold change and Cohen's d are computed with array operations
+over blocks of probes. Missing values (NaN) are masked per probe, so each
+probe uses exactly the samples it has values for.
+
+A probe is tested only if both groups have at least `min_n` values and
+non-zero variance - the same filter the scripts applied inside their loops.
+
+For several contrasts over the same samples (subtypes x risk/stage groups),
+GroupStats accumulates per-cell count/sum/sum-of-squares in one pass over
+the matrix and derives each contrast from those.
+
+moderated=True replaces the ordinary t with limma's empirical-Bayes
+moderated t (Smyth 2004): a scaled inverse-chi-square prior is fitted to
+the residual variances of all probes, each probe's variance is shrunk
+towards it, and the prior degrees of freedom are added to the residual
+ones. This stabilizes small subgroups (MHG, UNC) at no extra cost.
+
+permutation_fdr() adds label-permutation p-values and FDR: each chunk of
+permutations is one matrix product against the expression block, and
+chunks run in a process pool with independent, seeded RNG streams.
+bootstrap_effects() uses the same machinery for percentile CIs of log2FC
+and Cohen's d, resampling patients within each group.
+
+stream_ttest() runs the ordinary t-test over a SeriesMatrixStream without
+ever holding the matrix: each block of rows is reduced to per-group
+count/mean/variance and its result rows are emitted before the next block
+is read.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+from series_matrix import resolve_workers
+
+# Probes per block: bounds the temporaries to block x group-size arrays
+PROBE_BLOCK = 4096
+
+# Added to both means before the log2 ratio (as in the original scripts)
+PSEUDOCOUNT = 0.01
+
+# Label permutations evaluated together (one matrix product) and per pool task
+PERM_CHUNK = 50
+
+# Bootstrap replicates evaluated together and per pool task
+BOOT_CHUNK = 50
+
+# Worker processes of permutation_fdr / bootstrap_effects (None: one per CPU)
+WORKERS = None
+
+
+def group_moments(values, mask, block_size=PROBE_BLOCK):
+    """
+    Per-probe count, mean and population variance (ddof=0) of the masked samples.
+
+    `values` is (probes x samples), e.g. a memory map from ExpressionStore;
+    `mask` is a boolean sample mask or an array of sample positions. NaNs are
+    excluded probe by probe. Returns (n, mean, var) arrays; mean/var are NaN
+    where n == 0.
+    """
+    cols = np.asarray(mask)
+    if cols.dtype == bool:
+        cols = np.flatnonzero(cols)
+    n_probes = values.shape[0]
+    n = np.zeros(n_probes, dtype=np.int64)
+    mean = np.full(n_probes, np.nan)
+    var = np.full(n_probes, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, n_probes, block_size):
+            stop = min(start + block_size, n_probes)
+            x = np.asarray(values[start:stop][:, cols], dtype=np.float64)
+            present = ~np.isnan(x)
+            count = present.sum(axis=1)
+            # Shift each probe by its first observed value, so a constant probe
+            # is all zeros and its variance exactly 0 (0.1 * 3 / 3 != 0.1)
+            first = present.argmax(axis=1)
+            c = np.where(present.any(axis=1), x[np.arange(stop - start), first], 0.0)
+            d = np.where(present, x - c[:, None], 0.0)
+            mu = d.sum(axis=1) / count
+            dev = np.where(present, d - mu[:, None], 0.0)
+            n[start:stop] = count
+            mean[start:stop] = mu + c
+            var[start:stop] = (dev * dev).sum(axis=1) / count
+    return n, mean, var
+
+
+def ttest_from_moments(n_a, mean_a, var_a, n_b, mean_b, var_b):
+    """
+    Pooled-variance Student's t and two-sided p from group moments (var ddof=0).
+
+    Sign convention follows stats.ttest_ind(a, b): t > 0 when mean_a > mean_b.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df = n_a + n_b - 2
+        pooled = (n_a * var_a + n_b * var_b) / df
+        t = (mean_a - mean_b) / np.sqrt(pooled * (1.0 / n_a + 1.0 / n_b))
+        p = 2 * stats.t.sf(np.abs(t), df)
+    return t, p
+
+
+def trigamma_inverse(x):
+    """Solve trigamma(y) = x for y (Newton iteration, as limma's trigammaInverse)"""
+    x = np.asarray(x, dtype=np.float64)
+    y = 0.5 + 1.0 / x
+    for _ in range(50):
+        tri = special.polygamma(1, y)
+        dif = tri * (1 - tri / x) / special.polygamma(2, y)
+        y = y + dif
+        if np.all(-dif / y < 1e-8):
+            break
+    y = np.where(x > 1e7, 1.0 / np.sqrt(x), y)
+    return np.where(x < 1e-6, 1.0 / x, y)
+
+
+def fit_f_dist(s2, df):
+    """
+    Prior (df0, s0^2) of a scaled F distribution fitted to residual variances.
+
+    Method of moments on log(s2) (limma's fitFDist, non-robust); only finite,
+    positive variances with df > 0 are used. df0 is inf when the observed
+    spread is no more than sampling noise, i.e. all probes share one variance.
+    """
+    ok = np.isfinite(s2) & (s2 > 0) & (df > 0)
+    s2, df = s2[ok], df[ok]
+    if len(s2) < 2:
+        return np.inf, np.nan
+    e = np.log(s2) - special.digamma(df / 2) + np.log(df / 2)
+    emean = e.mean()
+    evar = ((e - emean) ** 2).sum() / (len(e) - 1) - special.polygamma(1, df / 2).mean()
+    if evar <= 0:
+        return np.inf, float(np.exp(emean))
+    df0 = float(2 * trigamma_inverse(evar))
+    s0_sq = float(np.exp(emean + special.digamma(df0 / 2) - np.log(df0 / 2)))
+    return df0, s0_sq
+
+
+def squeeze_var(s2, df, df0, s0_sq):
+    """Posterior (shrunken) variances: (df0 * s0^2 + df * s2) / (df0 + df)"""
+    if np.isinf(df0):
+        return np.full_like(s2, s0_sq, dtype=np.float64)
+    return (df0 * s0_sq + df * s2) / (df0 + df)
+
+
+def moderated_ttest_from_moments(n_a, mean_a, var_a, n_b, mean_b, var_b):
+    """
+    Empirical-Bayes moderated t (same sign as ttest_from_moments) and p-values.
+
+    Returns (t, p, df_total, s2_post, df0, s0_sq).
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df = (n_a + n_b - 2).astype(np.float64)
+        s2 = (n_a * var_a + n_b * var_b) / df
+        df0, s0_sq = fit_f_dist(s2, df)
+        s2_post = squeeze_var(s2, df, df0, s0_sq)
+        t = (mean_a - mean_b) / np.sqrt(s2_post * (1.0 / n_a + 1.0 / n_b))
+        df_total = df + df0
+        if np.isinf(df0):
+            p = 2 * stats.norm.sf(np.abs(t))
+        else:
+            p = 2 * stats.t.sf(np.abs(t), df_total)
+    return t, p, df_total, s2_post, df0, s0_sq
+
+
+def two_group_ttest(values, mask_a, mask_b, probe_ids=None, min_n=5,
+                    pseudocount=PSEUDOCOUNT, block_size=PROBE_BLOCK, moderated=False):
+    """
+    Genome-wide two-group comparison (group b vs group a).
+
+    Returns a DataFrame with one row per probe (indexed by `probe_ids` when
+    given): n_a, n_b, mean_a, mean_b, var_a, var_b (ddof=1), Log2FC
+    (log2((mean_b + pc) / (mean_a + pc))), Cohens_d ((mean_b - mean_a) over
+    the root mean of the two ddof=0 variances), T_stat and P_value
+    (ttest_ind(a, b)), and `tested` - the min-n / non-zero-variance filter.
+    Statistics of untested probes are still filled in where defined.
+
+    moderated=True gives moderated T_stat/P_value plus df_total and s2_post
+    columns; the fitted prior is in result.attrs ('df_prior', 's2_prior').
+    """
+    n_a, mean_a, var0_a = group_moments(values, mask_a, block_size)
+    n_b, mean_b, var0_b = group_moments(values, mask_b, block_size)
+    return compare_moments(n_a, mean_a, var0_a, n_b, mean_b, var0_b, probe_ids, min_n,
+                           pseudocount, moderated)
+
+
+def compare_moments(n_a, mean_a, var0_a, n_b, mean_b, var0_b, probe_ids=None, min_n=5,
+                    pseudocount=PSEUDOCOUNT, moderated=False):
+    """two_group_ttest's result table from per-probe group moments (var ddof=0)"""
+    if moderated:
+        t, p, df_total, s2_post, df0, s0_sq = moderated_ttest_from_moments(
+            n_a, mean_a, var0_a, n_b, mean_b, var0_b)
+    else:
+        t, p = ttest_from_moments(n_a, mean_a, var0_a, n_b, mean_b, var0_b)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log2fc = np.log2((mean_b + pseudocount) / (mean_a + pseudocount))
+        pooled_sd = np.sqrt((var0_a + var0_b) / 2)
+        cohens_d = np.where(pooled_sd > 0, (mean_b - mean_a) / pooled_sd, 0.0)
+        var_a = var0_a * n_a / (n_a - 1)
+        var_b = var0_b * n_b / (n_b - 1)
+
+    tested = (n_a >= min_n) & (n_b >= min_n) & (var0_a > 0) & (var0_b > 0)
+    index = pd.Index(probe_ids, name='Probe') if probe_ids is not None else None
+    result = pd.DataFrame({
+        'n_a': n_a, 'n_b': n_b,
+        'mean_a': mean_a, 'mean_b': mean_b,
+        'var_a': var_a, 'var_b': var_b,
+        'Log2FC': log2fc, 'Cohens_d': cohens_d,
+        'T_stat': t, 'P_value': p,
+        'tested': tested,
+    }, index=index)
+    if moderated:
+        result['df_total'] = df_total
+        result['s2_post'] = s2_post
+        result.attrs['df_prior'] = df0
+        result.attrs['s2_prior'] = s0_sq
+    return result
+
+
+def de_table(result, names, directions, cohens_d=False, extra=()):
+    """
+    Tested probes in the scripts' results layout.
+
+    `names` labels the mean columns (e.g. ('StageI', 'StageIII_IV') ->
+    Mean_StageI, Mean_StageIII_IV); `directions` = (label when Log2FC <= 0,
+    label when Log2FC > 0). Columns: Probe, Mean_<a>, Mean_<b>, Log2FC,
+    [Cohens_d], T_stat, P_value, Direction, then any `extra` result columns
+    (e.g. P_perm, FDR_perm) - in probe order.
+    """
+    tested = result[result['tested']]
+    table = pd.DataFrame({
+        'Probe': tested.index,
+        f'Mean_{names[0]}': tested['mean_a'].to_numpy(),
+        f'Mean_{names[1]}': tested['mean_b'].to_numpy(),
+        'Log2FC': tested['Log2FC'].to_numpy(),
+    })
+    if cohens_d:
+        table['Cohens_d'] = tested['Cohens_d'].to_numpy()
+    table['T_stat'] = tested['T_stat'].to_numpy()
+    table['P_value'] = tested['P_value'].to_numpy()
+    table['Direction'] = np.where(table['Log2FC'] > 0, directions[1], directions[0])
+    for col in extra:
+        table[col] = tested[col].to_numpy()
+    return table
+
+
+# =============================================================================
+# Sufficient statistics per sample cell
+# =============================================================================
+
+def _cell_keys(factors, columns=None):
+    """One cell tuple per row of a labels DataFrame (missing labels -> None)"""
+    if columns is not None:
+        factors = factors[list(columns)]
+    labels = factors.astype(object).where(factors.notna(), None)
+    return [tuple(row) for row in labels.itertuples(index=False, name=None)]
+
+
+def _matches(value, wanted):
+    if isinstance(wanted, (list, tuple, set)):
+        return value in wanted
+    return value == wanted
+
+
+class GroupStats:
+    """
+    Per-probe count, sum and sum of squares for every cell of a sample design.
+
+    Cells are the observed combinations of factor levels (e.g. COO x Risk);
+    missing labels form their own level (None), so pooled contrasts still
+    see every sample. Sums are taken around a per-probe shift (the probe's
+    first observed value), which keeps variances of near-constant probes
+    exact. Any contrast between unions of cells then costs O(probes x cells)
+    instead of a pass over the expression matrix.
+
+    The statistics are additive, so samples can be added or removed later
+    (add_samples / remove_samples, or update() against the current cohort)
+    at a cost proportional to the samples that changed; save() / load()
+    persist them between runs.
+    """
+
+    def __init__(self, factors, cells, n, sums, sumsq, shift, probe_ids=None, sample_cells=None,
+                 checksums=None):
+        self.factors = list(factors)
+        self.cells = list(cells)
+        self.n = n
+        self.sums = sums
+        self.sumsq = sumsq
+        self.shift = shift
+        self.probe_ids = probe_ids
+        self.sample_cells = sample_cells if sample_cells is not None else {}
+        # Checksum of each sample's column (column_checksums), to detect changed values
+        self.checksums = checksums if checksums is not None else {}
+
+    @classmethod
+    def from_matrix(cls, values, factors, probe_ids=None, block_size=PROBE_BLOCK, sample_ids=None):
+        """
+        Accumulate the statistics of a (probes x samples) matrix in one pass.
+
+        `factors` is a DataFrame (one row per matrix column) of the labels
+        that define the cells, e.g. clinical[['COO', 'Risk']]. Pass
+        `sample_ids` (matrix column order) to allow update() later.
+        """
+        keys = _cell_keys(factors)
+        cells = list(dict.fromkeys(keys))
+        code = {c: i for i, c in enumerate(cells)}
+        design = np.zeros((len(keys), len(cells)))
+        design[np.arange(len(keys)), [code[k] for k in keys]] = 1.0
+
+        n_probes = values.shape[0]
+        n = np.zeros((n_probes, len(cells)), dtype=np.int64)
+        sums = np.zeros((n_probes, len(cells)))
+        sumsq = np.zeros((n_probes, len(cells)))
+        shift = np.zeros(n_probes)
+        for start in range(0, n_probes, block_size):
+            stop = min(start + block_size, n_probes)
+            x = np.asarray(values[start:stop], dtype=np.float64)
+            present = ~np.isnan(x)
+            first = present.argmax(axis=1)
+            c = np.where(present.any(axis=1), x[np.arange(stop - start), first], 0.0)
+            d = np.where(present, x - c[:, None], 0.0)
+            shift[start:stop] = c
+            n[start:stop] = np.rint(present @ design).astype(np.int64)
+            sums[start:stop] = d @ design
+            sumsq[start:stop] = (d * d) @ design
+        sample_cells = dict(zip(sample_ids, keys)) if sample_ids is not None else None
+        return cls(factors.columns, cells, n, sums, sumsq, shift, probe_ids, sample_cells)
+
+    def _clear_cells(self, cells):
+        """Zero the count/sum/sum-of-squares columns of `cells` (positions)"""
+        self.n[:, cells] = 0
+        self.sums[:, cells] = 0.0
+        self.sumsq[:, cells] = 0.0
+
+    def _accumulate(self, values, keys, sign, block_size=PROBE_BLOCK):
+        """Add (sign=1) or subtract (sign=-1) sample columns `values` in cells `keys`"""
+        for key in keys:
+            if key not in self.cells:
+                self.cells.append(key)
+                self.n = np.hstack([self.n, np.zeros((len(self.n), 1), dtype=np.int64)])
+                self.sums = np.hstack([self.sums, np.zeros((len(self.sums), 1))])
+                self.sumsq = np.hstack([self.sumsq, np.zeros((len(self.sumsq), 1))])
+        code = {c: i for i, c in enumerate(self.cells)}
+        design = np.zeros((len(keys), len(self.cells)))
+        design[np.arange(len(keys)), [code[k] for k in keys]] = sign
+
+        n_probes = self.n.shape[0]
+        for start in range(0, n_probes, block_size):
+            stop = min(start + block_size, n_probes)
+            x = np.asarray(values[start:stop], dtype=np.float64)
+            present = ~np.isnan(x)
+            d = np.where(present, x - self.shift[start:stop, None], 0.0)
+            self.n[start:stop] += np.rint(present @ design).astype(np.int64)
+            self.sums[start:stop] += d @ design
+            self.sumsq[start:stop] += (d * d) @ design
+
+    def add_samples(self, values, factors, sample_ids=None):
+        """Add new samples: `values` is (probes x new samples), `factors` their labels"""
+        keys = _cell_keys(factors, self.factors)
+        if sample_ids is not None:
+            known = [s for s in sample_ids if s in self.sample_cells]
+            if known:
+                raise ValueError(f"Samples already included: {known[:5]}")
+        self._accumulate(values, keys, 1)
+        if sample_ids is not None:
+            self.sample_cells.update(zip(sample_ids, keys))
+
+    def remove_samples(self, values, factors, sample_ids=None):
+        """Remove previously added samples (their values and the labels they were added with)"""
+        keys = _cell_keys(factors, self.factors)
+        if sample_ids is not None:
+            unknown = [s for s in sample_ids if s not in self.sample_cells]
+            if unknown:
+                raise ValueError(f"Samples not included: {unknown[:5]}")
+        self._accumulate(values, keys, -1)
+        for s in (sample_ids if sample_ids is not None else ()):
+            del self.sample_cells[s]
+
+    def update(self, values, factors, sample_ids, checksums=None):
+        """
+        Bring the statistics in line with the current cohort.
+
+        `values` (probes x samples), `factors` and `sample_ids` describe the
+        whole current cohort in matrix column order. New samples are added,
+        relabelled samples move from the old cell to the new one, and the
+        cells of samples that left (whose values are no longer at hand) are
+        re-summed from their remaining samples. With `checksums` (sample ->
+        column_checksums entry) a sample whose values changed also has its
+        old cell re-summed; without them the values of samples already
+        included are assumed not to have changed. Returns (n_added,
+        n_removed, n_resummed_cells).
+        """
+        if not self.sample_cells and self.n.any():
+            raise ValueError("Statistics were built without sample IDs; cannot tell which samples changed")
+        keys = _cell_keys(factors, self.factors)
+        current = dict(zip(sample_ids, keys))
+        col = {s: i for i, s in enumerate(sample_ids)}
+        gone = [s for s in self.sample_cells if s not in current]
+        changed = [s for s in self.sample_cells if s in current and checksums is not None
+                   and s in self.checksums and checksums.get(s) != self.checksums[s]]
+        stale = {self.sample_cells[s] for s in gone + changed}
+        if stale:
+            self._clear_cells([self.cells.index(c) for c in stale])
+
+        n_new = sum(s not in self.sample_cells for s in sample_ids)
+        kept = {s for s, k in self.sample_cells.items() if s in current and k not in stale}
+        moved = [s for s in kept if current[s] != self.sample_cells[s]]
+        if moved:
+            self._accumulate(values[:, [col[s] for s in moved]], [self.sample_cells[s] for s in moved], -1)
+        # Every sample of a re-summed cell, plus new, moved and changed samples elsewhere
+        added = [s for s in sample_ids
+                 if current[s] in stale or s not in kept or current[s] != self.sample_cells[s]]
+        if added:
+            self._accumulate(values[:, [col[s] for s in added]], [current[s] for s in added], 1)
+        self.sample_cells = current
+        if checksums is not None:
+            self.checksums = {s: checksums[s] for s in sample_ids}
+        return n_new, len(gone), len(stale)
+
+    def save(self, path):
+        """Write the statistics to an .npz file (atomically)"""
+        meta = {'factors': self.factors, 'cells': [list(c) for c in self.cells],
+                'probe_ids': list(self.probe_ids) if self.probe_ids is not None else None,
+                'sample_cells': {s: list(c) for s, c in self.sample_cells.items()},
+                'checksums': self.checksums}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, n=self.n, sums=self.sums, sumsq=self.sumsq, shift=self.shift,
+                 meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Statistics written by save()"""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(meta['factors'], [tuple(c) for c in meta['cells']], data['n'], data['sums'],
+                       data['sumsq'], data['shift'], meta['probe_ids'],
+                       {s: tuple(c) for s, c in meta['sample_cells'].items()}, meta.get('checksums'))
+
+    def cells_where(self, **levels):
+        """Positions of the cells matching every `factor=level` (a level may be a list)"""
+        pos = [self.factors.index(f) for f in levels]
+        return [i for i, cell in enumerate(self.cells)
+                if all(_matches(cell[p], w) for p, w in zip(pos, levels.values()))]
+
+    def moments(self, **levels):
+        """Per-probe (n, mean, var ddof=0) of the union of matching cells"""
+        sel = self.cells_where(**levels)
+        n = self.n[:, sel].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m = self.sums[:, sel].sum(axis=1) / n
+            var = np.maximum(self.sumsq[:, sel].sum(axis=1) / n - m * m, 0.0)
+        return n, m + self.shift, var
+
+    def ttest(self, a, b, min_n=5, pseudocount=PSEUDOCOUNT, moderated=False):
+        """
+        Contrast group b vs group a, each given as {factor: level(s)}.
+
+        e.g. ttest({'COO': 'GCB', 'Risk': 'Low_Risk'}, {'COO': 'GCB', 'Risk': 'High_Risk'});
+        leave a factor out to pool over it. Same table as two_group_ttest.
+        """
+        n_a, mean_a, var_a = self.moments(**a)
+        n_b, mean_b, var_b = self.moments(**b)
+        return compare_moments(n_a, mean_a, var_a, n_b, mean_b, var_b, self.probe_ids,
+                               min_n, pseudocount, moderated)
+
+
+def column_checksums(values, sample_ids, block_size=PROBE_BLOCK):
+    """SHA-256 of every sample column of a (probes x samples) matrix, read in blocks of probes"""
+    hashes = [hashlib.sha256() for _ in sample_ids]
+    for start in range(0, values.shape[0], block_size):
+        block = np.ascontiguousarray(np.asarray(values[start:start + block_size], dtype=np.float64).T)
+        for h, column in zip(hashes, block):
+            h.update(column.tobytes())
+    return {s: h.hexdigest() for s, h in zip(sample_ids, hashes)}
+
+
+def cached_group_stats(path, values, factors, sample_ids, probe_ids=None, verbose=True):
+    """
+    GroupStats for the current cohort, kept up to date in the file at `path`.
+
+    The saved statistics are brought in line with the current samples by
+    GroupStats.update: added samples are summed in, and only the cells of
+    samples that left or whose values changed (per-sample column checksums)
+    are re-summed. They are rebuilt from the full matrix only when there is
+    no usable file or the probes or factors differ. Probes default to row
+    positions.
+    """
+    if probe_ids is None:
+        probe_ids = range(values.shape[0])
+    checksums = column_checksums(values, sample_ids)
+    cell_stats = None
+    if os.path.exists(path):
+        try:
+            cell_stats = GroupStats.load(path)
+        except (OSError, ValueError, KeyError):
+            cell_stats = None
+    if cell_stats is not None and (cell_stats.factors != list(factors.columns)
+                                   or cell_stats.probe_ids != list(probe_ids)):
+        cell_stats = None
+    if cell_stats is not None:
+        try:
+            added, removed, resummed = cell_stats.update(values, factors, sample_ids, checksums)
+            if verbose:
+                print(f"Group statistics updated from {os.path.basename(path)}: "
+                      f"{added} samples added, {removed} removed, {resummed} cells re-summed")
+        except ValueError as e:
+            if verbose:
+                print(f"Rebuilding group statistics: {e}")
+            cell_stats = None
+    if cell_stats is None:
+        cell_stats = GroupStats.from_matrix(values, factors, list(probe_ids), sample_ids=sample_ids)
+        cell_stats.checksums = checksums
+        if verbose:
+            print(f"Group statistics built for {len(sample_ids)} samples")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    cell_stats.save(path)
+    return cell_stats
+
+
+# =============================================================================
+# Streaming
+# =============================================================================
+
+def stream_ttest(stream, mask_a, mask_b, min_n=5, pseudocount=PSEUDOCOUNT):
+    """
+    Two-group comparison over a SeriesMatrixStream, one block of rows at a time.
+
+    Yields two_group_ttest's result table for each block as soon as it is
+    read, so memory stays O(chunk_rows x samples) for any number of probes.
+    Moderated t is not available here: its prior needs every probe's variance.
+    FDR needs all p-values - collect P_value (one float per probe) or write
+    the blocks out and correct afterwards.
+    """
+    for probe_ids, values in stream.chunks():
+        n_a, mean_a, var_a = group_moments(values, mask_a)
+        n_b, mean_b, var_b = group_moments(values, mask_b)
+        yield compare_moments(n_a, mean_a, var_a, n_b, mean_b, var_b, probe_ids, min_n,
+                              pseudocount)
+
+
+# =============================================================================
+# Permutation FDR
+# =============================================================================
+
+def _write_permutation_inputs(values, cols, block_size):
+    """
+    Temp .npy files with the compared samples, NaNs zeroed and each probe
+    shifted by its first observed value, plus the presence mask.
+
+    Returns ([centred path, present path], per-probe shift).
+    """
+    n_probes = values.shape[0]
+    shift = np.zeros(n_probes)
+    paths = []
+    for suffix in (".centred.npy", ".present.npy"):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        paths.append(path)
+    centred = np.lib.format.open_memmap(paths[0], mode='w+', dtype=np.float64,
+                                        shape=(n_probes, len(cols)))
+    present = np.lib.format.open_memmap(paths[1], mode='w+', dtype=bool,
+                                        shape=(n_probes, len(cols)))
+    for start in range(0, n_probes, block_size):
+        stop = min(start + block_size, n_probes)
+        x = np.asarray(values[start:stop][:, cols], dtype=np.float64)
+        ok = ~np.isnan(x)
+        first = ok.argmax(axis=1)
+        c = np.where(ok.any(axis=1), x[np.arange(stop - start), first], 0.0)
+        centred[start:stop] = np.where(ok, x - c[:, None], 0.0)
+        present[start:stop] = ok
+        shift[start:stop] = c
+    centred.flush()
+    present.flush()
+    del centred, present
+    return paths, shift
+
+
+def _permutation_chunk(centred_path, present_path, n_a, rows, thresholds, seed, n_perm,
+                       block_size=PROBE_BLOCK):
+    """
+    Worker: |t| exceedance counts for `n_perm` random relabellings.
+
+    Each relabelling is a column of a (samples x n_perm) indicator matrix,
+    so group sums, counts and sums of squares for all probes and all
+    permutations of the chunk come from three matrix products per block.
+    Returns, for each observed threshold, how many null |t| (over the
+    probes in `rows`) reach it, and the number of finite null statistics.
+    """
+    centred = np.load(centred_path, mmap_mode='r')
+    present = np.load(present_path, mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    m = centred.shape[1]
+    labels = np.zeros((m, n_perm))
+    for j in range(n_perm):
+        labels[rng.permutation(m)[:n_a], j] = 1.0
+
+    null = []
+    for start in range(0, len(rows), block_size):
+        r = rows[start:start + block_size]
+        x = np.asarray(centred[r])
+        ok = np.asarray(present[r], dtype=np.float64)
+        n_tot = ok.sum(axis=1)[:, None]
+        s_tot = x.sum(axis=1)[:, None]
+        q_tot = (x * x).sum(axis=1)[:, None]
+        n1 = ok @ labels
+        s1 = x @ labels
+        q1 = (x * x) @ labels
+        n2, s2, q2 = n_tot - n1, s_tot - s1, q_tot - q1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m1, m2 = s1 / n1, s2 / n2
+            v1 = np.maximum(q1 / n1 - m1 * m1, 0.0)
+            v2 = np.maximum(q2 / n2 - m2 * m2, 0.0)
+            df = n1 + n2 - 2
+            t = (m1 - m2) / np.sqrt((n1 * v1 + n2 * v2) / df * (1.0 / n1 + 1.0 / n2))
+        t = np.abs(t[np.isfinite(t)])
+        null.append(t)
+    null = np.sort(np.concatenate(null))
+    exceed = len(null) - np.searchsorted(null, thresholds, side='left')
+    return exceed, len(null)
+
+
+def permutation_fdr(values, mask_a, mask_b, n_perm=1000, probe_ids=None, min_n=5,
+                    workers=WORKERS, seed=0, chunk=PERM_CHUNK, block_size=PROBE_BLOCK):
+    """
+    two_group_ttest plus permutation p-values and FDR (columns P_perm, FDR_perm).
+
+    Group labels are shuffled across the pooled a+b samples `n_perm` times;
+    the null |t| of all tested probes are pooled. For a probe with observed
+    |t| = x:
+      P_perm   = (1 + #null >= x) / (1 + #null)
+      FDR_perm = (#null >= x / n_perm) / (#observed >= x), made monotone
+    Permutations are split into chunks of `chunk`, each with its own child
+    of SeedSequence(seed), so results depend on `seed` but not on `workers`
+    (None = one per CPU, 1 = in-process). On spawn platforms (Windows,
+    macOS) workers > 1 needs an `if __name__ == "__main__":` guard in the
+    calling script.
+    """
+    result = two_group_ttest(values, mask_a, mask_b, probe_ids, min_n, block_size=block_size)
+    idx_a, idx_b = (np.flatnonzero(np.asarray(m)) if np.asarray(m).dtype == bool
+                    else np.asarray(m, dtype=np.intp) for m in (mask_a, mask_b))
+    cols = np.concatenate([idx_a, idx_b])
+
+    tested = result['tested'].to_numpy()
+    rows = np.flatnonzero(tested)
+    observed = np.abs(result['T_stat'].to_numpy()[rows])
+    order = np.argsort(observed, kind='stable')
+    thresholds = observed[order]
+
+    sizes = [min(chunk, n_perm - start) for start in range(0, n_perm, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    exceed = np.zeros(len(rows), dtype=np.int64)
+    n_null = 0
+    (centred_path, present_path), _ = _write_permutation_inputs(values, cols, block_size)
+    try:
+        args = [(centred_path, present_path, len(idx_a), rows, thresholds, seeds[i], sizes[i],
+                 block_size) for i in range(len(sizes))]
+        workers = resolve_workers(workers)
+        if workers == 1:
+            parts = [_permutation_chunk(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_permutation_chunk, *zip(*args)))
+        for counts, n in parts:
+            exceed += counts
+            n_null += n
+    finally:
+        os.remove(centred_path)
+        os.remove(present_path)
+
+    p_perm = (1 + exceed) / (1 + n_null)
+    called = len(thresholds) - np.searchsorted(thresholds, thresholds, side='left')
+    fdr = np.minimum(1.0, (exceed / n_perm) / called)
+    # q-value: smallest FDR at this or any lower threshold (thresholds ascending)
+    fdr = np.minimum.accumulate(fdr)
+
+    p_col = np.full(len(result), np.nan)
+    fdr_col = np.full(len(result), np.nan)
+    p_col[rows[order]] = p_perm
+    fdr_col[rows[order]] = fdr
+    result['P_perm'] = p_col
+    result['FDR_perm'] = fdr_col
+    result.attrs['n_perm'] = n_perm
+    return result
+
+
+# =============================================================================
+# Bootstrap confidence intervals
+# =============================================================================
+
+def _resample_weights(rng, n, n_boot):
+    """(n x n_boot) multiplicities of n draws with replacement, one column per replicate"""
+    draws = rng.integers(0, n, size=(n_boot, n))
+    weights = np.zeros((n_boot, n))
+    np.add.at(weights, (np.arange(n_boot)[:, None], draws), 1.0)
+    return weights.T
+
+
+def _bootstrap_chunk(centred_path, present_path, n_a, rows, shift, seed, n_boot, out_paths,
+                     offset, top_k, pseudocount=PSEUDOCOUNT, block_size=PROBE_BLOCK):
+    """
+    Worker: log2FC and Cohen's d of `n_boot` within-group resamples.
+
+    Resampling is a multiplicity matrix per group, so weighted counts, sums
+    and sums of squares of all probes come from matrix products. Effects go
+    to columns [offset, offset + n_boot) of the two memory-mapped outputs;
+    returns how often each probe is among the `top_k` largest |d|.
+    """
+    centred = np.load(centred_path, mmap_mode='r')
+    present = np.load(present_path, mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    w_a = _resample_weights(rng, n_a, n_boot)
+    w_b = _resample_weights(rng, centred.shape[1] - n_a, n_boot)
+
+    lfc = np.empty((len(rows), n_boot), dtype=np.float32)
+    d = np.empty((len(rows), n_boot), dtype=np.float32)
+    for start in range(0, len(rows), block_size):
+        r = rows[start:start + block_size]
+        x = np.asarray(centred[r])
+        ok = np.asarray(present[r], dtype=np.float64)
+        moments = []
+        for cols, w in ((slice(0, n_a), w_a), (slice(n_a, None), w_b)):
+            xg = x[:, cols]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                n = ok[:, cols] @ w
+                m = (xg @ w) / n
+                moments.append((m, np.maximum((xg * xg) @ w / n - m * m, 0.0)))
+        (m_a, v_a), (m_b, v_b) = moments
+        c = shift[r][:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lfc[start:start + len(r)] = np.log2((m_b + c + pseudocount) / (m_a + c + pseudocount))
+            sd = np.sqrt((v_a + v_b) / 2)
+            d[start:start + len(r)] = np.where(sd > 0, (m_b - m_a) / sd, 0.0)
+
+    for path, block in zip(out_paths, (lfc, d)):
+        out = np.load(path, mmap_mode='r+')
+        out[:, offset:offset + n_boot] = block
+        out.flush()
+        del out
+
+    in_top = np.zeros(len(rows), dtype=np.int64)
+    k = min(top_k, len(rows))
+    if k > 0:
+        size = np.where(np.isnan(d), -np.inf, np.abs(d))
+        top = np.argpartition(-size, k - 1, axis=0)[:k]
+        np.add.at(in_top, top.ravel(), 1)
+    return in_top
+
+
+def _row_percentiles(x, q):
+    """Per-row percentiles (linear interpolation) ignoring NaNs, without nanpercentile's row loop"""
+    x = np.sort(x, axis=1)
+    n = (~np.isnan(x)).sum(axis=1)
+    out = np.full((len(x), len(q)), np.nan)
+    ok = n > 0
+    for j, qj in enumerate(q):
+        pos = qj / 100.0 * (n[ok] - 1)
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo + 1, n[ok] - 1)
+        xo = x[ok]
+        v_lo = np.take_along_axis(xo, lo[:, None], axis=1)[:, 0]
+        v_hi = np.take_along_axis(xo, hi[:, None], axis=1)[:, 0]
+        out[ok, j] = v_lo + (pos - lo) * (v_hi - v_lo)
+    return out
+
+
+def bootstrap_effects(values, mask_a, mask_b, n_boot=1000, probe_ids=None, min_n=5, top_k=100,
+                      ci=0.95, workers=WORKERS, seed=0, chunk=BOOT_CHUNK, pseudocount=PSEUDOCOUNT,
+                      block_size=PROBE_BLOCK):
+    """
+    Percentile bootstrap CIs for Log2FC and Cohen's d (group b vs group a).
+
+    Patients are resampled with replacement within each group `n_boot`
+    times; probes with at least `min_n` values in both groups are included.
+    Columns: Log2FC_lo, Log2FC_hi, Cohens_d_lo, Cohens_d_hi (the `ci`
+    percentile interval) and TopK_freq - the fraction of replicates in which
+    the probe is among the `top_k` largest |Cohen's d|. Chunks of `chunk`
+    replicates run in a process pool with their own SeedSequence(seed)
+    children, so results do not depend on `workers` (same caveat for spawn
+    platforms as permutation_fdr).
+    """
+    idx_a, idx_b = (np.flatnonzero(np.asarray(m)) if np.asarray(m).dtype == bool
+                    else np.asarray(m, dtype=np.intp) for m in (mask_a, mask_b))
+    n_a, _, _ = group_moments(values, idx_a, block_size)
+    n_b, _, _ = group_moments(values, idx_b, block_size)
+    rows = np.flatnonzero((n_a >= min_n) & (n_b >= min_n))
+
+    sizes = [min(chunk, n_boot - start) for start in range(0, n_boot, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    in_top = np.zeros(len(rows), dtype=np.int64)
+    (centred_path, present_path), shift = _write_permutation_inputs(
+        values, np.concatenate([idx_a, idx_b]), block_size)
+    out_paths = []
+    try:
+        for suffix in (".lfc.npy", ".d.npy"):
+            fd, path = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            out_paths.append(path)
+            np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                      shape=(len(rows), n_boot)).flush()
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        args = [(centred_path, present_path, len(idx_a), rows, shift, seeds[i], sizes[i],
+                 out_paths, int(offsets[i]), top_k, pseudocount, block_size)
+                for i in range(len(sizes))]
+        workers = resolve_workers(workers)
+        if workers == 1:
+            parts = [_bootstrap_chunk(*a) for a in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_bootstrap_chunk, *zip(*args)))
+        for counts in parts:
+            in_top += counts
+
+        q = [50 * (1 - ci), 50 * (1 + ci)]
+        bounds = np.full((values.shape[0], 4), np.nan)
+        for j, path in enumerate(out_paths):
+            boot = np.load(path, mmap_mode='r')
+            for start in range(0, len(rows), block_size):
+                r = rows[start:start + block_size]
+                block = np.asarray(boot[start:start + len(r)], dtype=np.float64)
+                bounds[r, 2 * j:2 * j + 2] = _row_percentiles(block, q)
+            del boot
+    finally:
+        for path in [centred_path, present_path] + out_paths:
+            os.remove(path)
+
+    freq = np.full(values.shape[0], np.nan)
+    freq[rows] = in_top / n_boot
+    index = pd.Index(probe_ids, name='Probe') if probe_ids is not None else None
+    result = pd.DataFrame({'Log2FC_lo': bounds[:, 0], 'Log2FC_hi': bounds[:, 1],
+                           'Cohens_d_lo': bounds[:, 2], 'Cohens_d_hi': bounds[:, 3],
+                           'TopK_freq': freq}, index=index)
+    result.attrs['n_boot'] = n_boot
+    result.attrs['top_k'] = top_k
+    return result
@@ -0,0 +1,198 @@
+"""
+Persistent Binary Cache for Parsed Series Matrices
+
+First load parses the series matrix (series_matrix.read_series_matrix) and
+writes the expression array as .npy plus a JSON sidecar with probe IDs,
+sample IDs and characteristics. Later loads are served from the cache.
+
+Cache entries are keyed by the source file's size and mtime; if those change
+the SHA-256 of the source is compared before deciding to re-parse, so a
+touched-but-identical file does not trigger a rebuild.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+from series_matrix import SeriesMatrix, characteristics_frame, read_series_matrix
+
+CACHE_VERSION = 1
+CACHE_DIRNAME = "cache"
+
+
+def default_cache_dir(source_path):
+    """Cache lives next to the source data so every script shares it"""
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), CACHE_DIRNAME)
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_fingerprint(path, with_hash=True):
+    """Size/mtime (and optionally content hash) identifying a source file"""
+    st = os.stat(path)
+    fp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        fp['sha256'] = file_sha256(path)
+    return fp
+
+
+def cache_entry_dir(source_path, cache_dir=None):
+    """Directory holding the cache entry for one source file"""
+    name = os.path.basename(source_path)
+    for ext in ('.gz', '.txt'):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.join(cache_dir or default_cache_dir(source_path), name)
+
+
+def _meta_path(entry):
+    return os.path.join(entry, "meta.json")
+
+
+def _values_path(entry, dtype):
+    return os.path.join(entry, f"values.{np.dtype(dtype).name}.npy")
+
+
+def atomic_write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _atomic_save_npy(path, array):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def read_json_meta(path, version):
+    """JSON sidecar at `path` (None if missing, unreadable or another version)"""
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == version else None
+
+
+def read_meta(entry):
+    """Sidecar metadata for a cache entry (None if missing/unreadable)"""
+    return read_json_meta(_meta_path(entry), CACHE_VERSION)
+
+
+def is_fresh(meta, source_path, meta_file=None):
+    """
+    True if cached metadata still matches the source file.
+
+    Size+mtime match is accepted directly; otherwise the content hash decides,
+    and a matching hash refreshes the mtime stored in `meta_file`.
+    """
+    if meta is None:
+        return False
+    quick = source_fingerprint(source_path, with_hash=False)
+    cached = meta['source']
+    if quick['size'] == cached['size'] and quick['mtime_ns'] == cached['mtime_ns']:
+        return True
+    if quick['size'] != cached['size']:
+        return False
+    if file_sha256(source_path) != cached['sha256']:
+        return False
+    if meta_file is not None:
+        meta['source']['mtime_ns'] = quick['mtime_ns']
+        atomic_write_json(meta_file, meta)
+    return True
+
+
+def write_cache(sm, source_path, cache_dir=None):
+    """Write a parsed SeriesMatrix to the cache; returns the entry directory"""
+    entry = cache_entry_dir(source_path, cache_dir)
+    os.makedirs(entry, exist_ok=True)
+
+    # Drop arrays (any dtype/layout) parsed from an older version of the source
+    for name in os.listdir(entry):
+        if name.endswith(".npy"):
+            os.remove(os.path.join(entry, name))
+    _atomic_save_npy(_values_path(entry, sm.values.dtype), sm.values)
+    chars = sm.characteristics
+    meta = {
+        'version': CACHE_VERSION,
+        'source': source_fingerprint(source_path),
+        'source_name': os.path.basename(source_path),
+        'shape': list(sm.values.shape),
+        'probe_ids': list(sm.probe_ids),
+        'sample_ids': list(sm.sample_ids),
+        'characteristics': {k: chars[k].tolist() for k in chars.columns},
+    }
+    atomic_write_json(_meta_path(entry), meta)
+    return entry
+
+
+def read_cache(entry, dtype=np.float64, mmap=False):
+    """
+    Load a SeriesMatrix from a cache entry (converting dtype if needed).
+
+    With mmap=True the values are a read-only memory map of the .npy, so
+    several processes share the OS page cache instead of private copies.
+    """
+    meta = read_meta(entry)
+    path = cached_values_path(entry, dtype)
+    values = np.load(path, mmap_mode='r' if mmap else None)
+    return SeriesMatrix(values, meta['probe_ids'], meta['sample_ids'],
+                        characteristics_frame(meta['sample_ids'], meta['characteristics']))
+
+
+def cached_values_path(entry, dtype=np.float64):
+    """Path of the cached array for `dtype`, converting from another dtype once"""
+    path = _values_path(entry, dtype)
+    if not os.path.exists(path):
+        cached = [f for f in os.listdir(entry) if f.startswith("values.") and f.endswith(".npy")]
+        values = np.load(os.path.join(entry, cached[0]), mmap_mode='r').astype(dtype)
+        _atomic_save_npy(path, values)
+    return path
+
+
+def ensure_cache(path, dtype=np.float64, cache_dir=None, verbose=True, workers=1):
+    """
+    Make sure a fresh cache entry exists for `path`; returns the entry directory.
+
+    Parses the source (and writes the cache) only when the entry is missing
+    or stale; `workers` is passed to read_series_matrix for that parse.
+    """
+    entry = cache_entry_dir(path, cache_dir)
+    meta = read_meta(entry)
+    if is_fresh(meta, path, _meta_path(entry)):
+        return entry
+
+    if verbose:
+        print(f"  Parsing {os.path.basename(path)} (building cache)...")
+    sm = read_series_matrix(path, dtype, workers=workers)
+    write_cache(sm, path, cache_dir)
+    return entry
+
+
+def load_series_matrix(path, dtype=np.float64, cache_dir=None, use_cache=True,
+                       mmap=False, verbose=True, workers=1):
+    """
+    Load a series matrix, serving from the binary cache when it is fresh.
+
+    Drop-in replacement for read_series_matrix(); the cache is (re)built on
+    the first load after the source changes. mmap=True memory-maps the
+    cached values instead of reading them into RAM. workers > 1 (None = one
+    per CPU) parses a cold cache in a process pool.
+    """
+    if not use_cache:
+        return read_series_matrix(path, dtype, workers=workers)
+
+    entry = ensure_cache(path, dtype, cache_dir, verbose, workers)
+    if verbose:
+        print(f"  Loading cached matrix: {entry}")
+    return read_cache(entry, dtype, mmap)
@@ -0,0 +1,198 @@
+"""
+Memory-Mapped Expression Store
+Labelled, zero-copy access to the cached series-matrix expression array
+
+The cache (expression_cache.py) holds the matrix probe-major
+(probes x samples). This module adds a sample-major copy (samples x probes)
+next to it and opens both read-only with np.load(mmap_mode='r'), so any
+number of analyses on one machine share the same pages of the OS cache.
+
+Subsetting returns an ExpressionView: contiguous selections are plain slices
+of the memory map (no copy); scattered sample/probe selections read only the
+selected rows from whichever layout keeps them contiguous on disk.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+from expression_cache import cached_values_path, ensure_cache, read_meta
+from series_matrix import characteristic_values, characteristics_frame
+
+# Rows copied at a time when building the sample-major layout
+TRANSPOSE_BLOCK = 1024
+
+
+def _sample_major_path(entry, dtype):
+    return os.path.join(entry, f"sample_major.{np.dtype(dtype).name}.npy")
+
+
+def build_sample_major(entry, dtype=np.float64, block=TRANSPOSE_BLOCK):
+    """
+    Write the samples x probes layout of a cache entry (if missing).
+
+    Transposes block by block through memory maps so the full matrix is never
+    held in RAM.
+    """
+    path = _sample_major_path(entry, dtype)
+    if os.path.exists(path):
+        return path
+
+    probe_major = np.load(cached_values_path(entry, dtype), mmap_mode='r')
+    n_probes, n_samples = probe_major.shape
+    tmp = path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(n_samples, n_probes))
+    for start in range(0, n_probes, block):
+        stop = min(start + block, n_probes)
+        out[:, start:stop] = probe_major[start:stop].T
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    return path
+
+
+def _as_index(selection, labels, lookup):
+    """
+    Normalize a selection (None, slice, boolean mask, labels or positions)
+    into a slice (when contiguous) or an integer index array.
+    """
+    if selection is None:
+        return slice(None)
+    if isinstance(selection, slice):
+        return selection
+    if isinstance(selection, pd.Series):
+        selection = selection.to_numpy()
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        if len(selection) != len(labels):
+            raise ValueError(f"Boolean mask has length {len(selection)}, expected {len(labels)}")
+        idx = np.flatnonzero(selection)
+    elif selection.dtype.kind in 'iu':
+        idx = selection.astype(np.intp)
+    else:
+        missing = [s for s in selection if s not in lookup]
+        if missing:
+            raise KeyError(f"{len(missing)} labels not in store, e.g. {missing[:3]}")
+        idx = np.array([lookup[s] for s in selection], dtype=np.intp)
+    # Contiguous ascending runs can be served as slices of the map
+    if len(idx) > 0 and np.all(np.diff(idx) == 1):
+        return slice(int(idx[0]), int(idx[-1]) + 1)
+    return idx
+
+
+class ExpressionView:
+    """A labelled (probes x samples) selection of an ExpressionStore"""
+
+    def __init__(self, store, probe_sel, sample_sel):
+        self.store = store
+        self._probe_sel = probe_sel
+        self._sample_sel = sample_sel
+        self.probe_ids = list(np.asarray(store.probe_ids, dtype=object)[probe_sel])
+        self.sample_ids = list(np.asarray(store.sample_ids, dtype=object)[sample_sel])
+
+    @property
+    def shape(self):
+        return (len(self.probe_ids), len(self.sample_ids))
+
+    @property
+    def values(self):
+        """
+        The selected submatrix as a (probes x samples) array.
+
+        Slice selections are views of the memory map. Scattered sample
+        selections are read from the sample-major layout (one contiguous row
+        per sample) and returned transposed, so only the selected samples are
+        copied.
+        """
+        p, s = self._probe_sel, self._sample_sel
+        if isinstance(p, slice) and isinstance(s, slice):
+            return self.store.probe_major[p, s]
+        if isinstance(p, slice):
+            return self.store.sample_major[s, p].T
+        if isinstance(s, slice):
+            return self.store.probe_major[p, s]
+        # Both scattered: pick the layout that reads fewer rows
+        if len(p) <= len(s):
+            return self.store.probe_major[p][:, s]
+        return self.store.sample_major[s][:, p].T
+
+    def iter_probe_blocks(self, block_size=4096):
+        """Yield (probe_ids, values) blocks so callers can stream large selections"""
+        n = len(self.probe_ids)
+        p = self._probe_sel
+        if isinstance(p, slice):
+            # Resolve start/stop/step so stepped and reversed slices stream too
+            p = range(*p.indices(len(self.store.probe_ids)))
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            if isinstance(p, range):
+                block = p[start:stop]
+                # A reversed block that ends at row 0 has stop -1: slice to the start
+                rows = slice(block.start, block.stop if block.stop >= 0 else None, block.step)
+            else:
+                rows = p[start:stop]
+            yield self.probe_ids[start:stop], self.store.probe_major[rows][:, self._sample_sel]
+
+    def to_frame(self):
+        """Selection as a DataFrame (probes as index, samples as columns)"""
+        return pd.DataFrame(np.asarray(self.values), index=self.probe_ids, columns=self.sample_ids)
+
+
+class ExpressionStore:
+    """Read-only, memory-mapped view of a cached expression matrix"""
+
+    def __init__(self, entry, dtype=np.float64):
+        meta = read_meta(entry)
+        if meta is None:
+            raise FileNotFoundError(f"No cache entry at {entry}")
+        self.entry = entry
+        self.dtype = np.dtype(dtype)
+        self.probe_ids = meta['probe_ids']
+        self.sample_ids = meta['sample_ids']
+        self.characteristics = characteristics_frame(meta['sample_ids'], meta['characteristics'])
+        self._probe_lookup = {p: i for i, p in enumerate(self.probe_ids)}
+        self._sample_lookup = {s: i for i, s in enumerate(self.sample_ids)}
+        self.probe_major = np.load(cached_values_path(entry, dtype), mmap_mode='r')
+        self._sample_major = None
+
+    @property
+    def shape(self):
+        return self.probe_major.shape
+
+    @property
+    def sample_major(self):
+        """(samples x probes) memory map, built on first use"""
+        if self._sample_major is None:
+            self._sample_major = np.load(build_sample_major(self.entry, self.dtype), mmap_mode='r')
+        return self._sample_major
+
+    def select(self, samples=None, probes=None):
+        """
+        Labelled view of a sample/probe subset.
+
+        `samples`/`probes` may be None (all), a boolean mask, a list of IDs,
+        integer positions, or a slice.
+        """
+        s = _as_index(samples, self.sample_ids, self._sample_lookup)
+        p = _as_index(probes, self.probe_ids, self._probe_lookup)
+        return ExpressionView(self, p, s)
+
+    def characteristic(self, key, convert=None):
+        """Values of one `key: value` characteristic in sample order"""
+        return characteristic_values(self.characteristics, key, convert)
+
+    def sample_mask(self, column, values):
+        """Boolean sample mask from a characteristics column, e.g. ('pred_combine', ['GCB'])"""
+        if isinstance(values, str):
+            values = [values]
+        return self.characteristics[column].isin(values).to_numpy()
+
+    def probe_values(self, probe_id):
+        """One probe across all samples (a view of the map)"""
+        return self.probe_major[self._probe_lookup[probe_id]]
+
+
+def open_store(path, dtype=np.float64, cache_dir=None, verbose=True, workers=1):
+    """Open the memory-mapped store for a series matrix, building the cache if needed"""
+    entry = ensure_cache(path, dtype, cache_dir, verbose, workers)
+    return ExpressionStore(entry, dtype)
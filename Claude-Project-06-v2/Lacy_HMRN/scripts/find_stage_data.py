@@ -5,6 +5,8 @@ Find stage data in Lacy/HMRN dataset
 import pandas as pd
 import os
 
+from clinical_metadata import load_clinical
+
 lacy_dir = "C:/Users/ericp/OneDrive/Desktop/Claude-Projects/Claude-Project-06/Lacy_HMRN"
 
 print("=" * 60)
@@ -25,17 +27,16 @@ try:
 except Exception as e:
     print(f"  Error: {e}")
 
-# Check series matrix for stage
+# Check series matrix for stage (metadata section only, no expression block)
 print("\n2. Series matrix metadata:")
-import gzip
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 try:
-    with gzip.open(series_file, 'rt') as f:
-        for i, line in enumerate(f):
-            if i > 200:
-                break
-            if 'stage' in line.lower() or 'ann_arbor' in line.lower():
-                print(f"  Line {i}: {line[:100]}...")
+    clinical = load_clinical(series_file)
+    print(f"  Samples: {len(clinical)}, characteristics: {list(clinical.columns)}")
+    stage_cols = [c for c in clinical.columns if 'stage' in c.lower() or 'ann_arbor' in c.lower()]
+    for col in stage_cols:
+        print(f"  {col} ({clinical[col].dtype}):")
+        print(clinical[col].value_counts(dropna=False).to_string())
 except Exception as e:
     print(f"  Error: {e}")
 
@@ -8,9 +8,10 @@ import numpy as np
 from scipy import stats
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import gzip
 import os
 
+from clinical_metadata import load_clinical
+
 print("=" * 70)
 print("GENOMIC ANALYSIS: Mutations by Stage (Lacy/HMRN)")
 print("=" * 70 + "\n")
@@ -27,48 +28,19 @@ print("Extracting stage data from GEO series matrix...")
 
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 
-sample_ids = None
-stages = None
-pids = None
-coo = None
-
-with gzip.open(series_file, 'rt') as f:
-    for line in f:
-        if line.startswith("!Sample_geo_accession"):
-            parts = line.strip().split('\t')[1:]
-            sample_ids = [p.strip('"') for p in parts]
-        elif line.startswith("!Sample_characteristics_ch1") and "Stage:" in line:
-            parts = line.strip().split('\t')[1:]
-            stages = []
-            for p in parts:
-                p = p.strip('"')
-                if "Stage:" in p:
-                    stage = p.split(":")[-1].strip()
-                    stages.append(stage)
-                else:
-                    stages.append(None)
-        elif line.startswith("!Sample_characteristics_ch1") and "pid_pmid_32187361:" in line:
-            parts = line.strip().split('\t')[1:]
-            pids = []
-            for p in parts:
-                p = p.strip('"')
-                if "pid_pmid_32187361:" in p:
-                    pid = p.split(":")[-1].strip()
-                    pids.append(pid if pid else None)
-                else:
-                    pids.append(None)
-        elif line.startswith("!Sample_characteristics_ch1") and "coo_class:" in line:
-            parts = line.strip().split('\t')[1:]
-            coo = []
-            for p in parts:
-                p = p.strip('"')
-                if "coo_class:" in p:
-                    c = p.split(":")[-1].strip()
-                    coo.append(c)
-                else:
-                    coo.append(None)
-        elif line.startswith("!series_matrix_table_begin"):
-            break
+# Header-only read (typed, cached); PIDs kept as strings to match genomic_data.csv
+clinical = load_clinical(series_file, dtypes={'pid_pmid_32187361': str})
+
+def clinical_column(key):
+    """Characteristic as a list (None when missing), or None if absent"""
+    if key not in clinical.columns:
+        return None
+    return [None if pd.isna(v) else v for v in clinical[key].astype(object)]
+
+sample_ids = clinical.index.tolist()
+stages = clinical_column('Stage')
+pids = clinical_column('pid_pmid_32187361')
+coo = clinical_column('coo_class')
 
 print(f"Samples: {len(sample_ids) if sample_ids else 0}")
 print(f"Stages extracted: {len([s for s in stages if s]) if stages else 0}")
@@ -0,0 +1,143 @@
+"""
+Covariate-Adjusted Linear-Model DE
+One design matrix, one QR factorization, all probes at once
+
+Fits expression ~ design (e.g. stage + COO + IPI) for every probe by
+ordinary least squares. The design is factorized once (X = QR); for a block
+of probes the coefficients are R^-1 Q' y, residual variances come from the
+same projection, and standard errors from diag((X'X)^-1) scaled by each
+probe's residual variance - a few matrix products per block instead of one
+regression per probe.
+
+Probes with missing values among the modelled samples cannot share the
+factorization; they are fitted individually on their observed samples
+(typically a handful). moderated=True shrinks the residual variances with
+the same empirical-Bayes prior as differential_expression.py.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from differential_expression import PROBE_BLOCK, fit_f_dist, squeeze_var
+
+
+def design_matrix(covariates, reference=None, intercept=True):
+    """
+    Model matrix from a per-sample covariate table.
+
+    Numeric columns enter as they are; other columns are treatment-coded
+    (one indicator per non-reference level, named '<column>[<level>]').
+    `reference` maps column -> reference level (default: first sorted level).
+    Samples with any missing covariate are dropped; returns (X, kept) where
+    `kept` is the boolean mask of modelled samples.
+    """
+    reference = reference or {}
+    kept = covariates.notna().all(axis=1).to_numpy()
+    data = covariates[kept]
+    columns = {}
+    if intercept:
+        columns['Intercept'] = np.ones(len(data))
+    for col in data.columns:
+        values = data[col]
+        if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            columns[col] = values.to_numpy(np.float64)
+            continue
+        levels = sorted(values.astype(str).unique())
+        ref = str(reference.get(col, levels[0]))
+        for level in levels:
+            if level != ref:
+                columns[f"{col}[{level}]"] = (values.astype(str) == level).to_numpy(np.float64)
+    return pd.DataFrame(columns, index=data.index), kept
+
+
+class LinearModelFit:
+    """Per-probe coefficients, standard errors, t and p for every design term"""
+
+    def __init__(self, terms, coef, se, df, s2, probe_ids=None, df_prior=None, s2_prior=None):
+        self.terms = list(terms)
+        self.coef = coef
+        self.se = se
+        self.df = df
+        self.s2 = s2
+        self.probe_ids = probe_ids
+        self.df_prior = df_prior
+        self.s2_prior = s2_prior
+        df_total = df + (df_prior if df_prior is not None else 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.t = coef / se
+            if df_prior is not None and np.isinf(df_prior):
+                self.p = 2 * stats.norm.sf(np.abs(self.t))
+            else:
+                self.p = 2 * stats.t.sf(np.abs(self.t), df_total[:, None])
+
+    def table(self, term):
+        """One term as a DataFrame: Coef, SE, T_stat, P_value, df"""
+        j = self.terms.index(term)
+        index = pd.Index(self.probe_ids, name='Probe') if self.probe_ids is not None else None
+        return pd.DataFrame({'Coef': self.coef[:, j], 'SE': self.se[:, j], 'T_stat': self.t[:, j],
+                             'P_value': self.p[:, j], 'df': self.df}, index=index)
+
+
+def lm_fit(values, design, samples=None, probe_ids=None, moderated=False,
+           block_size=PROBE_BLOCK):
+    """
+    Least-squares fit of every probe (row of `values`) on `design`.
+
+    `design` is the DataFrame from design_matrix(); `samples` gives the
+    matrix columns its rows correspond to (boolean mask or positions;
+    default: all columns, in order).
+    """
+    X = design.to_numpy(np.float64)
+    n, k = X.shape
+    cols = np.arange(values.shape[1]) if samples is None else np.asarray(samples)
+    if cols.dtype == bool:
+        cols = np.flatnonzero(cols)
+    if len(cols) != n:
+        raise ValueError(f"Design has {n} rows but {len(cols)} samples were selected")
+
+    Q, R = np.linalg.qr(X)
+    if np.linalg.matrix_rank(R) < k:
+        raise ValueError(f"Design is rank deficient (terms: {list(design.columns)})")
+    R_inv = np.linalg.inv(R)
+    unscaled = (R_inv ** 2).sum(axis=1)          # diag((X'X)^-1)
+    proj = R_inv @ Q.T                           # (k x n): y -> coefficients
+
+    n_probes = values.shape[0]
+    coef = np.full((n_probes, k), np.nan)
+    s2 = np.full(n_probes, np.nan)
+    df = np.full(n_probes, float(n - k))
+    se_unscaled = np.tile(np.sqrt(unscaled), (n_probes, 1))
+
+    for start in range(0, n_probes, block_size):
+        stop = min(start + block_size, n_probes)
+        Y = np.asarray(values[start:stop][:, cols], dtype=np.float64)
+        complete = ~np.isnan(Y).any(axis=1)
+        Yc = Y[complete]
+        B = Yc @ proj.T
+        resid = Yc - B @ X.T
+        rows = np.arange(start, stop)
+        coef[rows[complete]] = B
+        s2[rows[complete]] = (resid * resid).sum(axis=1) / (n - k)
+
+        # Probes with missing values: individual fits on their observed samples
+        for i in np.flatnonzero(~complete):
+            ok = ~np.isnan(Y[i])
+            Xi = X[ok]
+            if ok.sum() <= k or np.linalg.matrix_rank(Xi) < k:
+                continue
+            b, _, _, _ = np.linalg.lstsq(Xi, Y[i, ok], rcond=None)
+            dfi = ok.sum() - k
+            r = Y[i, ok] - Xi @ b
+            coef[start + i] = b
+            s2[start + i] = (r @ r) / dfi
+            df[start + i] = dfi
+            se_unscaled[start + i] = np.sqrt(np.diag(np.linalg.inv(Xi.T @ Xi)))
+
+    df_prior = s2_prior = None
+    s2_used = s2
+    if moderated:
+        df_prior, s2_prior = fit_f_dist(s2, df)
+        s2_used = squeeze_var(s2, df, df_prior, s2_prior)
+    se = se_unscaled * np.sqrt(s2_used)[:, None]
+    return LinearModelFit(design.columns, coef, se, df, s2, probe_ids, df_prior, s2_prior)
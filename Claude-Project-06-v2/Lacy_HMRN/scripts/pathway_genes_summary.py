@@ -6,6 +6,8 @@ From mortality signature analysis
 import pandas as pd
 import os
 
+from cohort_parquet import read_table
+
 print("=" * 80)
 print("EGRESS/RETENTION PATHWAY GENES: FDR and LogFC by Cohort")
 print("=" * 80)
@@ -22,22 +24,25 @@ ALL_GENES = EGRESS_GENES + RETENTION_GENES
 print(f"\nEgress genes: {EGRESS_GENES}")
 print(f"Retention genes: {RETENTION_GENES}")
 
-# Load results for each cohort
+# Load results for each cohort (only the pathway-gene rows and the columns used below)
 cohorts = {
-    'Global': 'mortality_signature_global.csv',
-    'GCB': 'mortality_signature_gcb.csv',
-    'ABC': 'mortality_signature_abc.csv',
-    'MHG': 'mortality_signature_mhg.csv',
-    'UNC': 'mortality_signature_unc.csv'
+    'Global': 'mortality_signature_global',
+    'GCB': 'mortality_signature_gcb',
+    'ABC': 'mortality_signature_abc',
+    'MHG': 'mortality_signature_mhg',
+    'UNC': 'mortality_signature_unc'
 }
+RESULT_COLUMNS = ['Gene_Symbol', 'Log2FC', 'P_value', 'FDR', 'Direction']
 
 results = {}
-for cohort, filename in cohorts.items():
-    filepath = os.path.join(results_dir, filename)
-    if os.path.exists(filepath):
-        df = pd.read_csv(filepath)
-        results[cohort] = df
-        print(f"Loaded {cohort}: {len(df)} probes")
+for cohort, name in cohorts.items():
+    try:
+        df = read_table(lacy_dir, name, columns=RESULT_COLUMNS,
+                        filters=[('Gene_Symbol', 'in', ALL_GENES)])
+    except FileNotFoundError:
+        continue
+    results[cohort] = df
+    print(f"Loaded {cohort}: {len(df)} pathway-gene probes")
 
 # =============================================================================
 # Extract pathway gene results
@@ -0,0 +1,164 @@
+"""
+Offline GPL14951 Platform Annotation
+Probe -> gene symbol / Entrez / Ensembl from the local SOFT file
+
+Streams Lacy_HMRN/GPL14951_family.soft.gz up to `!platform_table_end`
+(the family file continues with every sample table, which is never read),
+keeps only the ID/symbol/gene-ID columns of the platform table and caches
+the result as a compact probe-indexed table in cache/. Later lookups are a
+pickle load - no network access and no re-parse.
+"""
+
+import csv
+import os
+import pandas as pd
+
+from expression_cache import (atomic_write_json, cache_entry_dir, is_fresh, read_json_meta,
+                              source_fingerprint)
+from series_matrix import open_text
+
+SOFT_FILE = "GPL14951_family.soft.gz"
+LEGACY_CSV = "GPL14951_annotation.csv"
+
+PLATFORM_TABLE_BEGIN = "!platform_table_begin"
+PLATFORM_TABLE_END = "!platform_table_end"
+
+ANNOTATION_VERSION = 1
+
+# Platform table columns to keep, in order of preference for each field
+SYMBOL_COLUMNS = ['Symbol', 'ILMN_Gene', 'Gene_Symbol', 'Gene symbol']
+ENTREZ_COLUMNS = ['Entrez_Gene_ID', 'ENTREZ_GENE_ID', 'Gene ID']
+
+
+class _TableStream:
+    """File-like view of an open SOFT file that ends at `!platform_table_end`"""
+
+    def __init__(self, f):
+        self.f = f
+        self.done = False
+
+    def read(self, size=-1):
+        parts = []
+        n = 0
+        while not self.done and (size < 0 or n < size):
+            line = self.f.readline()
+            if not line or line.startswith(PLATFORM_TABLE_END):
+                self.done = True
+                break
+            parts.append(line)
+            n += len(line)
+        return ''.join(parts)
+
+
+def _is_ensembl(column):
+    return 'ensembl' in column.lower()
+
+
+def _wanted_column(column):
+    return (column == 'ID' or column in SYMBOL_COLUMNS or column in ENTREZ_COLUMNS
+            or _is_ensembl(column))
+
+
+def read_platform_table(soft_path, usecols=_wanted_column):
+    """
+    Read the `!platform_table_begin` block of a GEO SOFT file as strings.
+
+    Stops at `!platform_table_end`; `usecols` (names or a predicate) limits
+    which columns are materialized. Pass usecols=None for the full table.
+    """
+    with open_text(soft_path) as f:
+        for line in f:
+            if line.startswith(PLATFORM_TABLE_BEGIN):
+                break
+        else:
+            raise ValueError(f"No {PLATFORM_TABLE_BEGIN} block in {soft_path}")
+        return pd.read_csv(_TableStream(f), sep='\t', dtype=str, usecols=usecols,
+                           keep_default_na=False, na_values=[''],
+                           quoting=csv.QUOTE_NONE)
+
+
+def _text(values):
+    """Stripped strings, None for missing/blank"""
+    values = values.astype(object).str.strip()
+    return values.where(values.notna() & (values != ''), None)
+
+
+def _coalesce(table, candidates):
+    """Per-row first non-blank value across the candidate columns present"""
+    result = pd.Series(None, index=table.index, dtype=object)
+    for col in candidates:
+        if col in table.columns:
+            result = result.combine_first(_text(table[col]))
+    return result.where(result.notna(), None)
+
+
+def build_annotation(table):
+    """
+    Compact annotation from a platform table.
+
+    Index: Probe. Columns: Gene_Symbol, Entrez_ID (Int64; the first ID when
+    several are listed), Ensembl_ID (None when the platform has none).
+    """
+    entrez = _coalesce(table, ENTREZ_COLUMNS).str.extract(r'^(\d+)', expand=False)
+    annot = pd.DataFrame({
+        'Gene_Symbol': _coalesce(table, SYMBOL_COLUMNS),
+        'Entrez_ID': pd.to_numeric(entrez, errors='coerce').astype('Int64'),
+        'Ensembl_ID': _coalesce(table, [c for c in table.columns if _is_ensembl(c)]),
+    })
+    annot.index = pd.Index(_text(table['ID']), name='Probe')
+    return annot[annot.index.notna() & ~annot.index.duplicated()]
+
+
+def _annotation_paths(entry):
+    return os.path.join(entry, "annotation.pkl"), os.path.join(entry, "annotation.json")
+
+
+def load_annotation(soft_path, cache_dir=None, use_cache=True, verbose=True):
+    """
+    Probe-indexed annotation for a platform SOFT file.
+
+    Served from cache/<name>/annotation.pkl when it matches the SOFT file;
+    otherwise the platform table is streamed and the cache rewritten.
+    """
+    if not use_cache:
+        return build_annotation(read_platform_table(soft_path))
+
+    entry = cache_entry_dir(soft_path, cache_dir)
+    table_path, meta_path = _annotation_paths(entry)
+    meta = read_json_meta(meta_path, ANNOTATION_VERSION)
+    if is_fresh(meta, soft_path, meta_path) and os.path.exists(table_path):
+        return pd.read_pickle(table_path)
+
+    if verbose:
+        print(f"  Parsing platform table of {os.path.basename(soft_path)} (building annotation cache)...")
+    annot = build_annotation(read_platform_table(soft_path))
+    os.makedirs(entry, exist_ok=True)
+    tmp = table_path + ".tmp"
+    annot.to_pickle(tmp)
+    os.replace(tmp, table_path)
+    atomic_write_json(meta_path, {
+        'version': ANNOTATION_VERSION,
+        'source': source_fingerprint(soft_path),
+        'source_name': os.path.basename(soft_path),
+        'n_probes': len(annot),
+    })
+    return annot
+
+
+def load_probe_annotation(data_dir, verbose=True):
+    """
+    Probe/Gene_Symbol table for merging into DE results.
+
+    Uses the local GPL14951 SOFT file (plus Entrez_ID/Ensembl_ID columns);
+    falls back to the older GPL14951_annotation.csv. Only probes with a gene
+    symbol are returned; None if neither file exists.
+    """
+    soft_path = os.path.join(data_dir, SOFT_FILE)
+    if os.path.exists(soft_path):
+        annot = load_annotation(soft_path, verbose=verbose)
+        return annot[annot['Gene_Symbol'].notna()].reset_index()
+
+    csv_path = os.path.join(data_dir, LEGACY_CSV)
+    if os.path.exists(csv_path):
+        return pd.read_csv(csv_path)
+    return None
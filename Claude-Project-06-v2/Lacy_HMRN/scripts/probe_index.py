@@ -0,0 +1,293 @@
+"""
+Random-Access Probe Index
+Read a handful of probes without loading the whole expression matrix
+
+Gene-targeted scripts (tEgress, DZ/LZ, MYC signatures) need ~20 of ~30k
+probes. A ProbeIndex maps every probe ID to its position in a file and reads
+only the requested rows, so the cost is proportional to the number of
+probes asked for, not the platform size. Two backends:
+
+  CacheProbeIndex - byte offsets into the cached .npy (expression_cache.py);
+                    each probe is one seek + one contiguous read
+  BgzfProbeIndex  - virtual offsets into a block-gzip (BGZF) copy of the
+                    series matrix; each probe inflates one ~64 KB block.
+                    The copy is still a valid .gz (concatenated members), so
+                    zcat/gzip.open/R keep working on it.
+"""
+
+import gzip
+import io
+import json
+import os
+import struct
+import zlib
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+
+from expression_cache import (atomic_write_json, cache_entry_dir, cached_values_path,
+                              ensure_cache, is_fresh, read_json_meta, read_meta,
+                              source_fingerprint)
+from series_matrix import (TABLE_BEGIN, TABLE_END, characteristic_values, characteristics_frame,
+                           table_csv_options)
+from clinical_metadata import read_characteristics
+
+BGZF_INDEX_VERSION = 1
+
+# Uncompressed bytes per BGZF block (htslib's limit, so a block never exceeds 64 KB)
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_LEVEL = 6
+
+# Empty block that terminates every BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class ProbeIndex(ABC):
+    """Common interface: sample/probe labels, characteristics and targeted reads"""
+
+    def __init__(self, probe_ids, sample_ids, characteristics):
+        self.probe_ids = probe_ids
+        self.sample_ids = sample_ids
+        self.characteristics = characteristics
+        self._rows = {p: i for i, p in enumerate(probe_ids)}
+
+    def __contains__(self, probe_id):
+        return probe_id in self._rows
+
+    def characteristic(self, key, convert=None):
+        """Values of one `key: value` characteristic in sample order"""
+        return characteristic_values(self.characteristics, key, convert)
+
+    def read(self, probes):
+        """
+        Read the requested probes for all samples.
+
+        Returns (values, found) where values is (len(found) x n_samples) in
+        request order; unknown probe IDs are skipped.
+        """
+        found = list(dict.fromkeys(p for p in probes if p in self._rows))
+        rows = self._read_rows([self._rows[p] for p in found])
+        return rows, found
+
+    def read_dict(self, probes):
+        """Requested probes as {probe_id: values across samples}"""
+        values, found = self.read(probes)
+        return dict(zip(found, values))
+
+    @abstractmethod
+    def _read_rows(self, rows):
+        """(len(rows) x n_samples) values of the given row positions, in that order"""
+
+
+# =============================================================================
+# Cached .npy backend
+# =============================================================================
+
+def _npy_data_offset(path):
+    """Byte offset of the array data in a .npy file (after the header)"""
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+
+class CacheProbeIndex(ProbeIndex):
+    """Probe -> byte offset in the cached probe-major .npy"""
+
+    def __init__(self, entry, dtype=np.float64):
+        meta = read_meta(entry)
+        if meta is None:
+            raise FileNotFoundError(f"No cache entry at {entry}")
+        super().__init__(meta['probe_ids'], meta['sample_ids'],
+                         characteristics_frame(meta['sample_ids'], meta['characteristics']))
+        self.dtype = np.dtype(dtype)
+        self.values_path = cached_values_path(entry, dtype)
+        self.data_offset = _npy_data_offset(self.values_path)
+        self.row_bytes = len(self.sample_ids) * self.dtype.itemsize
+
+    def offset(self, probe_id):
+        """Byte offset of a probe's row in the .npy"""
+        return self.data_offset + self._rows[probe_id] * self.row_bytes
+
+    def _read_rows(self, rows):
+        n_samples = len(self.sample_ids)
+        out = np.empty((len(rows), n_samples), dtype=self.dtype)
+        order = np.argsort(rows, kind='stable')
+        with open(self.values_path, 'rb') as f:
+            # Visit rows in file order, merging adjacent rows into one read
+            i = 0
+            while i < len(order):
+                j = i
+                while j + 1 < len(order) and rows[order[j + 1]] == rows[order[j]] + 1:
+                    j += 1
+                f.seek(self.data_offset + rows[order[i]] * self.row_bytes)
+                block = np.fromfile(f, dtype=self.dtype, count=(j - i + 1) * n_samples)
+                out[order[i:j + 1]] = block.reshape(-1, n_samples)
+                i = j + 1
+        return out
+
+
+# =============================================================================
+# BGZF backend
+# =============================================================================
+
+def _bgzf_block(data, level=BGZF_LEVEL):
+    """One BGZF member: gzip header with the BC extra field + raw deflate"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    bsize = 18 + len(deflated) + 8
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                         ord('B'), ord('C'), 2, bsize - 1)
+    return header + deflated + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+def _read_bgzf_block(f, coffset):
+    """Inflate the block starting at compressed offset `coffset`; returns (data, next_coffset)"""
+    f.seek(coffset)
+    header = f.read(18)
+    if len(header) < 18 or header[:4] != b'\x1f\x8b\x08\x04' or header[12:14] != b'BC':
+        raise ValueError(f"Not a BGZF block at offset {coffset}")
+    bsize = struct.unpack('<H', header[16:18])[0] + 1
+    body = f.read(bsize - 18)
+    return zlib.decompress(body[:-8], -15), coffset + bsize
+
+
+def _bgzf_paths(source_path, cache_dir=None):
+    entry = cache_entry_dir(source_path, cache_dir)
+    return entry, os.path.join(entry, "series_matrix.bgz"), os.path.join(entry, "bgzf_index.json")
+
+
+def write_bgzf_copy(source_path, cache_dir=None, verbose=True):
+    """
+    Recompress a series matrix as BGZF and record the virtual offset of every probe row.
+
+    Virtual offset = (compressed block offset << 16) | offset within the
+    inflated block, as in htslib. Returns the index path.
+    """
+    entry, bgz_path, index_path = _bgzf_paths(source_path, cache_dir)
+    os.makedirs(entry, exist_ok=True)
+    if verbose:
+        print(f"  Writing BGZF copy of {os.path.basename(source_path)}...")
+
+    probe_ids = []
+    voffsets = []
+    in_table = False
+    header_done = False
+    coffset = 0
+    buf = bytearray()
+    tmp = bgz_path + ".tmp"
+
+    opener = gzip.open if source_path.endswith('.gz') else open
+    with opener(source_path, 'rb') as src, open(tmp, 'wb') as out:
+
+        def flush(n):
+            nonlocal coffset
+            block = _bgzf_block(bytes(buf[:n]))
+            out.write(block)
+            coffset += len(block)
+            del buf[:n]
+
+        for line in src:
+            if buf and len(buf) + len(line) > BGZF_BLOCK_SIZE:
+                flush(len(buf))
+            voffset = (coffset << 16) | len(buf)
+            buf += line
+            while len(buf) >= BGZF_BLOCK_SIZE:
+                flush(BGZF_BLOCK_SIZE)
+
+            if not in_table:
+                in_table = line.startswith(TABLE_BEGIN.encode())
+            elif not header_done:
+                header_done = True
+            elif line.startswith(TABLE_END.encode()):
+                in_table = False
+            elif line.strip():
+                probe_ids.append(line.split(b'\t', 1)[0].decode().strip().strip('"'))
+                voffsets.append(voffset)
+        if buf:
+            flush(len(buf))
+        out.write(BGZF_EOF)
+    os.replace(tmp, bgz_path)
+
+    chars = read_characteristics(source_path)
+    atomic_write_json(index_path, {
+        'version': BGZF_INDEX_VERSION,
+        'source': source_fingerprint(source_path),
+        'source_name': os.path.basename(source_path),
+        'sample_ids': chars.index.tolist(),
+        'characteristics': {k: chars[k].tolist() for k in chars.columns},
+        'probe_ids': probe_ids,
+        'voffsets': voffsets,
+    })
+    return index_path
+
+
+class BgzfProbeIndex(ProbeIndex):
+    """Probe -> virtual offset in a BGZF copy of the series matrix"""
+
+    def __init__(self, bgz_path, index_path, dtype=np.float64):
+        with open(index_path) as f:
+            index = json.load(f)
+        super().__init__(index['probe_ids'], index['sample_ids'],
+                         characteristics_frame(index['sample_ids'], index['characteristics']))
+        self.dtype = np.dtype(dtype)
+        self.bgz_path = bgz_path
+        self.voffsets = index['voffsets']
+
+    def offset(self, probe_id):
+        """BGZF virtual offset of a probe's row"""
+        return self.voffsets[self._rows[probe_id]]
+
+    def _read_line(self, f, voffset, blocks):
+        coffset, uoffset = voffset >> 16, voffset & 0xffff
+        parts = []
+        while True:
+            if coffset not in blocks:
+                blocks[coffset] = _read_bgzf_block(f, coffset)
+            data, next_coffset = blocks[coffset]
+            end = data.find(b'\n', uoffset)
+            if end >= 0:
+                parts.append(data[uoffset:end + 1])
+                return b''.join(parts)
+            # Row continues in the next block
+            parts.append(data[uoffset:])
+            coffset, uoffset = next_coffset, 0
+
+    def _read_rows(self, rows):
+        blocks = {}
+        lines = {}
+        with open(self.bgz_path, 'rb') as f:
+            for row in sorted(set(rows)):
+                lines[row] = self._read_line(f, self.voffsets[row], blocks)
+        n_samples = len(self.sample_ids)
+        if not rows:
+            return np.empty((0, n_samples), dtype=self.dtype)
+        text = b''.join(lines[r] for r in rows).decode()
+        frame = pd.read_csv(io.StringIO(text), **table_csv_options(n_samples))
+        return frame.to_numpy(self.dtype)
+
+
+# =============================================================================
+# Entry point
+# =============================================================================
+
+def open_probe_index(path, dtype=np.float64, cache_dir=None, bgzf=False, verbose=True):
+    """
+    Probe index for a series matrix.
+
+    Default: offsets into the binary cache (built on first use, like
+    load_series_matrix). bgzf=True uses (or writes) a BGZF copy instead,
+    which needs no uncompressed cache on disk.
+    """
+    if not bgzf:
+        entry = ensure_cache(path, dtype, cache_dir, verbose)
+        return CacheProbeIndex(entry, dtype)
+
+    entry, bgz_path, index_path = _bgzf_paths(path, cache_dir)
+    meta = read_json_meta(index_path, BGZF_INDEX_VERSION)
+    if not (is_fresh(meta, path, index_path) and os.path.exists(bgz_path)):
+        write_bgzf_copy(path, cache_dir, verbose)
+    return BgzfProbeIndex(bgz_path, index_path, dtype)
@@ -0,0 +1,156 @@
+"""
+Batched Rank Tests
+Mann-Whitney U and Kruskal-Wallis H for every probe from one shared sort
+
+RankMatrix sorts each probe's samples once (argsort of the whole matrix,
+NaNs last) and remembers where runs of tied values start. Any grouping -
+stage I vs III/IV, COO, IPI risk, within any subset of samples - is then
+ranked from that order with cumulative counts: samples outside the grouping
+are skipped, tied values get the average rank of the included members, and
+the tie-correction term sum(t^3 - t) comes out of the same pass. Each test
+therefore costs a few linear passes over the (probes x samples) order
+matrix instead of a sort per probe.
+
+p-values use the large-sample approximations with tie correction (normal
+with continuity correction for U, as mannwhitneyu(method='asymptotic');
+chi-square for H, as stats.kruskal).
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Probes per block when ranking (bounds the per-block temporaries)
+RANK_BLOCK = 2048
+
+
+def _label_codes(labels):
+    """Integer codes per sample (-1 for missing labels) and the level names"""
+    labels = pd.Series(np.asarray(labels, dtype=object))
+    codes, levels = pd.factorize(labels.where(labels.notna(), None), use_na_sentinel=True)
+    return codes.astype(np.int64), list(levels)
+
+
+class RankMatrix:
+    """Per-probe sort order of a (probes x samples) matrix, shared by all rank tests"""
+
+    def __init__(self, values, probe_ids=None, block_size=RANK_BLOCK):
+        n_probes, n_samples = values.shape
+        self.probe_ids = probe_ids
+        self.block_size = block_size
+        self.order = np.empty((n_probes, n_samples), dtype=np.int32)
+        self.run_start = np.empty((n_probes, n_samples), dtype=bool)
+        self.n_present = np.empty(n_probes, dtype=np.int64)
+        for start in range(0, n_probes, block_size):
+            stop = min(start + block_size, n_probes)
+            x = np.asarray(values[start:stop], dtype=np.float64)
+            order = np.argsort(x, axis=1, kind='stable')
+            s = np.take_along_axis(x, order, axis=1)
+            run = np.ones_like(s, dtype=bool)
+            run[:, 1:] = s[:, 1:] != s[:, :-1]
+            self.order[start:stop] = order
+            self.run_start[start:stop] = run
+            self.n_present[start:stop] = (~np.isnan(x)).sum(axis=1)
+
+    @property
+    def shape(self):
+        return self.order.shape
+
+    def _block_ranks(self, start, stop, codes):
+        """
+        Ranks among the samples with a label (code >= 0), in sorted order.
+
+        Returns (sorted codes, valid mask, ranks, tie term per probe).
+        """
+        order = self.order[start:stop]
+        run = self.run_start[start:stop]
+        n = order.shape[1]
+        pos = np.arange(n)
+        lab = codes[order]
+        valid = (lab >= 0) & (pos[None, :] < self.n_present[start:stop, None])
+        counts = np.cumsum(valid, axis=1, dtype=np.int32)
+        if run.all():
+            # No tied values in the block: ranks are the running counts
+            return lab, valid, counts.astype(np.float64), np.zeros(len(order))
+
+        # First and last sorted position of the tie run each position belongs to
+        first = np.maximum.accumulate(np.where(run, pos, 0), axis=1)
+        run_end = np.ones_like(run)
+        run_end[:, :-1] = run[:, 1:]
+        last = np.minimum.accumulate(np.where(run_end, pos, n - 1)[:, ::-1], axis=1)[:, ::-1]
+
+        before = np.take_along_axis(counts - valid, first, axis=1)
+        through = np.take_along_axis(counts, last, axis=1)
+        ranks = (before + 1 + through) / 2.0
+        t = (through - before).astype(np.float64)
+        ties = np.where(run_end, t ** 3 - t, 0.0).sum(axis=1)
+        return lab, valid, ranks, ties
+
+    def rank_sums(self, labels):
+        """
+        Per-probe group sizes and rank sums for a sample labelling.
+
+        `labels` has one entry per sample (None/NaN = not in the test).
+        Returns (levels, n, R, N, ties): n and R are (probes x levels).
+        """
+        codes, levels = _label_codes(labels)
+        n_probes = self.order.shape[0]
+        k = len(levels)
+        n = np.zeros((n_probes, k), dtype=np.int64)
+        R = np.zeros((n_probes, k))
+        ties = np.zeros(n_probes)
+        for start in range(0, n_probes, self.block_size):
+            stop = min(start + self.block_size, n_probes)
+            lab, valid, ranks, tie = self._block_ranks(start, stop, codes)
+            for j in range(k):
+                member = valid & (lab == j)
+                n[start:stop, j] = member.sum(axis=1)
+                R[start:stop, j] = np.where(member, ranks, 0.0).sum(axis=1)
+            ties[start:stop] = tie
+        return levels, n, R, n.sum(axis=1), ties
+
+    def mann_whitney(self, mask_a, mask_b):
+        """
+        Two-sided Mann-Whitney U test of group a vs group b for every probe.
+
+        Masks are boolean or sample positions. Columns: n_a, n_b, U_stat (U of
+        group a, as mannwhitneyu(a, b)), AUC (U / (n_a n_b), P(a > b)), Z, P_MWU.
+        """
+        labels = np.full(self.order.shape[1], None, dtype=object)
+        labels[np.asarray(mask_a)] = 'a'
+        if np.any(labels[np.asarray(mask_b)] == 'a'):
+            raise ValueError("Groups a and b overlap")
+        labels[np.asarray(mask_b)] = 'b'
+        levels, n, R, N, ties = self.rank_sums(labels)
+        n_a = n[:, levels.index('a')] if 'a' in levels else np.zeros(len(N), dtype=np.int64)
+        n_b = n[:, levels.index('b')] if 'b' in levels else np.zeros(len(N), dtype=np.int64)
+        r_a = R[:, levels.index('a')] if 'a' in levels else np.zeros(len(N))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            u_a = r_a - n_a * (n_a + 1) / 2.0
+            prod = (n_a * n_b).astype(np.float64)
+            mu = prod / 2.0
+            sigma = np.sqrt(prod / 12.0 * ((N + 1) - ties / (N * (N - 1))))
+            u = np.maximum(u_a, prod - u_a)
+            z = (u - mu - 0.5) / sigma
+            p = np.minimum(1.0, 2 * stats.norm.sf(z))
+            auc = u_a / prod
+        index = pd.Index(self.probe_ids, name='Probe') if self.probe_ids is not None else None
+        return pd.DataFrame({'n_a': n_a, 'n_b': n_b, 'U_stat': u_a, 'AUC': auc,
+                             'Z': z, 'P_MWU': p}, index=index)
+
+    def kruskal(self, labels):
+        """
+        Kruskal-Wallis H test across the groups of `labels` for every probe.
+
+        Groups empty for a probe (all NaN) do not count towards its df.
+        Columns: N, n_groups, H_stat, P_KW.
+        """
+        levels, n, R, N, ties = self.rank_sums(labels)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            h = 12.0 / (N * (N + 1)) * np.where(n > 0, R ** 2 / n, 0.0).sum(axis=1) - 3 * (N + 1)
+            h = h / (1 - ties / (N ** 3 - N))
+            k = (n > 0).sum(axis=1)
+            p = stats.chi2.sf(h, k - 1)
+        index = pd.Index(self.probe_ids, name='Probe') if self.probe_ids is not None else None
+        return pd.DataFrame({'N': N, 'n_groups': k, 'H_stat': h, 'P_KW': p}, index=index)
@@ -0,0 +1,389 @@
+"""
+Streaming GEO Series Matrix Reader
+Shared loader for GSE181063 (Lacy/HMRN) and other GEO series matrices
+
+Streams the gzip once and parses the expression block straight
+into a preallocated 2-D NumPy array (probes x samples) instead of holding the
+decompressed file and a dict of Python float lists in memory.
+"""
+
+import gzip
+import io
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+TABLE_BEGIN = "!series_matrix_table_begin"
+TABLE_END = "!series_matrix_table_end"
+NULL_VALUES = ('null', 'NA', 'NaN', '')
+
+# Rows per pandas C-parser chunk when filling the expression array
+CHUNK_ROWS = 2048
+
+# Characters of table text per task in parallel mode (~700 rows of 1310 samples)
+BLOCK_CHARS = 8 << 20
+
+
+class SeriesMatrix:
+    """Parsed series matrix: expression values plus sample characteristics"""
+
+    def __init__(self, values, probe_ids, sample_ids, characteristics):
+        self.values = values                    # (n_probes, n_samples) array
+        self.probe_ids = probe_ids              # list of probe IDs (row order)
+        self.sample_ids = sample_ids            # list of GSM IDs (column order)
+        self.characteristics = characteristics  # DataFrame indexed by sample ID
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def characteristic(self, key, convert=None):
+        """Values of one `key: value` characteristic in sample order"""
+        return characteristic_values(self.characteristics, key, convert)
+
+    def probe_index(self):
+        """Map probe ID -> row index"""
+        return {p: i for i, p in enumerate(self.probe_ids)}
+
+    def sample_index(self):
+        """Map sample ID -> column index"""
+        return {s: i for i, s in enumerate(self.sample_ids)}
+
+
+def characteristic_values(frame, key, convert=None):
+    """
+    Values of one characteristic column in sample order.
+
+    Missing values (and values `convert` fails on) come back as None; an
+    absent key gives all None.
+    """
+    if key not in frame.columns:
+        return [None] * len(frame)
+    values = frame[key].tolist()
+    if convert is None:
+        return values
+    converted = []
+    for v in values:
+        try:
+            converted.append(convert(v) if v is not None else None)
+        except (TypeError, ValueError):
+            converted.append(None)
+    return converted
+
+
+def open_text(path):
+    """Open a plain or gzipped text file for streaming"""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def _unquote(field):
+    return field.strip().strip('"')
+
+
+def parse_characteristics_row(parts, characteristics, n_samples):
+    """
+    Add one !Sample_characteristics_ch1 row to the characteristics dict.
+
+    Each cell is parsed as `key: value`, so rows where GEO mixes several keys
+    across samples are assigned to the right key per sample.
+    """
+    for i, cell in enumerate(parts[:n_samples]):
+        cell = _unquote(cell)
+        if ':' not in cell:
+            continue
+        key, _, value = cell.partition(':')
+        key = key.strip()
+        value = value.strip()
+        if key not in characteristics:
+            characteristics[key] = [None] * n_samples
+        characteristics[key][i] = value if value not in NULL_VALUES else None
+
+
+def read_header(f):
+    """
+    Consume the metadata section of an open series matrix.
+
+    Stops right after the `!series_matrix_table_begin` line (or at EOF) and
+    returns (geo_accessions, characteristics dict, found_table).
+    """
+    sample_ids = []
+    characteristics = {}
+    for line in f:
+        if line.startswith(TABLE_BEGIN):
+            return sample_ids, characteristics, True
+        if line.startswith("!Sample_geo_accession"):
+            sample_ids = [_unquote(p) for p in line.rstrip('\r\n').split('\t')[1:]]
+        elif line.startswith("!Sample_characteristics_ch1"):
+            parts = line.rstrip('\r\n').split('\t')[1:]
+            parse_characteristics_row(parts, characteristics, len(sample_ids))
+    return sample_ids, characteristics, False
+
+
+def table_chunks(f, n_cols, chunk_rows=CHUNK_ROWS):
+    """
+    Iterate over the data rows of an open table as DataFrame chunks.
+
+    Uses the pandas C parser on the stream itself; the trailing
+    `!series_matrix_table_end` line is dropped as a comment.
+    """
+    return pd.read_csv(f, chunksize=chunk_rows, **table_csv_options(n_cols))
+
+
+def table_csv_options(n_cols):
+    """read_csv options for data rows: probe ID index + n_cols float columns"""
+    dtypes = {0: str}
+    dtypes.update({i: np.float64 for i in range(1, n_cols + 1)})
+    return dict(sep='\t', header=None, index_col=0, comment='!',
+                na_values=list(NULL_VALUES), keep_default_na=False, dtype=dtypes)
+
+
+def read_table(f, n_cols, dtype=np.float64, chunk_rows=CHUNK_ROWS):
+    """
+    Parse data rows from an open file until `!series_matrix_table_end`/EOF.
+
+    Values go straight into a preallocated array that is grown in place
+    (realloc) as chunks arrive, so peak memory stays close to the matrix size
+    rather than the decompressed text. Returns (values, probe_ids).
+    """
+    capacity = chunk_rows * 8
+    values = np.empty((capacity, n_cols), dtype=dtype)
+    probe_ids = []
+    n_rows = 0
+
+    for chunk in table_chunks(f, n_cols, chunk_rows):
+        if chunk.shape[1] != n_cols:
+            raise ValueError(f"Expected {n_cols} values per row, got {chunk.shape[1]}")
+        needed = n_rows + len(chunk)
+        if needed > capacity:
+            capacity = max(needed, int(capacity * 1.5))
+            values.resize((capacity, n_cols), refcheck=False)
+        values[n_rows:needed] = chunk.to_numpy(dtype)
+        probe_ids.extend(chunk.index.tolist())
+        n_rows = needed
+
+    values.resize((n_rows, n_cols), refcheck=False)
+    return values, probe_ids
+
+
+def resolve_workers(workers):
+    """Worker count for parallel parsing: None/0 means one per CPU"""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def iter_line_blocks(f, block_chars=BLOCK_CHARS):
+    """
+    Split the rest of an open table into blocks of whole lines.
+
+    Stops at `!series_matrix_table_end`; each block ends with a newline, so
+    its row count is just the number of newlines in it.
+    """
+    while True:
+        block = f.read(block_chars)
+        if not block:
+            return
+        if not block.endswith('\n'):
+            block += f.readline()
+            if not block.endswith('\n'):
+                block += '\n'
+        end = block.find(TABLE_END)
+        if end >= 0 and (end == 0 or block[end - 1] == '\n'):
+            if end > 0:
+                yield block[:end]
+            return
+        yield block
+
+
+def _parse_block(out_path, n_cols, dtype, row0, n_rows, block):
+    """
+    Worker: parse one block of rows and write them into the shared output file.
+
+    Only the block's own rows are mapped, so workers never overlap.
+    """
+    frame = pd.read_csv(io.StringIO(block), **table_csv_options(n_cols))
+    if frame.shape != (n_rows, n_cols):
+        raise ValueError(f"Block at row {row0}: expected {n_rows}x{n_cols} values, got {frame.shape}")
+    itemsize = np.dtype(dtype).itemsize
+    out = np.memmap(out_path, dtype=dtype, mode='r+', offset=row0 * n_cols * itemsize,
+                    shape=(n_rows, n_cols))
+    out[:] = frame.to_numpy(dtype)
+    out.flush()
+    del out
+    return frame.index.tolist()
+
+
+def read_table_parallel(f, n_cols, dtype=np.float64, workers=None, block_chars=BLOCK_CHARS):
+    """
+    Parallel version of read_table().
+
+    The main process decompresses and cuts the table into blocks of whole
+    lines; a process pool parses the blocks and writes them straight into a
+    shared, file-backed output array at their row offsets (known up front
+    from the newline count). Decompression stays serial - gzip cannot be
+    split - so speed-up is bounded by the inflate rate.
+
+    On spawn platforms (Windows, macOS) the calling script needs an
+    `if __name__ == "__main__":` guard, as for any process pool.
+    """
+    workers = resolve_workers(workers)
+    dtype = np.dtype(dtype)
+    row_bytes = n_cols * dtype.itemsize
+    fd, out_path = tempfile.mkstemp(suffix=".values.tmp")
+    os.close(fd)
+
+    id_blocks = []
+    n_rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for block in iter_line_blocks(f, block_chars):
+                rows = block.count('\n')
+                # Grow the output file ahead of the workers (regions already
+                # mapped by running tasks are unaffected)
+                if os.path.getsize(out_path) < (n_rows + rows) * row_bytes:
+                    capacity = max(n_rows + rows, 2 * n_rows, CHUNK_ROWS)
+                    os.truncate(out_path, capacity * row_bytes)
+                pending.append(pool.submit(_parse_block, out_path, n_cols, dtype,
+                                           n_rows, rows, block))
+                n_rows += rows
+                # Bound the text held in flight
+                if len(pending) >= 2 * workers:
+                    id_blocks.append(pending.popleft().result())
+            while pending:
+                id_blocks.append(pending.popleft().result())
+
+        values = np.fromfile(out_path, dtype=dtype, count=n_rows * n_cols).reshape(n_rows, n_cols)
+    finally:
+        os.remove(out_path)
+
+    probe_ids = [p for ids in id_blocks for p in ids]
+    return values, probe_ids
+
+
+def characteristics_frame(sample_ids, characteristics):
+    """Build the sample x characteristic DataFrame (strings, None when missing)"""
+    frame = pd.DataFrame(characteristics, index=pd.Index(sample_ids, name='sample_id'),
+                         dtype=object)
+    return frame.where(frame.notna(), None)
+
+
+def read_table_header(f):
+    """Sample IDs from the column header line that follows `!series_matrix_table_begin`"""
+    header = f.readline().rstrip('\r\n').split('\t')
+    return [_unquote(h) for h in header[1:]]
+
+
+def align_characteristics(characteristics, geo_ids, sample_ids):
+    """Reorder characteristics (in !Sample_geo_accession order) to the table column order"""
+    if not geo_ids or geo_ids == sample_ids:
+        return characteristics
+    order = {s: i for i, s in enumerate(geo_ids)}
+    return {k: [v[order[s]] if s in order else None for s in sample_ids]
+            for k, v in characteristics.items()}
+
+
+def read_series_matrix(path, dtype=np.float64, chunk_rows=CHUNK_ROWS, workers=1):
+    """
+    Read a GEO series matrix in a single streaming pass.
+
+    workers > 1 (or None for one per CPU) parses the expression table in a
+    process pool (read_table_parallel).
+
+    Returns a SeriesMatrix with:
+      values          - (n_probes, n_samples) array of `dtype` (NaN for null)
+      probe_ids       - probe IDs in file order
+      sample_ids      - sample IDs from the table header
+      characteristics - DataFrame of `key: value` sample characteristics
+    """
+    with open_text(path) as f:
+        geo_ids, characteristics, found = read_header(f)
+        if not found:
+            raise ValueError(f"No {TABLE_BEGIN} block in {path}")
+
+        sample_ids = read_table_header(f)
+        if resolve_workers(workers) > 1:
+            values, probe_ids = read_table_parallel(f, len(sample_ids), dtype, workers)
+        else:
+            values, probe_ids = read_table(f, len(sample_ids), dtype, chunk_rows)
+
+    characteristics = align_characteristics(characteristics, geo_ids, sample_ids)
+    return SeriesMatrix(values, probe_ids, sample_ids,
+                        characteristics_frame(sample_ids, characteristics))
+
+
+def read_raw_data(path, dtype=np.float64, workers=1):
+    """
+    Read a plain tab-delimited expression table such as GSE181063_RawData.txt.gz.
+
+    The first line is the column header (probe ID column + value columns);
+    every other column must be numeric. Returns (values, probe_ids, columns).
+    """
+    with open_text(path) as f:
+        columns = [_unquote(h) for h in f.readline().rstrip('\r\n').split('\t')[1:]]
+        if resolve_workers(workers) > 1:
+            values, probe_ids = read_table_parallel(f, len(columns), dtype, workers)
+        else:
+            values, probe_ids = read_table(f, len(columns), dtype)
+    return values, probe_ids, columns
+
+
+class SeriesMatrixStream:
+    """
+    Series matrix opened for row-streaming instead of loading the table.
+
+    The header (sample IDs, characteristics) is parsed on open, so sample
+    groups can be defined before any expression row is read; chunks() then
+    yields (probe_ids, values) blocks of at most `chunk_rows` rows. Memory is
+    O(chunk_rows x samples) whatever the number of probes. Use as a context
+    manager, or call close().
+    """
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._f = open_text(path)
+        try:
+            geo_ids, characteristics, found = read_header(self._f)
+            if not found:
+                raise ValueError(f"No {TABLE_BEGIN} block in {path}")
+            self.sample_ids = read_table_header(self._f)
+        except Exception:
+            self._f.close()
+            raise
+        characteristics = align_characteristics(characteristics, geo_ids, self.sample_ids)
+        self.characteristics = characteristics_frame(self.sample_ids, characteristics)
+        self._consumed = False
+
+    def characteristic(self, key, convert=None):
+        """Values of one `key: value` characteristic in sample order"""
+        return characteristic_values(self.characteristics, key, convert)
+
+    def sample_index(self):
+        """Map sample ID -> column index"""
+        return {s: i for i, s in enumerate(self.sample_ids)}
+
+    def chunks(self, dtype=np.float64):
+        """Yield (probe_ids, values) for consecutive blocks of table rows (single pass)"""
+        if self._consumed:
+            raise RuntimeError(f"Expression table of {self.path} was already streamed")
+        self._consumed = True
+        n_cols = len(self.sample_ids)
+        for chunk in table_chunks(self._f, n_cols, self.chunk_rows):
+            if chunk.shape[1] != n_cols:
+                raise ValueError(f"Expected {n_cols} values per row, got {chunk.shape[1]}")
+            yield chunk.index.tolist(), chunk.to_numpy(dtype)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
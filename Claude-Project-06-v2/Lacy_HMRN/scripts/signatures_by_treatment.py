@@ -8,11 +8,13 @@ from scipy import stats
 from lifelines import KaplanMeierFitter, CoxPHFitter
 from lifelines.statistics import logrank_test
 import matplotlib.pyplot as plt
-import gzip
 import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from expression_cache import load_series_matrix
+from platform_annotation import load_probe_annotation
+
 print("=" * 80)
 print("SIGNATURE PROGNOSTIC VALUE BY TREATMENT STATUS")
 print("R-CHOP vs Non-R-CHOP")
@@ -30,59 +32,25 @@ print("Loading data and searching for treatment information...")
 
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 
-with gzip.open(series_file, 'rt') as f:
-    lines = f.readlines()
-
-# Parse all metadata
-sample_ids = None
-coo = None
-os_status = None
-os_followup = None
-rchop = None
+sm = load_series_matrix(series_file)
+sample_ids = sm.sample_ids
 
 # First, let's see all available characteristics
 print("\nSearching for treatment-related fields...")
-for line in lines:
-    if line.startswith("!Sample_characteristics_ch1"):
-        sample_val = line.strip().split('\t')[1].strip('"')
-        if any(x in sample_val.lower() for x in ['chop', 'treat', 'therap', 'regimen', 'chemo']):
-            print(f"  Found: {sample_val[:80]}")
+for key in sm.characteristics.columns:
+    sample_val = f"{key}: {sm.characteristics[key].iloc[0]}"
+    if any(x in sample_val.lower() for x in ['chop', 'treat', 'therap', 'regimen', 'chemo']):
+        print(f"  Found: {sample_val[:80]}")
 
 # Now parse all fields
-for line in lines:
-    if line.startswith("!Sample_geo_accession"):
-        parts = line.strip().split('\t')[1:]
-        sample_ids = [p.strip('"') for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "pred_combine:" in line:
-        parts = line.strip().split('\t')[1:]
-        coo = [p.strip('"').split(":")[-1].strip() if "pred_combine:" in p else None for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "os_status:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_status = []
-        for p in parts:
-            try:
-                os_status.append(int(p.strip('"').split(":")[-1].strip()))
-            except:
-                os_status.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "os_followup_y:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_followup = []
-        for p in parts:
-            try:
-                os_followup.append(float(p.strip('"').split(":")[-1].strip()))
-            except:
-                os_followup.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "rchop" in line.lower():
-        parts = line.strip().split('\t')[1:]
-        rchop = []
-        for p in parts:
-            p = p.strip('"')
-            if ":" in p:
-                val = p.split(":")[-1].strip()
-                rchop.append(val)
-            else:
-                rchop.append(None)
-        print(f"  Found R-CHOP field: {line.strip()[:100]}...")
+coo = sm.characteristic('pred_combine')
+os_status = sm.characteristic('os_status', int)
+os_followup = sm.characteristic('os_followup_y', float)
+rchop = None
+for key in sm.characteristics.columns:
+    if 'rchop' in key.lower():
+        rchop = sm.characteristic(key)
+        print(f"  Found R-CHOP field: {key}")
 
 # If no R-CHOP in GEO, check Blood supplement
 if rchop is None:
@@ -107,33 +75,16 @@ print(f"R-CHOP data available: {rchop is not None}")
 
 print("\nLoading expression data...")
 
-# Parse expression
-expr_start = None
-expr_end = None
-for i, line in enumerate(lines):
-    if line.startswith("!series_matrix_table_begin"):
-        expr_start = i + 1
-    elif line.startswith("!series_matrix_table_end"):
-        expr_end = i
-        break
-
-expr_data = {}
-if expr_start and expr_end:
-    expr_lines = lines[expr_start:expr_end]
-    for line in expr_lines[1:]:
-        parts = line.strip().split('\t')
-        probe_id = parts[0].strip('"')
-        values = [float(v) if v != 'null' and v != '' else np.nan for v in parts[1:]]
-        expr_data[probe_id] = values
+# Expression rows are views into one float array
+expr_data = dict(zip(sm.probe_ids, sm.values))
 
 # Load annotation
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
+annot_df = load_probe_annotation(lacy_dir)
 gene_to_probe = {}
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
-    for _, row in annot_df.iterrows():
-        if row['Gene_Symbol'] not in gene_to_probe:
-            gene_to_probe[row['Gene_Symbol']] = row['Probe']
+if annot_df is not None:
+    for probe, gene in zip(annot_df['Probe'], annot_df['Gene_Symbol']):
+        if gene not in gene_to_probe:
+            gene_to_probe[gene] = probe
 
 # Define signatures
 RETENTION_GENES = ['S1PR2', 'P2RY8', 'GNA13', 'RHOA', 'ARHGEF1']
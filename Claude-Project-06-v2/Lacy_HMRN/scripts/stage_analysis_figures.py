@@ -10,6 +10,8 @@ import matplotlib.patches as mpatches
 from matplotlib.gridspec import GridSpec
 import os
 
+from cohort_parquet import read_table
+
 print("=" * 70)
 print("GCB-DLBCL STAGE ANALYSIS - GENERATING FIGURES")
 print("=" * 70 + "\n")
@@ -27,21 +29,18 @@ if not os.path.exists(figures_dir):
 
 print("Loading data...")
 
-# Load DE results
-de_results = pd.read_csv(os.path.join(results_dir, "gcb_expression_by_stage.csv"))
+# Load DE results (annotated; Parquet export when available, else CSV + annotation)
+de_results = read_table(lacy_dir, "gcb_expression_by_stage",
+                        columns=['Probe', 'Gene_Symbol', 'Entrez_ID', 'Log2FC', 'P_value', 'FDR',
+                                 'Direction'])
 print(f"DE results: {len(de_results)} probes")
 
-# Load annotation if available
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
-    de_results = de_results.merge(annot_df, on='Probe', how='left')
-
-# Load staged data
-staged_file = os.path.join(results_dir, "gcb_staged_tegress.csv")
-if os.path.exists(staged_file):
-    staged_data = pd.read_csv(staged_file)
+# Load staged data (only the stage grouping is used)
+try:
+    staged_data = read_table(lacy_dir, "gcb_staged_tegress", columns=['stage_group'])
     print(f"Staged GCB patients: {len(staged_data)}")
+except FileNotFoundError:
+    pass
 
 # =============================================================================
 # 2. FIGURE 1: Volcano Plot
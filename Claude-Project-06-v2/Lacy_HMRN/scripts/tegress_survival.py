@@ -6,15 +6,17 @@ Calculate egress/retention transcriptional score and analyze OS by quartiles
 import pandas as pd
 import numpy as np
 from scipy import stats
-from lifelines import KaplanMeierFitter
-from lifelines.statistics import logrank_test, multivariate_logrank_test
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import gzip
 import os
 import warnings
 warnings.filterwarnings('ignore')
 
+from probe_index import open_probe_index
+from platform_annotation import load_probe_annotation
+from survival_design import SurvivalDesign
+from survival_stats import kaplan_meier, logrank_matrix
+
 print("=" * 70)
 print("tEGRESS SCORE SURVIVAL ANALYSIS")
 print("Retention vs Egress Pathway Gene Expression")
@@ -48,84 +50,24 @@ print("\nLoading data...")
 
 series_file = os.path.join(lacy_dir, "GSE181063_series_matrix.txt.gz")
 
-with gzip.open(series_file, 'rt') as f:
-    lines = f.readlines()
+# Probe index: only the pathway genes' rows are read, not the whole matrix
+index = open_probe_index(series_file)
+sample_ids = index.sample_ids
+probe_ids = index.probe_ids
 
 # Parse metadata
-sample_ids = None
-coo = None
-os_status = None
-os_followup = None
-
-for line in lines:
-    if line.startswith("!Sample_geo_accession"):
-        parts = line.strip().split('\t')[1:]
-        sample_ids = [p.strip('"') for p in parts]
-    elif line.startswith("!Sample_characteristics_ch1") and "pred_combine:" in line:
-        parts = line.strip().split('\t')[1:]
-        coo = []
-        for p in parts:
-            p = p.strip('"')
-            if "pred_combine:" in p:
-                coo.append(p.split(":")[-1].strip())
-            else:
-                coo.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "os_status:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_status = []
-        for p in parts:
-            p = p.strip('"')
-            if "os_status:" in p:
-                try:
-                    os_status.append(int(p.split(":")[-1].strip()))
-                except:
-                    os_status.append(None)
-            else:
-                os_status.append(None)
-    elif line.startswith("!Sample_characteristics_ch1") and "os_followup_y:" in line:
-        parts = line.strip().split('\t')[1:]
-        os_followup = []
-        for p in parts:
-            p = p.strip('"')
-            if "os_followup_y:" in p:
-                try:
-                    os_followup.append(float(p.split(":")[-1].strip()))
-                except:
-                    os_followup.append(None)
-            else:
-                os_followup.append(None)
-
-# Parse expression matrix
-expr_start = None
-expr_end = None
-for i, line in enumerate(lines):
-    if line.startswith("!series_matrix_table_begin"):
-        expr_start = i + 1
-    elif line.startswith("!series_matrix_table_end"):
-        expr_end = i
-        break
-
-expr_data = {}
-probe_ids = []
-if expr_start and expr_end:
-    expr_lines = lines[expr_start:expr_end]
-    for line in expr_lines[1:]:
-        parts = line.strip().split('\t')
-        probe_id = parts[0].strip('"')
-        probe_ids.append(probe_id)
-        values = [float(v) if v != 'null' and v != '' else np.nan for v in parts[1:]]
-        expr_data[probe_id] = values
+coo = index.characteristic('pred_combine')
+os_status = index.characteristic('os_status', int)
+os_followup = index.characteristic('os_followup_y', float)
 
 print(f"Samples: {len(sample_ids)}")
 print(f"Probes: {len(probe_ids)}")
 
 # Load annotation to map probes to genes
-annot_file = os.path.join(lacy_dir, "GPL14951_annotation.csv")
+annot_df = load_probe_annotation(lacy_dir)
 probe_to_gene = {}
-if os.path.exists(annot_file):
-    annot_df = pd.read_csv(annot_file)
-    for _, row in annot_df.iterrows():
-        probe_to_gene[row['Probe']] = row['Gene_Symbol']
+if annot_df is not None:
+    probe_to_gene = dict(zip(annot_df['Probe'], annot_df['Gene_Symbol']))
 
 # Create gene to probe mapping (use first probe for each gene)
 gene_to_probe = {}
@@ -135,6 +77,10 @@ for probe, gene in probe_to_gene.items():
 
 print(f"\nGenes with probes: {list(gene_to_probe.keys())}")
 
+pathway_probes = [gene_to_probe[g] for g in RETENTION_GENES + EGRESS_GENES + IDENTITY_GENES
+                  if g in gene_to_probe]
+expr_data = index.read_dict(pathway_probes)
+
 # =============================================================================
 # 3. Calculate tEgress Score
 # =============================================================================
@@ -240,11 +186,33 @@ surv_data = clinical[clinical['OS_status'].notna() & clinical['OS_time'].notna()
 print(f"\nSamples with survival data: {len(surv_data)}")
 
 # Create quartiles
-surv_data['tEgress_quartile'] = pd.qcut(surv_data['tEgress'], q=4, labels=['Q1 (Low)', 'Q2', 'Q3', 'Q4 (High)'])
+QUARTILES = ['Q1 (Low)', 'Q2', 'Q3', 'Q4 (High)']
+surv_data['tEgress_quartile'] = pd.qcut(surv_data['tEgress'], q=4, labels=QUARTILES)
 
 print("\ntEgress quartile distribution:")
 print(surv_data['tEgress_quartile'].value_counts().sort_index())
 
+# Quartiles (and median-split groups) of every cohort as label columns - overall and
+# recomputed within each COO subtype, NaN outside it - so the log-rank tests and
+# Kaplan-Meier curves below are each one batched pass over the event times for all cohorts
+SUBTYPES = ['GCB', 'ABC', 'MHG', 'UNC']
+surv_data['tEgress_group'] = pd.cut(surv_data['tEgress'], bins=2, labels=['Low', 'High'])
+cohort_quartiles = pd.DataFrame({'OVERALL': surv_data['tEgress_quartile']})
+cohort_halves = pd.DataFrame({'Overall': surv_data['tEgress_group']})
+for subtype in SUBTYPES:
+    in_subtype = surv_data['COO'] == subtype
+    if in_subtype.sum() >= 20:
+        cohort_quartiles[subtype] = pd.qcut(surv_data.loc[in_subtype, 'tEgress'], q=4, labels=QUARTILES)
+        cohort_halves[subtype] = pd.cut(surv_data.loc[in_subtype, 'tEgress'], bins=2, labels=['Low', 'High'])
+
+survival_design = SurvivalDesign.from_frame(surv_data, time_col='OS_time', id_col='sample_id')
+logrank_q1_vs_q4 = logrank_matrix(survival_design, cohort_quartiles, groups=['Q1 (Low)', 'Q4 (High)'])
+logrank_quartiles = logrank_matrix(survival_design, cohort_quartiles)
+logrank_halves = logrank_matrix(survival_design, cohort_halves, groups=['Low', 'High'])
+km_quartiles = kaplan_meier(survival_design, cohort_quartiles, groups=QUARTILES)
+km_halves = kaplan_meier(survival_design, cohort_halves, groups=['Low', 'High'])
+median_quartiles = km_quartiles.table()['median']
+
 # =============================================================================
 # 5. Survival Analysis Function
 # =============================================================================
@@ -263,27 +231,24 @@ def run_survival_analysis(data, group_name, ax=None):
     # Quartile distribution
     print(f"\nSamples: {len(data)}")
     print("Quartile distribution:")
-    for q in ['Q1 (Low)', 'Q2', 'Q3', 'Q4 (High)']:
+    for q in QUARTILES:
         n = len(data[data['tEgress_quartile'] == q])
         events = data[data['tEgress_quartile'] == q]['OS_status'].sum()
         print(f"  {q}: n={n}, events={int(events)}")
 
     # Kaplan-Meier by quartile
-    kmf = KaplanMeierFitter()
-
     colors = {'Q1 (Low)': '#2ECC71', 'Q2': '#3498DB', 'Q3': '#F39C12', 'Q4 (High)': '#E74C3C'}
 
     results = {}
 
     if ax is not None:
-        for quartile in ['Q1 (Low)', 'Q2', 'Q3', 'Q4 (High)']:
+        for quartile in QUARTILES:
             subset = data[data['tEgress_quartile'] == quartile]
             if len(subset) >= 5:
-                kmf.fit(subset['OS_time'], subset['OS_status'], label=quartile)
-                kmf.plot_survival_function(ax=ax, color=colors[quartile], linewidth=2)
+                km_quartiles.plot(ax, group_name, quartile, color=colors[quartile], linewidth=2)
 
                 # Store median survival
-                median_surv = kmf.median_survival_time_
+                median_surv = median_quartiles[(group_name, quartile)]
                 results[quartile] = {
                     'n': len(subset),
                     'events': int(subset['OS_status'].sum()),
@@ -295,17 +260,15 @@ def run_survival_analysis(data, group_name, ax=None):
     q4 = data[data['tEgress_quartile'] == 'Q4 (High)']
 
     if len(q1) >= 5 and len(q4) >= 5:
-        lr = logrank_test(q1['OS_time'], q4['OS_time'], q1['OS_status'], q4['OS_status'])
-        print(f"\nLog-rank test (Q1 vs Q4): p = {lr.p_value:.4f}")
-        results['logrank_q1_vs_q4'] = lr.p_value
+        p_q1_q4 = logrank_q1_vs_q4.loc[group_name, 'p_value']
+        print(f"\nLog-rank test (Q1 vs Q4): p = {p_q1_q4:.4f}")
+        results['logrank_q1_vs_q4'] = p_q1_q4
 
     # Overall log-rank (all quartiles)
-    try:
-        multi_lr = multivariate_logrank_test(data['OS_time'], data['tEgress_quartile'], data['OS_status'])
-        print(f"Log-rank test (all quartiles): p = {multi_lr.p_value:.4f}")
-        results['logrank_overall'] = multi_lr.p_value
-    except:
-        pass
+    p_overall = logrank_quartiles.loc[group_name, 'p_value']
+    if not np.isnan(p_overall):
+        print(f"Log-rank test (all quartiles): p = {p_overall:.4f}")
+        results['logrank_overall'] = p_overall
 
     # Median OS by quartile
     print("\nMedian OS by quartile:")
@@ -344,12 +307,12 @@ if all_results:
 # By subtype
 subtype_results = {}
 
-for idx, subtype in enumerate(['GCB', 'ABC', 'MHG', 'UNC'], start=1):
+for idx, subtype in enumerate(SUBTYPES, start=1):
     subset = surv_data[surv_data['COO'] == subtype].copy()
 
     if len(subset) >= 20:
-        # Recalculate quartiles within subtype
-        subset['tEgress_quartile'] = pd.qcut(subset['tEgress'], q=4, labels=['Q1 (Low)', 'Q2', 'Q3', 'Q4 (High)'])
+        # Quartiles recalculated within subtype
+        subset['tEgress_quartile'] = cohort_quartiles[subtype]
 
         subtype_results[subtype] = run_survival_analysis(subset, subtype, axes[idx])
 
@@ -389,8 +352,6 @@ print("\n" + "=" * 70)
 print("ADDITIONAL: HIGH vs LOW tEGRESS (Median Split)")
 print("=" * 70)
 
-surv_data['tEgress_group'] = pd.cut(surv_data['tEgress'], bins=2, labels=['Low', 'High'])
-
 fig, axes = plt.subplots(2, 3, figsize=(18, 12))
 axes = axes.flatten()
 
@@ -400,21 +361,17 @@ def run_binary_survival(data, group_name, ax):
     if len(data) < 20:
         return None
 
-    kmf = KaplanMeierFitter()
-
     for group, color in [('Low', '#2ECC71'), ('High', '#E74C3C')]:
         subset = data[data['tEgress_group'] == group]
         if len(subset) >= 5:
-            kmf.fit(subset['OS_time'], subset['OS_status'], label=f'{group} tEgress')
-            kmf.plot_survival_function(ax=ax, color=color, linewidth=2.5)
+            km_halves.plot(ax, group_name, group, label=f'{group} tEgress', color=color, linewidth=2.5)
 
     # Log-rank
     low = data[data['tEgress_group'] == 'Low']
     high = data[data['tEgress_group'] == 'High']
 
     if len(low) >= 5 and len(high) >= 5:
-        lr = logrank_test(low['OS_time'], high['OS_time'], low['OS_status'], high['OS_status'])
-        return lr.p_value
+        return logrank_halves.loc[group_name, 'p_value']
     return None
 
 # Overall
@@ -426,10 +383,10 @@ axes[0].set_ylabel('Overall Survival')
 axes[0].legend(loc='lower left')
 
 # By subtype
-for idx, subtype in enumerate(['GCB', 'ABC', 'MHG', 'UNC'], start=1):
+for idx, subtype in enumerate(SUBTYPES, start=1):
     subset = surv_data[surv_data['COO'] == subtype].copy()
     if len(subset) >= 20:
-        subset['tEgress_group'] = pd.cut(subset['tEgress'], bins=2, labels=['Low', 'High'])
+        subset['tEgress_group'] = cohort_halves[subtype]
         p_val = run_binary_survival(subset, subtype, axes[idx])
         axes[idx].set_title(f'{subtype} (n={len(subset)})\np={p_val:.4f}' if p_val else f'{subtype} (n={len(subset)})',
                            fontsize=12, fontweight='bold')
@@ -0,0 +1,98 @@
+"""Checks for differential_expression.py (run with pytest from scripts/)"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from differential_expression import cached_group_stats, group_moments, stream_ttest, two_group_ttest
+from series_matrix import SeriesMatrixStream, read_series_matrix
+
+
+def test_constant_probe_has_zero_variance():
+    # 0.1 is not dyadic: a plain mean of repeated 0.1 is not exactly 0.1
+    values = np.array([[0.1] * 6, [0.3, np.nan, 0.3, 0.3, 0.3, 0.3]])
+    n, mean, var = group_moments(values, np.ones(6, dtype=bool))
+    assert np.array_equal(var, [0.0, 0.0])
+    assert np.array_equal(mean, [0.1, 0.3])
+
+
+def test_constant_probe_is_not_tested():
+    # Constant within each group (0.1 vs 0.3): no variance, so no t-test
+    rng = np.random.default_rng(0)
+    mask_a = np.arange(12) < 6
+    values = np.vstack([np.where(mask_a, 0.1, 0.3), rng.normal(size=12)])
+    result = two_group_ttest(values, mask_a, ~mask_a, min_n=5)
+    assert list(result['tested']) == [False, True]
+    _, p = stats.ttest_ind(values[1, mask_a], values[1, ~mask_a])
+    assert np.isclose(result['P_value'][1], p)
+
+
+def test_stream_ttest_matches_two_group_ttest(tmp_path):
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=(10, 12))
+    values[2, :4] = np.nan
+    samples = [f"GSM{i}" for i in range(12)]
+    groups = ['a', 'b'] * 6
+    rows = [f'"P{i}"\t' + "\t".join("null" if np.isnan(v) else repr(v) for v in row.tolist())
+            for i, row in enumerate(values)]
+    path = tmp_path / "series_matrix.txt"
+    path.write_text("\n".join([
+        "!Sample_geo_accession\t" + "\t".join(f'"{s}"' for s in samples),
+        "!Sample_characteristics_ch1\t" + "\t".join(f'"group: {g}"' for g in groups),
+        "!series_matrix_table_begin",
+        '"ID_REF"\t' + "\t".join(f'"{s}"' for s in samples),
+        *rows,
+        "!series_matrix_table_end", ""]))
+
+    # Blocks of 3 rows: the last block is partial
+    with SeriesMatrixStream(str(path), chunk_rows=3) as stream:
+        group = np.array(stream.characteristic('group'))
+        streamed = pd.concat(stream_ttest(stream, group == 'a', group == 'b', min_n=4))
+    sm = read_series_matrix(str(path))
+    expected = two_group_ttest(sm.values, group == 'a', group == 'b', sm.probe_ids, min_n=4)
+    pd.testing.assert_frame_equal(streamed.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def _assert_same_moments(cell_stats, values, factors):
+    for level in ('a', 'b'):
+        n, mean, var = cell_stats.moments(Group=level)
+        mask = (factors['Group'] == level).to_numpy()
+        expected = group_moments(values, mask)
+        assert np.array_equal(n, expected[0])
+        assert np.allclose(mean, expected[1]) and np.allclose(var, expected[2])
+
+
+def test_cached_group_stats_appends_incrementally(tmp_path, capsys):
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(4, 10))
+    factors = pd.DataFrame({'Group': ['a', 'b'] * 5})
+    samples = [f"S{i}" for i in range(10)]
+    path = str(tmp_path / "stats.npz")
+
+    # probe_ids default to row positions
+    cached_group_stats(path, values[:, :8], factors[:8], samples[:8])
+    capsys.readouterr()
+
+    # A release adding two patients updates the saved sums instead of rebuilding them
+    cell_stats = cached_group_stats(path, values, factors, samples)
+    assert "2 samples added, 0 removed, 0 cells re-summed" in capsys.readouterr().out
+    _assert_same_moments(cell_stats, values, factors)
+
+
+def test_cached_group_stats_resums_changed_and_removed_samples(tmp_path, capsys):
+    rng = np.random.default_rng(2)
+    values = rng.normal(size=(4, 10))
+    factors = pd.DataFrame({'Group': ['a', 'b'] * 5})
+    samples = [f"S{i}" for i in range(10)]
+    path = str(tmp_path / "stats.npz")
+    cached_group_stats(path, values, factors, samples, verbose=False)
+
+    # S0 (group a) corrected in place, S1 (group b) withdrawn: both cells re-summed
+    values[:, 0] += 10
+    values, factors, samples = np.delete(values, 1, axis=1), factors.drop(index=1), samples[:1] + samples[2:]
+    cell_stats = cached_group_stats(path, values, factors, samples)
+    assert "0 samples added, 1 removed, 2 cells re-summed" in capsys.readouterr().out
+    _assert_same_moments(cell_stats, values, factors)
+    assert os.path.exists(path)
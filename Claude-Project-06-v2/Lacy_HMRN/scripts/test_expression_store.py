@@ -0,0 +1,28 @@
+"""Checks for expression_store.py views (run with pytest from scripts/)"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from expression_store import ExpressionView
+
+
+def _store(n_probes=20, n_samples=10):
+    values = np.arange(n_probes * n_samples, dtype=float).reshape(n_probes, n_samples)
+    return SimpleNamespace(probe_ids=[f"P{i}" for i in range(n_probes)],
+                           sample_ids=[f"S{j}" for j in range(n_samples)],
+                           probe_major=values)
+
+
+@pytest.mark.parametrize('probes', [slice(None), slice(2, 17, 3), slice(None, None, -1),
+                                    slice(18, 3, -4), np.array([5, 1, 9])])
+@pytest.mark.parametrize('samples', [slice(None), np.array([0, 3, 7])])
+def test_iter_probe_blocks_matches_selection(probes, samples):
+    store = _store()
+    view = ExpressionView(store, probes, samples)
+    for block_size in (1, 3, 50):
+        blocks = list(view.iter_probe_blocks(block_size))
+        assert [p for ids, _ in blocks for p in ids] == view.probe_ids
+        assert np.array_equal(np.vstack([b for _, b in blocks]),
+                              store.probe_major[probes][:, samples])
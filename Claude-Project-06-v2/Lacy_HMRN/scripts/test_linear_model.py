@@ -0,0 +1,30 @@
+"""Checks for linear_model.py against statsmodels (run with pytest from scripts/)"""
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+
+from linear_model import design_matrix, lm_fit
+
+
+def test_lm_fit_matches_statsmodels():
+    rng = np.random.default_rng(0)
+    n = 60
+    covariates = pd.DataFrame({'Stage': rng.choice(['I', 'III_IV'], n),
+                               'COO': rng.choice(['ABC', 'GCB', 'UNC'], n),
+                               'IPI': rng.integers(0, 5, n).astype(float)})
+    covariates.loc[3, 'IPI'] = np.nan         # sample dropped from the model
+    values = rng.normal(size=(8, n))
+    values[2, [0, 10, 20]] = np.nan           # probe fitted on its own observed samples
+    X, kept = design_matrix(covariates, reference={'Stage': 'I'})
+    fit = lm_fit(values, X, samples=kept, probe_ids=[f"P{i}" for i in range(8)], block_size=3)
+
+    table = fit.table('Stage[III_IV]')
+    for i in range(len(values)):
+        y = values[i, kept]
+        ok = ~np.isnan(y)
+        ols = sm.OLS(y[ok], X.to_numpy()[ok]).fit()
+        assert np.allclose(fit.coef[i], ols.params)
+        assert np.allclose(fit.se[i], ols.bse)
+        assert np.allclose(fit.p[i], ols.pvalues)
+        assert table['df'].iloc[i] == ols.df_resid
@@ -0,0 +1,38 @@
+"""Checks for rank_tests.py against scipy (run with pytest from scripts/)"""
+
+import numpy as np
+from scipy import stats
+
+from rank_tests import RankMatrix
+
+
+def _matrix(seed=0, n_probes=12, n_samples=40):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(n_probes, n_samples))
+    values[:4] = values[:4].round(0)          # ties
+    values[5, ::7] = np.nan
+    return rng, values
+
+
+def test_mann_whitney_matches_scipy():
+    _, values = _matrix()
+    mask_a = np.arange(40) < 15
+    mask_b = np.arange(40) >= 22              # samples 15-21 in neither group
+    result = RankMatrix(values, block_size=5).mann_whitney(mask_a, mask_b)
+    for i, row in enumerate(values):
+        a, b = row[mask_a], row[mask_b]
+        a, b = a[~np.isnan(a)], b[~np.isnan(b)]
+        expected = stats.mannwhitneyu(a, b, alternative='two-sided', method='asymptotic')
+        assert np.isclose(result['U_stat'][i], expected.statistic)
+        assert np.isclose(result['P_MWU'][i], expected.pvalue)
+
+
+def test_kruskal_matches_scipy():
+    rng, values = _matrix(1)
+    labels = rng.choice(['GCB', 'ABC', 'MHG', None], 40)
+    result = RankMatrix(values).kruskal(labels)
+    for i, row in enumerate(values):
+        groups = [row[(labels == g) & ~np.isnan(row)] for g in ('GCB', 'ABC', 'MHG')]
+        expected = stats.kruskal(*groups)
+        assert np.isclose(result['H_stat'][i], expected.statistic)
+        assert np.isclose(result['P_KW'][i], expected.pvalue)
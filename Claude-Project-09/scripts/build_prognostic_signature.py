@@ -11,11 +11,14 @@ Strategy:
 import pandas as pd
 import numpy as np
 from lifelines import CoxPHFitter, KaplanMeierFitter
-from lifelines.statistics import logrank_test
 import matplotlib.pyplot as plt
 import warnings
 import os
 
+from batch_cox import cox_univariate
+from survival_design import SurvivalDesign
+from survival_stats import concordance_matrix, logrank_matrix
+
 warnings.filterwarnings('ignore')
 
 # Paths
@@ -57,34 +60,20 @@ print(f"   Deaths: {int(os_df['OS_status'].sum())} ({100*os_df['OS_status'].mean
 print("\n2. Univariate gene screening (full OS cohort)...")
 
 def quick_cox_screen(expr_data, clinical_data, top_n=100):
-    """Fast univariate Cox screening"""
-    results = []
+    """Fast univariate Cox screening (every gene in one batched fit) with each gene's C-index"""
     sample_ids = clinical_data['Sample_ID'].tolist()
     valid_samples = [s for s in sample_ids if s in expr_data.columns]
+    design = SurvivalDesign.from_frame(clinical_data, samples=valid_samples)
+
+    genes = expr_data.index[~(expr_data.std(axis=1) < 0.1)]
+    cox = cox_univariate(expr_data.loc[genes, valid_samples].values, design, gene_ids=genes)
+    cox = cox[cox['converged'] & (cox['n_samples'] >= 50)]
+    # Harrell's C (higher expression read as higher risk)
+    conc = concordance_matrix(design, expr_data.loc[cox.index, valid_samples].values, risk=True)
 
-    for gene in expr_data.index:
-        if expr_data.loc[gene].std() < 0.1:
-            continue
-        try:
-            cox_df = pd.DataFrame({
-                'time': clinical_data.set_index('Sample_ID').loc[valid_samples, 'OS_time_years'].values,
-                'event': clinical_data.set_index('Sample_ID').loc[valid_samples, 'OS_status'].values,
-                'gene': expr_data.loc[gene, valid_samples].values
-            }).dropna()
-
-            if len(cox_df) < 50:
-                continue
-
-            cph = CoxPHFitter()
-            cph.fit(cox_df, duration_col='time', event_col='event')
-            hr = np.exp(cph.params_['gene'])
-            pval = cph.summary.loc['gene', 'p']
-
-            results.append({'Gene': gene, 'HR': hr, 'p_value': pval})
-        except:
-            continue
-
-    results_df = pd.DataFrame(results).sort_values('p_value')
+    results_df = pd.DataFrame({'Gene': cox.index, 'HR': cox['HR'].values,
+                               'p_value': cox['p_value'].values,
+                               'C_index': conc['c_index'].values}).sort_values('p_value')
     return results_df
 
 screen_results = quick_cox_screen(expr_z, os_df)
@@ -163,6 +152,18 @@ for var in ['Prognostic_Score', 'IPI_numeric']:
     sig = "***" if pval < 0.001 else "**" if pval < 0.01 else "*" if pval < 0.05 else ""
     print(f"      {var}: HR={hr:.2f} ({ci_low:.2f}-{ci_high:.2f}), p={pval:.4f} {sig}")
 
+# Discrimination: Harrell's C of signature, IPI and the combined model, one batched pass
+ipi_design = SurvivalDesign(cox3_df['OS_time_years'].values, cox3_df['OS_status'].values)
+risk_scores = {'Signature': cox3_df['Prognostic_Score'].values,
+               'IPI': cox3_df['IPI_numeric'].values,
+               'Signature + IPI': cox3_df[['Prognostic_Score', 'IPI_numeric']].values
+                                   @ cph3.params_[['Prognostic_Score', 'IPI_numeric']].values}
+c_index = concordance_matrix(ipi_design, np.vstack(list(risk_scores.values())),
+                             score_ids=list(risk_scores), risk=True)['c_index']
+print("\n   Harrell's C-index:")
+for name, c in c_index.items():
+    print(f"      {name}: C={c:.3f}")
+
 # 5. Stratify by risk groups
 print("\n5. Creating risk groups...")
 
@@ -176,17 +177,19 @@ for group in ['Low', 'Medium', 'High']:
     pct = 100 * sub['OS_status'].mean()
     print(f"      {group}: n={len(sub)}, deaths={deaths} ({pct:.1f}%)")
 
-# Log-rank test
-low = os_df[os_df['Risk_Group'] == 'Low']
-high = os_df[os_df['Risk_Group'] == 'High']
-lr = logrank_test(low['OS_time_years'], high['OS_time_years'],
-                  event_observed_A=low['OS_status'], event_observed_B=high['OS_status'])
-print(f"\n   Log-rank test (Low vs High): p = {lr.p_value:.2e}")
+# Log-rank tests (Low vs High), whole cohort and within each subtype in one pass
+SUBTYPES = ['EZB', 'BN2', 'MCD', 'Other']
+risk_labels = pd.DataFrame({'All': os_df['Risk_Group']})
+for subtype in SUBTYPES:
+    risk_labels[subtype] = os_df['Risk_Group'].where(os_df['LymphGen_Subtype'] == subtype)
+logrank_low_high = logrank_matrix(SurvivalDesign.from_frame(os_df), risk_labels, groups=['Low', 'High'])
+lr_p = logrank_low_high.loc['All', 'p_value']
+print(f"\n   Log-rank test (Low vs High): p = {lr_p:.2e}")
 
 # 6. Subtype-specific analysis
 print("\n6. Subtype-specific signature performance...")
 
-for subtype in ['EZB', 'BN2', 'MCD', 'Other']:
+for subtype in SUBTYPES:
     sub_df = os_df[os_df['LymphGen_Subtype'] == subtype]
 
     if len(sub_df) >= 20 and sub_df['OS_status'].sum() >= 5:
@@ -201,7 +204,9 @@ for subtype in ['EZB', 'BN2', 'MCD', 'Other']:
                 hr = np.exp(cph_sub.params_['Prognostic_Score'])
                 pval = cph_sub.summary.loc['Prognostic_Score', 'p']
                 sig = "*" if pval < 0.05 else ""
-                print(f"   {subtype}: n={len(sub_df)}, HR={hr:.2f}, p={pval:.4f} {sig}")
+                lr_sub = logrank_low_high.loc[subtype, 'p_value']
+                print(f"   {subtype}: n={len(sub_df)}, HR={hr:.2f}, p={pval:.4f} {sig}"
+                      f" (log-rank Low vs High p={lr_sub:.4f})")
             except:
                 print(f"   {subtype}: n={len(sub_df)}, model failed")
         else:
@@ -252,7 +257,7 @@ ax.set_xlim(0, 10)
 ax.set_ylim(0, 1)
 
 # Add log-rank p-value
-ax.text(0.95, 0.95, f'Log-rank p = {lr.p_value:.2e}', transform=ax.transAxes,
+ax.text(0.95, 0.95, f'Log-rank p = {lr_p:.2e}', transform=ax.transAxes,
         fontsize=11, verticalalignment='top', horizontalalignment='right',
         bbox=dict(boxstyle='round', facecolor='white', alpha=0.8))
 
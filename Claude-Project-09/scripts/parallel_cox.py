@@ -0,0 +1,176 @@
+"""
+Parallel Cox Screening
+Gene chunks across worker processes over one shared-memory expression matrix
+
+The batched solvers of batch_cox.py run on one core. For genome-wide
+screens (every gene, Global plus each LymphGen subtype) the gene axis is
+split into chunks and fitted in a process pool. The z-scored expression
+matrix is copied once into shared memory (SharedMatrix); workers attach to
+it by name and receive only the survival design, the covariates and row /
+column positions, so nothing of size genes x patients is pickled. Chunk
+results come back as they finish (with a progress line) and are
+reassembled in gene order.
+
+Worker count: None means one per CPU; 1 runs in-process. On spawn
+platforms (Windows, macOS) workers > 1 needs an `if __name__ == "__main__":`
+guard in the calling script, as for any process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from batch_cox import (SCREEN_P, cox_adjusted, cox_score_test, cox_screen, cox_univariate,
+                       merge_screen, screen_selection)
+
+# Genes per task
+CHUNK_SIZE = 1024
+
+# Worker processes (None: one per CPU)
+WORKERS = None
+
+
+def resolve_workers(workers):
+    """Worker count for parallel screening: None/0 means one per CPU"""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+class SharedMatrix:
+    """
+    A 2-D float64 array copied into shared memory.
+
+    Create once in the parent (`with SharedMatrix(expr_z.values) as shared:`),
+    pass to parallel_cox / parallel_screen any number of times; close()
+    releases the block.
+    """
+
+    def __init__(self, array):
+        array = np.asarray(array, dtype=np.float64)
+        self.shape = array.shape
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self._shm.buf)
+        self.array[:] = array
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Worker state, set once per process by _attach
+_worker = {}
+
+
+def _attach(name, shape, columns, design, covariates):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['values'] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker['columns'] = columns
+    _worker['design'] = design
+    _worker['covariates'] = covariates
+
+
+def _call(func, values, design, covariates, options):
+    # The three screens take the covariates in different positions
+    if func is cox_adjusted:
+        return func(values, covariates, design, **options)
+    if func is cox_score_test:
+        return func(values, design, covariates, **options)
+    return func(values, design, **options)
+
+
+def _fit_chunk(func, rows, options):
+    values = _worker['values'][rows][:, _worker['columns']]
+    return _call(func, values, _worker['design'], _worker['covariates'], options)
+
+
+def parallel_cox(func, matrix, design, rows=None, columns=None, covariates=None,
+                 gene_ids=None, workers=WORKERS, chunk_size=CHUNK_SIZE, label=None,
+                 **options):
+    """
+    Run a batch_cox screen (cox_univariate, cox_adjusted or cox_score_test)
+    over gene chunks in a process pool.
+
+    `matrix` is a SharedMatrix (or an array, shared for this call only) of
+    genes x samples; `rows` / `columns` select the genes and the design's
+    input patients by position (default: all, in order). Returns the same
+    DataFrame as `func` on the selected block, rows in gene order.
+    """
+    shared = matrix if isinstance(matrix, SharedMatrix) else None
+    array = shared.array if shared is not None else np.asarray(matrix, dtype=np.float64)
+    rows = np.arange(array.shape[0]) if rows is None else np.asarray(rows)
+    columns = np.arange(array.shape[1]) if columns is None else np.asarray(columns)
+    workers = min(resolve_workers(workers), max(1, -(-len(rows) // chunk_size)))
+
+    if workers == 1:
+        result = _call(func, array[rows][:, columns], design, covariates, options)
+    else:
+        owned = shared is None
+        if owned:
+            shared = SharedMatrix(array)
+        try:
+            chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+            parts = [None] * len(chunks)
+            done = 0
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(shared.name, shared.shape, columns,
+                                               design, covariates)) as pool:
+                futures = {pool.submit(_fit_chunk, func, chunk, options): i
+                           for i, chunk in enumerate(chunks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    parts[i] = future.result()
+                    done += len(chunks[i])
+                    print(f"      {label or func.__name__}: {done}/{len(rows)} genes...",
+                          flush=True)
+        finally:
+            if owned:
+                shared.close()
+        result = pd.concat(parts, ignore_index=True)
+
+    result.index = (pd.Index(gene_ids, name='Gene') if gene_ids is not None
+                    else pd.RangeIndex(len(rows)))
+    return result
+
+
+def parallel_screen(matrix, design, rows=None, columns=None, covariates=None, gene_ids=None,
+                    p_threshold=SCREEN_P, top_n=None, workers=WORKERS,
+                    chunk_size=CHUNK_SIZE, **fit_options):
+    """
+    batch_cox.cox_screen with both stages (score test, exact refits) run
+    by parallel_cox; the refit selection is made over all genes at once.
+    """
+    if resolve_workers(workers) == 1:
+        array = matrix.array if isinstance(matrix, SharedMatrix) else np.asarray(matrix)
+        rows = slice(None) if rows is None else rows
+        columns = slice(None) if columns is None else columns
+        return cox_screen(array[rows][:, columns], design, covariates, gene_ids,
+                          p_threshold, top_n, **fit_options)
+    shared = matrix if isinstance(matrix, SharedMatrix) else SharedMatrix(matrix)
+    try:
+        array = shared.array
+        rows = np.arange(array.shape[0]) if rows is None else np.asarray(rows)
+        common = dict(columns=columns, covariates=covariates, workers=workers,
+                      chunk_size=chunk_size)
+        screen = parallel_cox(cox_score_test, shared, design, rows, label='score test',
+                              min_samples=fit_options.get('min_samples', 2), **common)
+        refit = screen_selection(screen['p_score'], p_threshold, top_n)
+        func = cox_univariate if covariates is None else cox_adjusted
+        fit = parallel_cox(func, shared, design, rows[refit], label='exact fits',
+                           **common, **fit_options)
+    finally:
+        if shared is not matrix:
+            shared.close()
+    return merge_screen(screen, fit, refit, gene_ids)
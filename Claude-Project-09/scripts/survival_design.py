@@ -0,0 +1,105 @@
+"""
+Survival Design
+Sorted times, tie groups and risk sets of one cohort / endpoint, built once
+
+Every Cox, log-rank and Kaplan-Meier computation over the same patients
+needs the same bookkeeping: patients ordered by time, the distinct event
+times, which patients are at risk at each of them and how many died. A
+SurvivalDesign holds all of it, so a screen over thousands of genes (or a
+rerun for each LymphGen subtype) sorts and groups the patients once instead
+of once per fit.
+
+Patients missing time or event are dropped when the design is built; the
+`kept` mask maps the input patients to the modelled ones. Arrays passed to
+the consumers (expression values, covariates) are given for the input
+patients, in input order.
+
+Claude-Project-06-v2/Lacy_HMRN/scripts and Claude-Project-09/scripts carry
+identical copies of this module and of survival_stats.py; change both.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class SurvivalDesign:
+    """Time-sorted order, distinct event times, risk sets and Efron rows of one cohort"""
+
+    def __init__(self, time, event, ids=None):
+        time = np.asarray(time, dtype=np.float64)
+        event = np.asarray(event, dtype=np.float64)
+        self.kept = ~(np.isnan(time) | np.isnan(event))
+        self.ids = pd.Index(ids)[self.kept] if ids is not None else None
+        # Modelled patients, input order (subset() rebuilds from these)
+        self.time_input = time[self.kept]
+        self.event_input = event[self.kept] > 0
+
+        self.order = np.argsort(self.time_input, kind='stable')
+        self.time = self.time_input[self.order]
+        self.event = self.event_input[self.order]
+        self.n = len(self.time)
+
+        # Positions of deaths (sorted order) and the distinct death time each belongs to
+        self.death_pos = np.flatnonzero(self.event)
+        self.event_times, self.death_group = np.unique(self.time[self.death_pos],
+                                                       return_inverse=True)
+        # Risk set of a death time: everyone with time >= t, i.e. from its first position on
+        self.first = np.searchsorted(self.time, self.event_times, side='left')
+        self.n_at_risk = self.n - self.first
+        self.n_deaths = np.bincount(self.death_group, minlength=len(self.event_times))
+        self.group_start = np.concatenate([[0], np.cumsum(self.n_deaths)[:-1]]).astype(np.int64)
+        # Efron: the l-th of d tied deaths removes l/d of the tied deaths' weight
+        self.row_group = np.repeat(np.arange(len(self.event_times)), self.n_deaths)
+        self.row_frac = ((np.arange(len(self.row_group)) - self.group_start[self.row_group])
+                         / self.n_deaths[self.row_group])
+
+    @classmethod
+    def from_frame(cls, frame, samples=None, time_col='OS_time_years', event_col='OS_status',
+                   id_col='Sample_ID'):
+        """
+        Design from a clinical table. `samples` selects and orders the
+        patients (e.g. the expression columns); default: all rows in order.
+        """
+        if samples is not None:
+            frame = frame.set_index(id_col).loc[list(samples)]
+            ids = frame.index
+        else:
+            ids = frame[id_col].values
+        return cls(frame[time_col].values, frame[event_col].values, ids=ids)
+
+    def subset(self, mask):
+        """Design of the modelled patients selected by `mask` (input order)"""
+        ids = self.ids[mask] if self.ids is not None else None
+        return SurvivalDesign(self.time_input[mask], self.event_input[mask], ids=ids)
+
+    @property
+    def n_events(self):
+        return len(self.death_pos)
+
+    def take(self, values):
+        """Rows of `values` (... x input patients) restricted to the modelled patients"""
+        return np.asarray(values, dtype=np.float64)[..., self.kept]
+
+    def sorted_rows(self, values):
+        """Rows of `values` (... x input patients) for the modelled patients, time-sorted"""
+        return np.asarray(values)[..., self.kept][..., self.order]
+
+    def at_risk(self, weights):
+        """Sum of `weights` (... x patients, time-sorted) over each event time's risk set"""
+        rev = np.cumsum(weights[..., ::-1], axis=-1)[..., ::-1]
+        return rev[..., self.first]
+
+    def deaths(self, weights):
+        """Sum of `weights` (... x patients, time-sorted) over each event time's deaths"""
+        if self.n_events == 0:
+            return np.zeros(weights.shape[:-1] + (0,))
+        return np.add.reduceat(weights[..., self.death_pos], self.group_start, axis=-1)
+
+    def risk_sums(self, a):
+        """
+        Efron-corrected risk-set sums of `a` (... x patients, time-sorted):
+        one value per death, (... x deaths).
+        """
+        rev = np.cumsum(a[..., ::-1], axis=-1)[..., ::-1]
+        dead = np.add.reduceat(a[..., self.death_pos], self.group_start, axis=-1)
+        return rev[..., self.first][..., self.row_group] - self.row_frac * dead[..., self.row_group]
@@ -0,0 +1,331 @@
+"""
+Batched Survival Statistics
+Log-rank tests, Kaplan-Meier curves and concordance for many columns over one SurvivalDesign
+
+A grouping - signature quartiles, risk tertiles, high vs low, the same
+split within one subtype (patients outside it left unlabelled) - is a
+column of group labels for the design's input patients. With the columns
+one-hot encoded as (columns x groups x patients) in the design's time
+order, at-risk and death counts per group at every event time are the
+design's risk-set and per-time sums, so the log-rank observed-minus-
+expected, hypergeometric covariance and chi-square of every column come
+from a few array operations, and so do the Kaplan-Meier curves of every
+group with their Greenwood variances, confidence limits and medians.
+
+Harrell's C of a score (a gene, a signature) counts, over comparable
+pairs - one patient died before the other left follow-up - how often the
+score orders them correctly. Walking the patients in time order with a
+Fenwick tree of the earlier deaths' score ranks, each patient's concordant
+and tied pairs are two prefix counts, O(n log n) per score instead of
+O(n^2); the walk is shared by a block of scores, each step one array
+operation across all of them.
+
+Statistics match lifelines' logrank_test / multivariate_logrank_test
+(k-group chi-square on k - 1 degrees of freedom), KaplanMeierFitter
+(exponential Greenwood "log-log" limits; a median is the first time the
+curve reaches 0.5, inf when not reached) and concordance_index (tied
+scores count 1/2; tied death times are not comparable, a censoring at a
+death time is).
+
+Claude-Project-06-v2/Lacy_HMRN/scripts and Claude-Project-09/scripts carry
+identical copies of this module and of survival_design.py (the projects
+are run separately and do not import from each other); change both.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Confidence level of Kaplan-Meier limits (lifelines default)
+KM_CI = 0.95
+
+# Scores per concordance block (memory: block x patients Fenwick trees)
+SCORE_BLOCK = 2048
+
+
+def _label_codes(labels, groups=None):
+    """
+    Integer codes (patients x columns, -1 = not in the test) and level names.
+    `groups` restricts (and orders) the levels; other labels are left out.
+    """
+    frame = labels.to_frame() if isinstance(labels, pd.Series) else pd.DataFrame(labels)
+    cols = [col.array for _, col in frame.items()]
+    categorical = [isinstance(col, pd.Categorical) for col in cols]
+    if groups is None:
+        found = set()
+        for col, is_cat in zip(cols, categorical):
+            found.update(col.categories if is_cat else pd.unique(np.asarray(col)[pd.notna(col)]))
+        levels = sorted(found, key=str)
+    else:
+        levels = list(groups)
+    lookup = pd.Index(levels, dtype=object)
+    codes = np.empty(frame.shape, dtype=np.int64)
+    remaps = {}
+    for j, (col, is_cat) in enumerate(zip(cols, categorical)):
+        if is_cat:
+            # Remap the category codes instead of comparing every label
+            key = tuple(col.categories)
+            if key not in remaps:
+                remaps[key] = np.append(lookup.get_indexer(col.categories.astype(object)), -1)
+            codes[:, j] = remaps[key][col.codes]
+        else:
+            codes[:, j] = lookup.get_indexer(np.asarray(col, dtype=object))
+    return codes, levels, list(frame.columns)
+
+
+def _membership(design, labels, groups=None):
+    """One-hot group membership (columns x levels x patients, time-sorted), levels, columns"""
+    codes, levels, columns = _label_codes(labels, groups)
+    codes = design.sorted_rows(codes.T)                       # columns x patients
+    member = (codes[:, None, :] == np.arange(len(levels))[None, :, None]).astype(np.float64)
+    return member, levels, columns
+
+
+def logrank_matrix(design, labels, groups=None):
+    """
+    Log-rank test of every column of `labels` in one pass over event times.
+
+    `labels` is a DataFrame (or Series) with one row per input patient of
+    `design` and one grouping per column; NaN (or, with `groups`, any label
+    not listed) leaves the patient out of that column's test, so e.g.
+    groups=['Low', 'High'] gives Low vs High. Returns one row per column: n,
+    events, n_groups, chi2, df, p_value, and observed / expected deaths per
+    level (O[level], E[level]).
+    """
+    member, levels, columns = _membership(design, labels, groups)
+    n_levels = len(levels)
+
+    at_risk = design.at_risk(member)                          # columns x levels x times
+    dead = design.deaths(member)
+    n_risk = at_risk.sum(axis=1)
+    n_dead = dead.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(n_risk[:, None, :] > 0, at_risk / n_risk[:, None, :], 0.0)
+        factor = np.where(n_risk > 1, n_dead * (n_risk - n_dead) / (n_risk - 1), 0.0)
+    observed = dead.sum(axis=-1)
+    expected = (n_dead[:, None, :] * share).sum(axis=-1)
+    # Hypergeometric covariance: sum_t f_t * (diag(p_t) - p_t p_t')
+    cov = (np.einsum('kt,kgt->kg', factor, share)[:, :, None] * np.eye(n_levels)
+           - np.einsum('kt,kgt,kht->kgh', factor, share, share))
+
+    # Generalized inverse: absent levels have zero rows, O - E sums to zero
+    diff = observed - expected
+    chi2 = np.einsum('kg,kgh,kh->k', diff, np.linalg.pinv(cov, hermitian=True), diff)
+    present = (member.sum(axis=-1) > 0).sum(axis=1)
+    df = present - 1
+    with np.errstate(invalid='ignore'):
+        p_value = np.where(df > 0, stats.chi2.sf(chi2, np.maximum(df, 1)), np.nan)
+        chi2 = np.where(df > 0, chi2, np.nan)
+
+    result = pd.DataFrame({'n': member.sum(axis=(1, 2)).astype(np.int64),
+                           'events': observed.sum(axis=1).astype(np.int64), 'n_groups': present, 'chi2': chi2, 'df': df, 'p_value': p_value},
+                          index=pd.Index(columns, name='Grouping'))
+    for i, level in enumerate(levels):
+        result[f'O[{level}]'] = observed[:, i]
+        result[f'E[{level}]'] = expected[:, i]
+    return result
+
+
+def _first_crossing(times, curves, q=0.5):
+    """First time each curve (... x times) is <= q; inf if it never is (or there are no times)"""
+    if len(times) == 0:
+        return np.full(curves.shape[:-1], np.inf)
+    hit = curves <= q
+    return np.where(hit.any(axis=-1), times[hit.argmax(axis=-1)], np.inf)
+
+
+class KaplanMeier:
+    """
+    Kaplan-Meier curves of every (grouping column, level), from kaplan_meier().
+
+    Curves are arrays (columns x levels x event times) over the design's
+    distinct event times `times`: survival, variance (Greenwood), lower /
+    upper confidence limits, at_risk and deaths; a curve stays flat after
+    its group's last follow-up (last_time). Per (column, level): n, events,
+    median and median_lower / median_upper (the medians of the limits),
+    inf = not reached, NaN for empty groups.
+    """
+
+    def __init__(self, columns, levels, times, survival, variance, lower, upper, at_risk,
+                 deaths, n, last_time, ci):
+        self.columns = list(columns)
+        self.levels = list(levels)
+        self.times = times
+        self.survival = survival
+        self.variance = variance
+        self.lower = lower
+        self.upper = upper
+        self.at_risk = at_risk
+        self.deaths = deaths
+        self.n = n
+        self.events = deaths.sum(axis=-1).astype(np.int64)
+        self.last_time = last_time
+        self.ci = ci
+
+        empty = n == 0
+        self.median = np.where(empty, np.nan, _first_crossing(times, survival))
+        # The lower limit reaches 0.5 first, giving the lower bound of the median
+        self.median_lower = np.where(empty, np.nan, _first_crossing(times, lower))
+        self.median_upper = np.where(empty, np.nan, _first_crossing(times, upper))
+
+    def _index(self, column, level):
+        return self.columns.index(column), self.levels.index(level)
+
+    def table(self):
+        """One row per non-empty (Grouping, Group): n, events, median and its confidence limits"""
+        index = pd.MultiIndex.from_product([self.columns, self.levels], names=['Grouping', 'Group'])
+        table = pd.DataFrame({'n': self.n.ravel().astype(np.int64), 'events': self.events.ravel(),
+                              'median': self.median.ravel(), 'median_lower': self.median_lower.ravel(),
+                              'median_upper': self.median_upper.ravel()}, index=index)
+        return table[table['n'] > 0]
+
+    def curve(self, column, level):
+        """
+        Step-function points (time, survival, lower, upper) of one group: time
+        0, each of its death times and its last follow-up (steps are 'post').
+        """
+        i, j = self._index(column, level)
+        steps = np.flatnonzero(self.deaths[i, j] > 0)
+        t = np.concatenate([[0.0], self.times[steps], [self.last_time[i, j]]])
+        points = [np.concatenate([[1.0], a[i, j, steps], a[i, j, steps[-1:]] if len(steps) else [1.0]])
+                  for a in (self.survival, self.lower, self.upper)]
+        return (t, *points)
+
+    def plot(self, ax, column, level, label=None, color=None, ci_show=True, **kwargs):
+        """Draw one group's curve (and shaded confidence band) on `ax`, as lifelines does"""
+        t, surv, lower, upper = self.curve(column, level)
+        line, = ax.step(t, surv, where='post', label=level if label is None else label,
+                        color=color, **kwargs)
+        if ci_show:
+            ax.fill_between(t, lower, upper, step='post', alpha=0.25, color=line.get_color(),
+                            linewidth=0)
+        return ax
+
+
+def kaplan_meier(design, labels, groups=None, ci=KM_CI):
+    """
+    Kaplan-Meier curves of every level of every column of `labels` (as in
+    logrank_matrix: one row per input patient of `design`, NaN = not in
+    that grouping), from one pass over the event times. Returns a
+    KaplanMeier with compact (columns x levels x event times) arrays.
+    """
+    member, levels, columns = _membership(design, labels, groups)
+    at_risk = design.at_risk(member)                          # columns x levels x times
+    dead = design.deaths(member)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Product-limit in log space; no one at risk leaves the curve flat
+        log_step = np.where(at_risk > 0, np.log(at_risk - dead) - np.log(at_risk), 0.0)
+        log_surv = np.cumsum(log_step, axis=-1)
+        survival = np.exp(log_surv)
+        # Greenwood: sum of d / (n (n - d)); the step where everyone dies adds nothing
+        greenwood = np.cumsum(np.where(at_risk > dead, dead / (at_risk * (at_risk - dead)), 0.0),
+                              axis=-1)
+        variance = survival ** 2 * greenwood
+        # Exponential Greenwood ("log-log") limits; undefined where S = 1 -> 1
+        z = stats.norm.ppf(0.5 + ci / 2)
+        spread = z * np.sqrt(greenwood) / log_surv
+        lower = np.nan_to_num(np.exp(-np.exp(np.log(-log_surv) - spread)), nan=1.0)
+        upper = np.nan_to_num(np.exp(-np.exp(np.log(-log_surv) + spread)), nan=1.0)
+
+    n = member.sum(axis=-1)
+    times = np.broadcast_to(design.time, member.shape)
+    last_time = np.where(n > 0, np.where(member > 0, times, -np.inf).max(axis=-1), np.nan)
+    return KaplanMeier(columns, levels, design.event_times, survival, variance, lower, upper,
+                       at_risk, dead, n, last_time, ci)
+
+
+def _dense_ranks(values):
+    """Dense ranks 1..m of each row, equal values sharing a rank; NaN -> 0"""
+    order = np.argsort(values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+    new = np.ones(ordered.shape, dtype=bool)
+    new[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ranks = np.empty(values.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.cumsum(new, axis=1), axis=1)
+    ranks[np.isnan(values)] = 0
+    return ranks
+
+
+def _fenwick_add(tree, offset, idx):
+    """Add 1 at ranks `idx` (rows x k, 0 = skip) of each row's Fenwick tree"""
+    size = tree.shape[1] - 1
+    flat = tree.reshape(-1)
+    # One column at a time: each row updates its own tree, so no index repeats
+    for col in idx.T:
+        col = col.copy()
+        while True:
+            live = (col > 0) & (col <= size)
+            if not live.any():
+                break
+            flat[(offset[:, 0] + col)[live]] += 1
+            col += col & -col
+
+
+def _fenwick_sum(tree, offset, idx):
+    """Count of inserted ranks <= `idx` (rows x ...) in each row's Fenwick tree"""
+    flat = tree.reshape(-1)
+    total = np.zeros(idx.shape, dtype=np.int64)
+    idx = idx.copy()
+    while idx.any():
+        total += flat.take(offset + idx)
+        idx &= idx - 1
+    return total
+
+
+def _concordance_block(design, ranks, compare_after):
+    """Concordant, tied and comparable pair counts of each row of `ranks` (time-sorted)"""
+    if design.n_events == 0:
+        # No deaths, no comparable pairs
+        return (np.zeros(ranks.shape[0], dtype=np.int64),) * 3
+    tree = np.zeros((ranks.shape[0], design.n + 1), dtype=np.int32)
+    # Start of each row's tree in the flattened array
+    offset = np.arange(ranks.shape[0])[:, None] * tree.shape[1]
+    concordant, tied, pairs, inserted = (np.zeros(ranks.shape[0], dtype=np.int64) for _ in range(4))
+    # Patients in order of the number of death times inserted before they are compared
+    by_batch = np.argsort(compare_after, kind='stable')
+    bounds = np.searchsorted(compare_after[by_batch], np.arange(len(design.event_times) + 2))
+    for k, start in enumerate(design.group_start, start=1):
+        died = ranks[:, design.death_pos[start:start + design.n_deaths[k - 1]]]
+        _fenwick_add(tree, offset, died)
+        inserted += (died > 0).sum(axis=1)
+
+        r = ranks[:, by_batch[bounds[k]:bounds[k + 1]]]
+        if r.shape[1] == 0:
+            continue
+        scored = r > 0
+        # Earlier deaths scored below / up to each patient's score, in one walk
+        below, upto = _fenwick_sum(tree, offset[:, :, None],
+                                   np.stack([np.maximum(r - 1, 0), r], axis=-1)).transpose(2, 0, 1)
+        concordant += np.where(scored, below, 0).sum(axis=1)
+        tied += np.where(scored, upto - below, 0).sum(axis=1)
+        pairs += inserted * scored.sum(axis=1)
+    return concordant, tied, pairs
+
+
+def concordance_matrix(design, scores, score_ids=None, risk=False, block_size=SCORE_BLOCK):
+    """
+    Harrell's C of every row of `scores` (scores x input patients of
+    `design`; a 1-D array is one score), as lifelines' concordance_index
+    with the score as predicted survival time. risk=True treats higher
+    scores as higher risk (a Cox linear predictor, a gene's expression
+    read as HR > 1), i.e. C of the negated score. NaN scores leave the
+    patient out of that row's pairs. Returns c_index, concordant, tied and
+    n_pairs per row (c_index NaN without comparable pairs).
+    """
+    values = design.take(np.atleast_2d(scores))[:, design.order]
+    if risk:
+        values = -values
+    # Deaths are compared with the deaths of earlier times, censorings also with their own time's
+    compare_after = np.searchsorted(design.event_times, design.time, side='right') - design.event
+
+    counts = np.zeros((3, len(values)), dtype=np.int64)
+    for start in range(0, len(values), block_size):
+        block = slice(start, start + block_size)
+        counts[:, block] = _concordance_block(design, _dense_ranks(values[block]), compare_after)
+    concordant, tied, pairs = counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c_index = np.where(pairs > 0, (concordant + 0.5 * tied) / pairs, np.nan)
+
+    index = pd.Index(score_ids) if score_ids is not None else pd.RangeIndex(len(values))
+    return pd.DataFrame({'c_index': c_index, 'concordant': concordant, 'tied': tied,
+                         'n_pairs': pairs}, index=index)
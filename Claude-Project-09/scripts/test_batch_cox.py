@@ -0,0 +1,82 @@
+"""Checks for batch_cox.py against lifelines and statsmodels (run with pytest from scripts/)"""
+
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter
+from statsmodels.duration.hazard_regression import PHReg
+
+from batch_cox import cox_adjusted, cox_score_test, cox_screen, cox_univariate
+from survival_design import SurvivalDesign
+
+
+def _cohort(seed=0, n=150, n_genes=6):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(n_genes, n))
+    # Gene 0 carries the hazard; rounded times give tied deaths (Efron)
+    time = rng.exponential(np.exp(-0.7 * values[0])).round(2) + 0.01
+    event = (rng.random(n) < 0.7).astype(float)
+    time[5] = np.nan
+    values[2, :4] = np.nan
+    ipi = rng.integers(0, 4, n).astype(float)
+    return values, time, event, ipi
+
+
+def _lifelines_fit(columns, time, event):
+    frame = pd.DataFrame({**columns, 'T': time, 'E': event}).dropna()
+    # Tight tolerance: lifelines' default stops ~1e-6 short of the optimum
+    return CoxPHFitter().fit(frame, duration_col='T', event_col='E',
+                             fit_options={'precision': 1e-12})
+
+
+def test_cox_univariate_matches_lifelines():
+    values, time, event, _ = _cohort()
+    result = cox_univariate(values, SurvivalDesign(time, event))
+    assert result['converged'].all()
+    for g in range(len(values)):
+        cph = _lifelines_fit({'x': values[g]}, time, event)
+        assert np.isclose(result['coef'][g], cph.params_['x'], atol=1e-6)
+        assert np.isclose(result['se'][g], cph.standard_errors_['x'], rtol=1e-5)
+        assert np.isclose(result['p_value'][g], cph.summary.loc['x', 'p'], rtol=1e-4)
+        assert np.isclose(result['log_likelihood'][g], cph.log_likelihood_)
+        assert result['n_samples'][g] == len(cph.durations)
+
+
+def test_cox_adjusted_matches_lifelines():
+    values, time, event, ipi = _cohort(1)
+    ipi[7] = np.nan
+    result = cox_adjusted(values, ipi[:, None], SurvivalDesign(time, event))
+    for g in range(len(values)):
+        cph = _lifelines_fit({'x': values[g], 'ipi': ipi}, time, event)
+        assert np.isclose(result['coef'][g], cph.params_['x'], atol=1e-6)
+        assert np.isclose(result['se'][g], cph.standard_errors_['x'], rtol=1e-5)
+        assert np.isclose(result['log_likelihood'][g], cph.log_likelihood_)
+
+
+def test_score_test_matches_statsmodels():
+    values, time, event, _ = _cohort(2)
+    result = cox_score_test(values, SurvivalDesign(time, event))
+    for g in range(len(values)):
+        ok = ~np.isnan(time) & ~np.isnan(values[g])
+        model = PHReg(time[ok], values[g, ok][:, None], status=event[ok], ties='efron')
+        score = model.score(np.zeros(1))[0]
+        info = -model.hessian(np.zeros(1))[0, 0]
+        assert np.isclose(result['z_score'][g], score / np.sqrt(info))
+
+
+def test_cox_screen_refits_only_hits():
+    values, time, event, _ = _cohort(3)
+    design = SurvivalDesign(time, event)
+    screen = cox_screen(values, design, p_threshold=0.05, top_n=2)
+    exact = cox_univariate(values, design)
+    refit = screen['refit'].to_numpy()
+    assert refit.sum() >= 2 and refit[0]
+    assert np.allclose(screen['coef'][refit], exact['coef'][refit])
+    assert screen['coef'][~refit].isna().all() and not screen['converged'][~refit].any()
+
+
+def test_no_deaths():
+    values, time, _, _ = _cohort(4)
+    design = SurvivalDesign(time, np.zeros(len(time)))
+    assert design.n_events == 0
+    result = cox_score_test(values, design)
+    assert result['p_score'].isna().all() and (result['n_events'] == 0).all()
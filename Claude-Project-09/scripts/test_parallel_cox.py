@@ -0,0 +1,56 @@
+"""Checks for parallel_cox.py (run with pytest from scripts/)"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_cox import cox_adjusted, cox_screen, cox_univariate
+from parallel_cox import SharedMatrix, parallel_cox, parallel_screen
+from survival_design import SurvivalDesign
+
+
+def _cohort(seed=0, n=80, n_genes=30):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(n_genes, n))
+    time = rng.exponential(np.exp(-0.5 * values[0])).round(2) + 0.01
+    event = (rng.random(n) < 0.7).astype(float)
+    values[4, :3] = np.nan
+    return values, time, event, rng.integers(0, 4, n).astype(float)
+
+
+def test_parallel_cox_matches_in_process_fit():
+    values, time, event, ipi = _cohort()
+    # Genes and patients by position, as the scripts select them from the shared matrix
+    rows, columns = np.arange(1, 30, 2), np.arange(5, 80)
+    design = SurvivalDesign(time[columns], event[columns])
+    covariates = ipi[columns, None]
+    with SharedMatrix(values) as shared:
+        pooled = parallel_cox(cox_adjusted, shared, design, rows, columns, covariates,
+                              gene_ids=[f"G{r}" for r in rows], workers=2, chunk_size=4)
+    expected = cox_adjusted(values[rows][:, columns], covariates, design)
+    assert list(pooled.index) == [f"G{r}" for r in rows]
+    pd.testing.assert_frame_equal(pooled.reset_index(drop=True), expected)
+
+
+def test_parallel_screen_matches_cox_screen():
+    values, time, event, _ = _cohort(1)
+    design = SurvivalDesign(time, event)
+    pooled = parallel_screen(values, design, top_n=5, workers=2, chunk_size=8)
+    expected = cox_screen(values, design, top_n=5)
+    pd.testing.assert_frame_equal(pooled, expected)
+    assert pooled['refit'].sum() >= 5
+    assert np.allclose(pooled['coef'][pooled['refit']],
+                       cox_univariate(values, design)['coef'][pooled['refit']])
+
+
+def test_shared_matrix_is_unlinked_on_error():
+    values, _, _, _ = _cohort(2)
+    with pytest.raises(RuntimeError):
+        with SharedMatrix(values) as shared:
+            name = shared.name
+            assert np.array_equal(shared.array, values, equal_nan=True)
+            raise RuntimeError("screen failed")
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,80 @@
+"""Checks for survival_stats.py against lifelines (run with pytest from scripts/)"""
+
+import numpy as np
+import pandas as pd
+from lifelines import KaplanMeierFitter
+from lifelines.statistics import logrank_test, multivariate_logrank_test
+from lifelines.utils import concordance_index
+
+from survival_design import SurvivalDesign
+from survival_stats import concordance_matrix, kaplan_meier, logrank_matrix
+
+
+def _cohort(seed=0, n=120):
+    rng = np.random.default_rng(seed)
+    # Rounded times give tied deaths and censorings at death times
+    time = rng.exponential(5, n).round(1)
+    event = rng.integers(0, 2, n).astype(float)
+    time[3] = np.nan
+    labels = pd.DataFrame({'tertile': rng.choice(['Low', 'Mid', 'High'], n),
+                           'half': rng.choice(['Low', 'High', None], n)})
+    return rng, time, event, labels
+
+
+def test_logrank_matches_lifelines():
+    _, time, event, labels = _cohort()
+    result = logrank_matrix(SurvivalDesign(time, event), labels)
+    ok = ~np.isnan(time)
+
+    k_group = multivariate_logrank_test(time[ok], labels['tertile'][ok], event[ok])
+    assert np.isclose(result.loc['tertile', 'chi2'], k_group.test_statistic)
+    assert np.isclose(result.loc['tertile', 'p_value'], k_group.p_value)
+
+    low, high = ok & (labels['half'] == 'Low'), ok & (labels['half'] == 'High')
+    two_group = logrank_test(time[low], time[high], event[low], event[high])
+    assert result.loc['half', 'n'] == low.sum() + high.sum()
+    assert np.isclose(result.loc['half', 'p_value'], two_group.p_value)
+
+
+def test_kaplan_meier_matches_lifelines():
+    _, time, event, labels = _cohort(1)
+    km = kaplan_meier(SurvivalDesign(time, event), labels)
+    for level in ('Low', 'Mid', 'High'):
+        mask = ~np.isnan(time) & (labels['tertile'] == level).to_numpy()
+        kmf = KaplanMeierFitter().fit(time[mask], event[mask])
+        i, j = km._index('tertile', level)
+        expected = kmf.survival_function_at_times(km.times).to_numpy()
+        assert np.allclose(km.survival[i, j], expected)
+        ci = kmf.confidence_interval_.reindex(km.times, method='ffill')
+        assert np.allclose(km.lower[i, j], ci.iloc[:, 0]) and np.allclose(km.upper[i, j], ci.iloc[:, 1])
+        assert km.median[i, j] == kmf.median_survival_time_
+
+
+def test_concordance_matches_lifelines():
+    rng, time, event, _ = _cohort(2)
+    scores = rng.normal(size=(20, len(time)))
+    scores[:5] = scores[:5].round(0)          # tied scores
+    scores[6, 10] = np.nan
+    result = concordance_matrix(SurvivalDesign(time, event), scores, block_size=7)
+    for g in range(len(scores)):
+        ok = ~np.isnan(time) & ~np.isnan(scores[g])
+        assert np.isclose(result['c_index'][g], concordance_index(time[ok], scores[g, ok], event[ok]))
+
+    risk = concordance_matrix(SurvivalDesign(time, event), scores[7], risk=True)
+    ok = ~np.isnan(time)
+    assert np.isclose(risk['c_index'][0], concordance_index(time[ok], -scores[7, ok], event[ok]))
+
+
+def test_no_deaths():
+    _, time, _, labels = _cohort(3)
+    design = SurvivalDesign(time, np.zeros(len(time)))
+
+    km = kaplan_meier(design, labels)
+    assert np.isinf(km.table()['median']).all()
+    assert (km.table()['events'] == 0).all()
+
+    logrank = logrank_matrix(design, labels)
+    assert (logrank['events'] == 0).all()
+
+    concordance = concordance_matrix(design, np.ones((2, len(time))))
+    assert concordance['c_index'].isna().all() and (concordance['n_pairs'] == 0).all()